@@ -0,0 +1,128 @@
+import json
+import logging
+from telegram import Update
+import main
+from dispatcher import UpdateDispatcher
+
+logger = logging.getLogger(__name__)
+
+class WebhookApp:
+    """Minimal ASGI ingress for the webhook.
+
+    Runs on the same event loop as the bot application: an update is parsed,
+    queued and acknowledged straight away. When the dispatcher queue is full the
+    request is refused with 503 so Telegram retries later instead of the process
+    buffering without bound.
+    """
+
+    RETRY_AFTER_SECONDS = 1
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.handle_http(scope, receive, send)
+    
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                    await send({"type": "lifespan.startup.complete"})
+                except Exception as e:
+                    logger.error(f"Error starting ASGI app: {e}")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    
+    async def startup(self):
+        main.create_bot_application()
+        logger.info("Bot application created")
+        
+        main.dispatcher = UpdateDispatcher(
+            main.bot_app, on_startup=[main.bot_handlers.start], on_shutdown=[main.bot_handlers.close]
+        )
+        await main.dispatcher.start_async()
+        
+        await main.register_webhook()
+    
+    async def shutdown(self):
+        if main.dispatcher:
+            await main.dispatcher.stop_async()
+        if main.database:
+            main.database.close()
+    
+    async def handle_http(self, scope, receive, send):
+        path = scope["path"]
+        method = scope["method"]
+        
+        if path == "/webhook":
+            if method != "POST":
+                await self.send_json(send, 405, {"status": "error", "message": "Method not allowed"})
+                return
+            await self.webhook(receive, send)
+        elif path == "/health" and method == "GET":
+            await self.send_json(send, 200, {"status": "healthy", "service": "anonymous_dating_bot"})
+        elif path == "/metrics" and method == "GET":
+            await self.send_json(send, 200, main.collect_metrics())
+        elif path == "/" and method == "GET":
+            await self.send_json(send, 200, {
+                "message": "Anonymous Dating Telegram Bot",
+                "status": "running",
+                "endpoints": {
+                    "webhook": "/webhook",
+                    "health": "/health",
+                    "metrics": "/metrics"
+                }
+            })
+        else:
+            await self.send_json(send, 404, {"status": "error", "message": "Not found"})
+    
+    async def webhook(self, receive, send):
+        """Handle incoming webhook requests from Telegram"""
+        # Shed load before reading and parsing the body
+        if main.dispatcher.reject_if_full():
+            await self.send_busy(send)
+            return
+        
+        try:
+            json_data = json.loads(await self.read_body(receive) or b"null")
+            if json_data:
+                update = Update.de_json(json_data, main.bot_app.bot)
+                if not main.dispatcher.submit(update):
+                    await self.send_busy(send)
+                    return
+            
+            await self.send_json(send, 200, {"status": "ok"})
+        except Exception as e:
+            logger.error(f"Error processing webhook: {e}")
+            await self.send_json(send, 500, {"status": "error", "message": str(e)})
+    
+    async def read_body(self, receive):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+    
+    async def send_busy(self, send):
+        await self.send_json(
+            send, 503, {"status": "busy"},
+            headers=[(b"retry-after", str(self.RETRY_AFTER_SECONDS).encode())]
+        )
+    
+    async def send_json(self, send, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+app = WebhookApp()
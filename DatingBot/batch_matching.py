@@ -0,0 +1,24 @@
+"""Pairing a whole batch of waiting users at once.
+
+One-at-a-time matching hands the best partner to whoever asks first. A batch
+round instead scores every compatible pair among the candidates, then takes
+pairs greedily by score: the highest-scoring pair first, then the best pair
+among the remaining users, and so on. That is a 1/2-approximation of the
+maximum-weight matching and runs in O(E log E) for E candidate pairs.
+"""
+
+def greedy_pairs(edges):
+    """Pick disjoint pairs from (score, user_a, user_b) edges, best score first.
+
+    Edges must already be in priority order for ties (e.g. longest waiting
+    first); the sort is stable. Returns [(user_a, user_b, score)].
+    """
+    used = set()
+    pairs = []
+    for score, user_a, user_b in sorted(edges, key=lambda edge: edge[0], reverse=True):
+        if user_a in used or user_b in used:
+            continue
+        used.add(user_a)
+        used.add(user_b)
+        pairs.append((user_a, user_b, score))
+    return pairs
@@ -0,0 +1,113 @@
+"""Vectorized compatibility scoring over columnar copies of the matching pool.
+
+NumPy is optional: without it MatchingPool keeps scoring candidates one by
+one with MatchingService.calculate_compatibility_score. Scores here must stay
+identical to that function.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAVE_NUMPY = np is not None
+
+class CandidateColumns:
+    """Pool entries of one (gender, looking_for) pair as parallel arrays.
+    
+    Rows of removed users are marked dead and reused, so adds and removes are
+    O(1) and a scoring pass never copies the arrays.
+    """
+
+    _COLUMNS = (("user_ids", "int64"), ("ages", "int16"), ("min_ages", "int16"), ("max_ages", "int16"),
+                ("city_ids", "int32"), ("bio_lengths", "int32"), ("alive", "bool"))
+    
+    def __init__(self, capacity=1024):
+        for name, dtype in self._COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype))
+        self._rows = {}  # user_id -> row
+        self._free = []
+        self.size = 0  # Rows ever used; everything past it is unused
+    
+    def __len__(self):
+        return len(self._rows)
+    
+    def _next_row(self):
+        if self._free:
+            return self._free.pop()
+        if self.size == len(self.user_ids):
+            for name, _ in self._COLUMNS:
+                old = getattr(self, name)
+                new = np.zeros(len(old) * 2, old.dtype)
+                new[:len(old)] = old
+                setattr(self, name, new)
+        self.size += 1
+        return self.size - 1
+    
+    def add(self, entry, city_id):
+        row = self._rows.get(entry.user_id)
+        if row is None:
+            row = self._next_row()
+            self._rows[entry.user_id] = row
+        
+        self.user_ids[row] = entry.user_id
+        self.ages[row] = entry.age
+        self.min_ages[row] = entry.min_age
+        self.max_ages[row] = entry.max_age
+        self.city_ids[row] = city_id
+        self.bio_lengths[row] = entry.bio_length
+        self.alive[row] = True
+    
+    def remove(self, user_id):
+        row = self._rows.pop(user_id, None)
+        if row is not None:
+            self.alive[row] = False
+            self._free.append(row)
+
+def top_k(columns, seeker, seeker_city_id, exclude_ids, interest_postings, k):
+    """Score every compatible row in one pass and return the best k.
+    
+    interest_postings holds, for each of the seeker's interest tokens, an
+    array of the user ids that share it. Returns (user_ids, scores), best
+    first.
+    """
+    n = columns.size
+    ages = columns.ages[:n]
+    mask = columns.alive[:n] & (ages >= seeker.min_age) & (ages <= seeker.max_age)
+    mask &= (columns.min_ages[:n] <= seeker.age) & (columns.max_ages[:n] >= seeker.age)
+    rows = np.flatnonzero(mask)
+    if exclude_ids and rows.size:
+        excluded = np.fromiter(exclude_ids, np.int64, len(exclude_ids))
+        rows = rows[~np.isin(columns.user_ids[rows], excluded)]
+    if not rows.size:
+        return [], []
+    
+    user_ids = columns.user_ids[rows]
+    
+    # Base score for meeting basic criteria
+    scores = np.full(rows.size, 50, np.int32)
+    
+    # City bonus
+    if seeker_city_id:
+        scores += 20 * (columns.city_ids[rows] == seeker_city_id)
+    
+    # Age compatibility bonus
+    age_diff = np.abs(columns.ages[rows].astype(np.int32) - seeker.age)
+    scores += np.select([age_diff <= 2, age_diff <= 5, age_diff <= 10], [15, 10, 5], 0).astype(np.int32)
+    
+    # 5 points per common interest
+    for posting in interest_postings:
+        scores += 5 * np.isin(user_ids, posting, assume_unique=True)
+    
+    # Bio length bonus
+    if seeker.bio_length > 20:
+        scores += 10 * (columns.bio_lengths[rows] > 20)
+    
+    np.minimum(scores, 100, out=scores)
+    
+    # Only the best k are needed: partition, then sort just those
+    if rows.size > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(rows.size)
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return user_ids[top].tolist(), scores[top].tolist()
@@ -0,0 +1,83 @@
+"""Multi-worker scaling: load-test throughput at 1, 2, 4, ... worker processes.
+
+Runs benchmarks/load_test.py once per worker count (each run in its own
+process, on a fresh database) and compares updates/s per phase against the
+single-process run:
+
+  speedup     updates/s relative to --workers 1 (single-process mode)
+  efficiency  speedup / workers; near 1.0 is linear scaling
+
+Scaling is bounded by the cores available to the workers, and the load
+generator and stub Bot API share the machine with them, so use a host with
+more cores than the largest worker count. Multi-worker mode needs Postgres
+(SQLite can't lock users across processes), so --database-url is required
+for worker counts above 1; each run starts with --reset.
+
+Usage:
+    python benchmarks/cluster_bench.py [--workers 1,2,4] [--pairs 200] [--messages 10]
+        [--concurrency 64] --database-url postgresql://localhost/dating_bench [--json out.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+LOAD_TEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_test.py")
+
+PHASES = ("register", "chat")
+
+def run_load_test(workers, args):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        out = f.name
+    command = [sys.executable, LOAD_TEST, "--workers", str(workers), "--pairs", str(args.pairs),
+               "--messages", str(args.messages), "--concurrency", str(args.concurrency), "--json", out]
+    if args.database_url:
+        command += ["--database-url", args.database_url, "--reset"]
+    try:
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(out) as f:
+            return {phase["phase"]: phase for phase in json.load(f)["phases"]}
+    finally:
+        os.unlink(out)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--json", dest="json_path", help="also write the results as JSON")
+    args = parser.parse_args()
+    
+    counts = [int(n) for n in args.workers.split(",")]
+    if max(counts) > 1 and not (args.database_url or "").startswith("postgresql"):
+        parser.error("worker counts above 1 need --database-url pointing at Postgres")
+    cores = os.cpu_count() or 1
+    if max(counts) >= cores:
+        print(f"Note: {cores} CPU core(s) for up to {max(counts)} workers plus the load generator; "
+              "scaling will flatten once workers outnumber free cores")
+    
+    results = {workers: run_load_test(workers, args) for workers in counts}
+    baseline = results[counts[0]]
+    
+    print(f"{'workers':>8} " + " ".join(f"{phase + ' upd/s':>14} {'speedup':>8} {'eff':>5}" for phase in PHASES)
+          + f" {'chat p95 ms':>12} {'timeouts':>9}")
+    for workers in counts:
+        cells = []
+        for phase in PHASES:
+            rate = results[workers][phase]["updates_per_s"]
+            speedup = rate / baseline[phase]["updates_per_s"] if baseline[phase]["updates_per_s"] else 0.0
+            cells.append(f"{rate:>14.1f} {speedup:>7.2f}x {speedup / workers * counts[0]:>5.2f}")
+        timeouts = sum(phase["timeouts"] for phase in results[workers].values())
+        print(f"{workers:>8} " + " ".join(cells) + f" {results[workers]['chat']['p95_ms']:>12} {timeouts:>9}")
+    
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"cores": cores, "pairs": args.pairs, "messages": args.messages,
+                       "results": {str(workers): phases for workers, phases in results.items()}}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
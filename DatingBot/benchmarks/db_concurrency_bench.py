@@ -0,0 +1,101 @@
+"""Concurrent-update throughput with blocking vs. executor-backed database access.
+
+Runs a message relay transaction (route lookup plus Message insert and commit)
+for many matched pairs at once, each followed by a simulated Telegram send:
+
+  blocking  - the transaction runs inline on the event loop (the old handlers)
+  executor  - the transaction runs on the DatabaseExecutor thread pool
+
+Usage:
+    python benchmarks/db_concurrency_bench.py [--pairs 50] [--messages 20]
+        [--send-latency-ms 30] [--db-latency-ms 1] [--database-url sqlite:///bench.db]
+
+--db-latency-ms adds a sleep per statement to emulate the network round trip to
+a remote database server.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from models import db, User, UserProfile, Match, Message, Gender, MatchStatus
+from database import DatabaseExecutor
+from bot_handlers import BotHandlers
+
+def seed(engine, pairs):
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    database = DatabaseExecutor(engine, max_workers=1)
+    
+    def _seed(session):
+        for i in range(pairs):
+            users = []
+            for j, gender in enumerate((Gender.MALE, Gender.FEMALE)):
+                user = User(telegram_id=str(i * 2 + j + 1), is_registered=True)
+                user.profile = UserProfile(age=25, gender=gender, looking_for=Gender.FEMALE if j == 0 else Gender.MALE)
+                session.add(user)
+                users.append(user)
+            session.flush()
+            session.add(Match(
+                user1_id=users[0].id, user2_id=users[1].id, status=MatchStatus.ACTIVE,
+                anonymous_id_1=f"UserA{i}", anonymous_id_2=f"UserB{i}"
+            ))
+        session.commit()
+    
+    database.run_sync(_seed)
+    database.close()
+
+def relay_tx(session, handlers, telegram_id, text):
+    _, route = handlers._lookup_route_tx(session, telegram_id)
+    session.add(Message(match_id=route.match_id, sender_id=route.user_id, receiver_id=route.partner_id, content=text))
+    session.commit()
+
+async def run_mode(handlers, database, mode, pairs, messages, send_latency):
+    async def sender(telegram_id):
+        for n in range(messages):
+            if mode == "blocking":
+                database.run_sync(relay_tx, handlers, telegram_id, f"message {n}")
+            else:
+                await database.run(relay_tx, handlers, telegram_id, f"message {n}")
+            await asyncio.sleep(send_latency)  # Telegram sendMessage
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(str(i * 2 + 1)) for i in range(pairs)))
+    elapsed = time.perf_counter() - started
+    return pairs * messages / elapsed, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--send-latency-ms", type=float, default=30)
+    parser.add_argument("--db-latency-ms", type=float, default=1)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    
+    url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    engine = create_engine(url)
+    
+    if args.db_latency_ms:
+        @event.listens_for(engine, "before_cursor_execute")
+        def _latency(*_):
+            time.sleep(args.db_latency_ms / 1000)
+    
+    print(f"{args.pairs} pairs x {args.messages} messages, send latency {args.send_latency_ms}ms, "
+          f"db latency {args.db_latency_ms}ms, {url.split(':')[0]}")
+    for mode in ("blocking", "executor"):
+        seed(engine, args.pairs)
+        database = DatabaseExecutor(engine, max_workers=args.workers)
+        handlers = BotHandlers(database, bot=None)
+        rate, elapsed = asyncio.run(run_mode(handlers, database, mode, args.pairs, args.messages, args.send_latency_ms / 1000))
+        database.close()
+        print(f"  {mode:<9} {rate:8.1f} updates/s  ({elapsed:.2f}s)")
+
+if __name__ == "__main__":
+    main()
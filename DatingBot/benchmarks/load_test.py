@@ -0,0 +1,261 @@
+"""End-to-end load test of the webhook against a stub Bot API.
+
+Starts main.app (Flask mode, with the update dispatcher) on a local port,
+pointed at benchmarks/stub_bot_api.py instead of api.telegram.org, then runs
+synthetic users through the whole flow by POSTing update JSON to /webhook:
+
+  register  /start -> setup profile -> gender -> looking for -> age, bio, interests, city
+  match     /match (one side of each pair)
+  chat      every user sends --messages messages to their partner
+  stop      /stop_chat
+
+Each step waits for the bot's answer to reach the stub; its end-to-end latency
+is the time from POST to that answer. Reports p50/p95/p99 latency, updates/s
+and database statements per phase.
+
+Usage:
+    python benchmarks/load_test.py [--pairs 50] [--messages 5] [--concurrency 32] [--workers 1]
+        [--database-url postgresql://localhost/dating_bench --reset] [--telegram-limits] [--json out.json]
+
+Runs offline; defaults to a temporary SQLite file. By default outbound rate
+limits are lifted so the bot itself is measured; --telegram-limits keeps the
+production limits. With --workers N the bot runs in multi-worker mode (a front
+process routing updates to N forked worker processes), which needs Postgres;
+database statements are then not counted, since they happen in the workers.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_bot_api import StubBotAPI, BOT_USER
+
+INTERESTS = ["music", "movies", "hiking", "cooking", "travel", "gaming", "reading", "art", "sports", "yoga"]
+CITIES = ["Paris", "London", "Berlin", "Madrid", "Rome", "Lisbon"]
+
+class SyntheticUser:
+    def __init__(self, telegram_id, gender, looking_for):
+        self.id = telegram_id
+        self.gender = gender
+        self.looking_for = looking_for
+        self.age = random.randint(20, 40)
+        self.interests = ", ".join(random.sample(INTERESTS, 3))
+        self.city = random.choice(CITIES)
+    
+    def as_dict(self):
+        return {"id": self.id, "is_bot": False, "first_name": f"Load{self.id}", "username": f"load{self.id}"}
+
+class LoadTest:
+    def __init__(self, stub, webhook_url, timeout):
+        self.stub = stub
+        self.webhook_url = webhook_url
+        self.timeout = timeout
+        self._update_ids = itertools.count(1)
+        self._markers = itertools.count(1)
+        self._lock = threading.Lock()
+    
+    def message_update(self, user, text):
+        message = {"message_id": next(self._update_ids), "date": int(time.time()),
+                   "chat": {"id": user.id, "type": "private"}, "from": user.as_dict(), "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+    
+    def callback_update(self, user, data):
+        update_id = next(self._update_ids)
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user.as_dict(), "chat_instance": str(user.id), "data": data,
+            "message": {"message_id": update_id, "date": int(time.time()),
+                        "chat": {"id": user.id, "type": "private"}, "from": BOT_USER, "text": "menu"}
+        }}
+    
+    def post(self, update):
+        request = urllib.request.Request(
+            self.webhook_url, data=json.dumps(update).encode(), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+    
+    def step(self, user, update, predicate=None):
+        """POST one update and wait for the bot's answer. Returns latency in seconds, or None on timeout."""
+        seen = self.stub.count(user.id)
+        if predicate is None:
+            predicate = lambda: self.stub.count(user.id) > seen
+        
+        started = time.monotonic()
+        self.post(update)
+        if not self.stub.wait_for(predicate, self.timeout):
+            return None
+        return time.monotonic() - started
+    
+    def register(self, user):
+        latencies = [self.step(user, self.message_update(user, "/start"))]
+        for data in ("setup_profile", f"gender_{user.gender}", f"looking_{user.looking_for}"):
+            latencies.append(self.step(user, self.callback_update(user, data)))
+        for text in (str(user.age), "I enjoy long walks and good conversation", user.interests, user.city):
+            latencies.append(self.step(user, self.message_update(user, text)))
+        return latencies
+    
+    def match(self, user):
+        return [self.step(user, self.message_update(user, "/match"))]
+    
+    def chat(self, user, messages):
+        latencies = []
+        for _ in range(messages):
+            marker = f"#lt{next(self._markers)}"
+            seen = self.stub.count(user.id)
+            
+            def relayed_or_refused():
+                if marker in self.stub.markers:
+                    return True
+                return any("not currently matched" in text for *_, text in self.stub.messages_since(user.id, seen))
+            
+            latencies.append(self.step(user, self.message_update(user, f"hey there {marker}"), relayed_or_refused))
+        return latencies
+    
+    def stop(self, user):
+        return [self.step(user, self.message_update(user, "/stop_chat"))]
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+    
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run_phase(name, test, users, flow, concurrency, queries):
+    queries_before = queries.count if queries else 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(flow, users))
+    duration = time.monotonic() - started
+    
+    latencies = [l for result in results for l in result if l is not None]
+    timeouts = sum(1 for result in results for l in result if l is None)
+    updates = len(latencies) + timeouts
+    db_queries = queries.count - queries_before if queries else None
+    return {
+        "phase": name,
+        "updates": updates,
+        "timeouts": timeouts,
+        "duration_s": round(duration, 3),
+        "updates_per_s": round(updates / duration, 1) if duration else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+        "db_queries": db_queries,
+        "db_queries_per_update": round(db_queries / updates, 2) if updates and db_queries is not None else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=15)
+    parser.add_argument("--workers", type=int, default=1, help="bot worker processes (multi-worker mode when > 1)")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep production outbound rate limits")
+    parser.add_argument("--json", dest="json_path", help="also write the results as JSON")
+    args = parser.parse_args()
+    
+    if args.workers > 1 and not (args.database_url or "").startswith("postgresql"):
+        parser.error("--workers > 1 needs --database-url pointing at Postgres (SQLite can't lock users across processes)")
+    
+    stub = StubBotAPI().start()
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load_test.db')}"
+    
+    # main.py and Config read the environment at import time
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:LOADTEST",
+        "TELEGRAM_API_URL": stub.url,
+        "DATABASE_URL": database_url,
+        "WEBHOOK_URL": "",
+        "LOG_LEVEL": "WARNING",
+        "MAX_MESSAGES_PER_MINUTE": "1000000",  # Limiter still runs, but synthetic users chat faster than people
+    })
+    if not args.telegram_limits:
+        os.environ.update({"OUTBOUND_GLOBAL_RATE": "100000", "OUTBOUND_PER_CHAT_RATE": "100000",
+                           "OUTBOUND_PER_CHAT_BURST": "100000"})
+    
+    import logging
+    import main as bot
+    from werkzeug.serving import make_server
+    for name in ("", "werkzeug", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    
+    if args.reset:
+        with bot.app.app_context():
+            bot.db.drop_all()
+    bot.init_database()
+    queries = None
+    if args.workers > 1:
+        bot.start_cluster(args.workers)
+    else:
+        with bot.app.app_context():
+            bot.start_bot()
+        queries = QueryCounter(bot.database.engine)
+    
+    server = make_server("127.0.0.1", 0, bot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test = LoadTest(stub, f"http://127.0.0.1:{server.server_port}/webhook", args.timeout)
+    
+    # Telegram ids well away from real ones and from previous runs
+    base_id = random.randint(10 ** 12, 2 * 10 ** 12)
+    men = [SyntheticUser(base_id + i * 2, "male", "female") for i in range(args.pairs)]
+    women = [SyntheticUser(base_id + i * 2 + 1, "female", "male") for i in range(args.pairs)]
+    everyone = men + women
+    
+    results = []
+    try:
+        results.append(run_phase("register", test, everyone, test.register, args.concurrency, queries))
+        results.append(run_phase("match", test, men, test.match, args.concurrency, queries))
+        results.append(run_phase("chat", test, everyone, lambda u: test.chat(u, args.messages), args.concurrency, queries))
+        results.append(run_phase("stop", test, men, test.stop, args.concurrency, queries))
+    finally:
+        server.shutdown()
+        metrics = bot.collect_metrics()
+        if bot.cluster:
+            bot.stop_cluster()
+        else:
+            bot.stop_bot()
+        stub.stop()
+    
+    print(f"{args.pairs} pairs, {args.messages} messages each, {database_url.split(':')[0]}, {args.workers} worker(s)")
+    print(f"{'phase':<10}{'updates':>8}{'timeouts':>9}{'upd/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'q/upd':>7}")
+    for r in results:
+        queries_text = [value if value is not None else "-" for value in (r['db_queries'], r['db_queries_per_update'])]
+        print(f"{r['phase']:<10}{r['updates']:>8}{r['timeouts']:>9}{r['updates_per_s']:>9}{r['p50_ms']:>9}"
+              f"{r['p95_ms']:>9}{r['p99_ms']:>9}{queries_text[0]:>9}{queries_text[1]:>7}")
+    print(f"metrics: {json.dumps(metrics)}")
+    
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"pairs": args.pairs, "messages": args.messages, "database": database_url.split(':')[0],
+                       "workers": args.workers, "phases": results, "metrics": metrics}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Concurrent /match stress test: no user may end up in two active matches.
+
+Seeds many seekers competing for a few partners, then runs every seeker's
+find_match at once on the DatabaseExecutor pool. Afterwards it counts active
+matches per user straight from the database and exits with status 1 if any
+user has more than one.
+
+Usage:
+    python benchmarks/match_race_stress.py [--seekers 300] [--partners 60]
+        [--rounds 3] [--workers 16] [--database-url postgresql://...]
+
+--database-url runs against Postgres, exercising SELECT ... FOR UPDATE SKIP
+LOCKED; the default is a temporary SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, union_all
+from models import db, User, UserProfile, Match, Gender, MatchStatus
+from database import DatabaseExecutor
+from matching_service import MatchingService
+
+def seed(session, seekers, partners):
+    for i in range(seekers + partners):
+        is_seeker = i < seekers
+        user = User(telegram_id=str(500000 + i), is_registered=True)
+        user.profile = UserProfile(
+            age=25 + i % 10,
+            gender=Gender.MALE if is_seeker else Gender.FEMALE,
+            looking_for=Gender.FEMALE if is_seeker else Gender.MALE,
+        )
+        session.add(user)
+    session.commit()
+    return [user_id for (user_id,) in session.query(User.id).join(UserProfile).filter(
+        UserProfile.gender == Gender.MALE
+    ).order_by(User.id)]
+
+def active_matches_per_user(session):
+    """{user_id: number of ACTIVE matches} for users with more than one"""
+    sides = union_all(
+        session.query(Match.user1_id.label("user_id")).filter(Match.status == MatchStatus.ACTIVE),
+        session.query(Match.user2_id.label("user_id")).filter(Match.status == MatchStatus.ACTIVE),
+    ).subquery()
+    rows = session.query(sides.c.user_id, func.count()).group_by(sides.c.user_id).having(func.count() > 1)
+    return dict(rows.all())
+
+def end_all_matches(session):
+    count = session.query(Match).filter(Match.status == MatchStatus.ACTIVE).update(
+        {Match.status: MatchStatus.ENDED}, synchronize_session=False
+    )
+    session.commit()
+    return count
+
+async def run_round(service, seeker_ids):
+    started = time.perf_counter()
+    matches = await asyncio.gather(*(service.find_match(user_id) for user_id in seeker_ids))
+    return [match for match in matches if match], time.perf_counter() - started
+
+async def main_async(args):
+    if args.database_url:
+        engine = create_engine(args.database_url, pool_size=args.workers, max_overflow=0)
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "match_race.db")
+        engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30})
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+
+    database = DatabaseExecutor(engine, max_workers=args.workers)
+    service = MatchingService(database)
+    seeker_ids = database.run_sync(seed, args.seekers, args.partners)
+
+    print(f"{engine.dialect.name}: {args.seekers} seekers, {args.partners} partners, {args.workers} workers")
+    print(f"{'round':>5} {'matches':>8} {'seconds':>8} {'conflicts':>10} {'double-assigned':>16}")
+
+    failed = False
+    for round_number in range(1, args.rounds + 1):
+        # Start every round from a full pool; recent-match exclusion keeps rounds from repeating pairs
+        database.run_sync(service.pool.rebuild)
+        conflicts_before = service.claims.conflicts
+
+        matches, elapsed = await run_round(service, seeker_ids)
+        doubles = database.run_sync(active_matches_per_user)
+        failed = failed or bool(doubles)
+
+        print(f"{round_number:>5} {len(matches):>8} {elapsed:>8.2f} {service.claims.conflicts - conflicts_before:>10} {len(doubles):>16}")
+        if doubles:
+            print(f"      users in more than one active match: {doubles}")
+
+        database.run_sync(end_all_matches)
+
+    database.close()
+    print("FAILED: double assignments found" if failed else "OK: no user was matched twice")
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seekers", type=int, default=300)
+    parser.add_argument("--partners", type=int, default=60)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+if __name__ == "__main__":
+    main()
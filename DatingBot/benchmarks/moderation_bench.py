@@ -0,0 +1,141 @@
+"""Content moderation: per-pattern scans vs. the compiled ModerationEngine.
+
+Generates a synthetic chat corpus (mostly clean small talk, with a share of
+messages carrying a rule hit: profanity, contact details, phone numbers,
+handles) and checks every message three ways:
+
+  legacy     - the old is_appropriate_content: seven re.search calls per text
+  fallback   - ModerationEngine without pyahocorasick: word rules looked up
+               per token, the rest in one combined regex
+  automaton  - ModerationEngine with literals in an Aho-Corasick automaton
+               (needs pyahocorasick) plus the combined regex for the rest
+
+All three must give the same verdict for every message; the run fails
+otherwise. --extra-words adds that many synthetic word rules to the rule
+file, to show how each path scales with the size of the word lists.
+
+Usage:
+    python benchmarks/moderation_bench.py [--messages 20000] [--extra-words 0,1000,10000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import moderation
+from config import Config
+
+LEGACY_PATTERNS = [
+    r'\b(hate|kill|die|suicide)\b',
+    r'\b(fuck|shit|damn)\b',
+    r'\b(drug|weed|cocaine)\b',
+    r'\b(sex|nude|naked)\b',
+    r'(instagram|telegram|whatsapp|phone|number)',
+    r'(\d{10,})',
+    r'(@\w+)',
+]
+
+CLEAN = [
+    "hey, how is your day going?", "I just got back from a long hike in the hills",
+    "what kind of music are you into lately", "haha that's hilarious", "Do you like cooking?",
+    "I'm reading a great book about the history of coffee", "weekend plans: sleep, brunch, repeat",
+    "my cat knocked everything off the shelf again", "have you ever been to Lisbon?",
+    "studying for exams is killing my vibe... not literally", "the diet coke shortage is real",
+]
+FLAGGED = [
+    "add me on instagram", "text me at 5551234567890", "I hate mondays", "damn that's wild",
+    "what's your whatsapp", "find me @sunny_days", "send nudes lol jk", "my phone is dead",
+]
+
+def corpus(messages, flagged_share, rng):
+    return [
+        rng.choice(FLAGGED) if rng.random() < flagged_share else " ".join(rng.sample(CLEAN, rng.randint(1, 3)))
+        for _ in range(messages)
+    ]
+
+def legacy_is_appropriate(text):
+    text_lower = text.lower()
+    for pattern in LEGACY_PATTERNS:
+        if re.search(pattern, text_lower):
+            return False
+    return True
+
+def write_rules(extra_words, rng):
+    """The shipped rule file plus extra_words synthetic word rules (letters no corpus word uses)"""
+    with open(Config.MODERATION_RULES_FILE, encoding="utf-8") as f:
+        text = f.read()
+    if extra_words:
+        words = {"".join(rng.choice("qxzjv") for _ in range(rng.randint(5, 9))) for _ in range(extra_words)}
+        text += "\n[synthetic]\n" + "".join(f"word: {word}\n" for word in sorted(words))
+    handle, path = tempfile.mkstemp(suffix=".txt")
+    with os.fdopen(handle, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+def build_engine(path, use_automaton):
+    saved = moderation.ahocorasick
+    if not use_automaton:
+        moderation.ahocorasick = None
+    try:
+        return moderation.ModerationEngine(path, reload_seconds=0)
+    finally:
+        moderation.ahocorasick = saved
+
+def timed(fn, texts, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        verdicts = [fn(text) for text in texts]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(texts) * 1e6, verdicts
+
+def run(texts, extra_words, repeat, rng):
+    path = write_rules(extra_words, rng)
+    try:
+        paths = {"fallback": build_engine(path, use_automaton=False)}
+        if moderation.ahocorasick is not None:
+            paths["automaton"] = build_engine(path, use_automaton=True)
+    finally:
+        os.unlink(path)
+    
+    results = {}
+    if not extra_words:
+        results["legacy"] = timed(legacy_is_appropriate, texts, repeat)
+    for name, engine in paths.items():
+        results[name] = timed(lambda text, engine=engine: engine.check(text) is None, texts, repeat)
+    
+    # The synthetic words never occur in the corpus, so verdicts match the legacy rules at any size
+    expected = [legacy_is_appropriate(text) for text in texts]
+    for name, (_, verdicts) in results.items():
+        mismatches = [text for text, got, want in zip(texts, verdicts, expected) if got != want]
+        assert not mismatches, f"{name} disagrees with the legacy check on {mismatches[:3]}"
+    
+    return {name: us for name, (us, _) in results.items()}, expected.count(False)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--flagged", type=float, default=0.1, help="Share of messages that break a rule")
+    parser.add_argument("--extra-words", default="0,1000,10000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    
+    if moderation.ahocorasick is None:
+        print("pyahocorasick is not installed; only the fallback path is measured")
+    
+    rng = random.Random(1)
+    texts = corpus(args.messages, args.flagged, rng)
+    print(f"{'rules+':>7} {'flagged':>8} {'legacy us':>10} {'fallback us':>12} {'automaton us':>13}")
+    for extra_words in (int(n) for n in args.extra_words.split(",")):
+        timings, flagged = run(texts, extra_words, args.repeat, rng)
+        cells = [f"{timings[name]:.2f}" if name in timings else "-" for name in ("legacy", "fallback", "automaton")]
+        print(f"{extra_words:>7} {flagged:>8} {cells[0]:>10} {cells[1]:>12} {cells[2]:>13}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""find_match scaling over synthetic populations.
+
+Seeds a database with a synthetic population (users and profiles with skewed
+gender, age, city and interest distributions, plus blocks and a history of
+ended and active matches), then measures MatchingService.find_match per call:
+
+  latency      p50/p95/p99/mean wall time of _find_match
+  queries      SQL statements issued per call
+  memory       peak Python allocations per call (tracemalloc, on a subset)
+
+for the in-memory pool path and the database fallback path, at each
+population size. Sizes grow incrementally in one database, so 10k/100k/1M
+seeds 1M users once. Results are printed and, with --json, written to a file
+for comparison between releases.
+
+Usage:
+    python benchmarks/population_bench.py [--sizes 10000,100000,1000000] [--calls 200]
+        [--db-calls 5] [--database-url postgresql://localhost/dating_bench ...] [--json out.json]
+
+--database-url may be given more than once (e.g. SQLite and Postgres); the
+default is a temporary SQLite file. Every database given is wiped.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, insert, func
+from models import db, User, UserProfile, Match, BlockedUser, InterestToken, Gender, UserStatus, MatchStatus
+from database import DatabaseExecutor
+from matching_service import MatchingService
+from batch_scoring import HAVE_NUMPY
+
+CITIES = [f"City {i}" for i in range(1, 201)]
+VOCABULARY = [f"interest {i}" for i in range(1, 301)]
+CHUNK = 10000
+
+def zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+class Population:
+    """Generates synthetic rows with stable, seeded distributions"""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.city_weights = zipf_weights(len(CITIES))
+        self.interest_weights = zipf_weights(len(VOCABULARY))
+    
+    def gender_pair(self):
+        roll = self.rng.random()
+        gender = Gender.MALE if roll < 0.55 else Gender.FEMALE if roll < 0.97 else Gender.OTHER
+        if gender == Gender.OTHER:
+            return gender, self.rng.choice(list(Gender))
+        if self.rng.random() < 0.08:
+            return gender, gender
+        return gender, Gender.FEMALE if gender == Gender.MALE else Gender.MALE
+    
+    def user_rows(self, first_id, count, now):
+        users, profiles = [], []
+        rng = self.rng
+        for user_id in range(first_id, first_id + count):
+            registered = rng.random() < 0.92
+            status = UserStatus.BANNED if rng.random() < 0.01 else UserStatus.INACTIVE if rng.random() < 0.05 else UserStatus.ACTIVE
+            users.append({"id": user_id, "telegram_id": str(9 * 10 ** 11 + user_id), "first_name": f"Pop{user_id}",
+                          "status": status, "is_registered": registered, "created_at": now})
+            if not registered:
+                continue
+            
+            gender, looking_for = self.gender_pair()
+            age = max(18, min(70, int(rng.triangular(18, 70, 26))))
+            interest_ids = sorted(set(rng.choices(range(1, len(VOCABULARY) + 1), self.interest_weights,
+                                                  k=rng.randint(0, 6))))
+            profiles.append({
+                "user_id": user_id, "age": age, "gender": gender, "looking_for": looking_for,
+                "min_age": max(18, age - rng.randint(2, 12)), "max_age": min(99, age + rng.randint(2, 12)),
+                "city": rng.choices(CITIES, self.city_weights)[0] if rng.random() < 0.9 else None,
+                "bio": "Coffee, long walks and good conversation" if rng.random() < 0.6 else None,
+                "interests": ", ".join(VOCABULARY[i - 1] for i in interest_ids) or None,
+                "interest_ids": ",".join(map(str, interest_ids)) or None,
+                "created_at": now,
+            })
+        return users, profiles
+    
+    def history_rows(self, first_id, last_id, now):
+        """Blocks (~1 per 20 users), ended matches over the last 30 days (~1 per 2 users), ~5% in active matches"""
+        rng = self.rng
+        count = last_id - first_id + 1
+        
+        def other_user(user_id):
+            other_id = rng.randint(1, last_id)
+            return other_id if other_id != user_id else last_id + 1 - user_id
+        
+        blocks = []
+        for blocker_id in (rng.randint(first_id, last_id) for _ in range(count // 20)):
+            blocks.append({"blocker_id": blocker_id, "blocked_id": other_user(blocker_id),
+                           "created_at": now - timedelta(days=rng.uniform(0, 90))})
+        matches = []
+        for user1_id in (rng.randint(first_id, last_id) for _ in range(count // 2)):
+            created_at = now - timedelta(days=rng.uniform(0, 30))
+            matches.append({"user1_id": user1_id, "user2_id": other_user(user1_id),
+                            "status": MatchStatus.ENDED, "created_at": created_at,
+                            "ended_at": created_at + timedelta(minutes=30),
+                            "anonymous_id_1": "UserAAAA", "anonymous_id_2": "UserBBBB"})
+        active = list(range(first_id, last_id + 1))
+        rng.shuffle(active)
+        active = active[:count // 20 * 2]
+        for user1_id, user2_id in zip(active[::2], active[1::2]):
+            matches.append({"user1_id": user1_id, "user2_id": user2_id, "status": MatchStatus.ACTIVE,
+                            "created_at": now - timedelta(minutes=rng.uniform(0, 600)),
+                            "anonymous_id_1": "UserCCCC", "anonymous_id_2": "UserDDDD"})
+        return blocks, matches
+
+def bulk_insert(session, model, rows):
+    for start in range(0, len(rows), CHUNK):
+        session.execute(insert(model), rows[start:start + CHUNK])
+
+def grow(session, population, current, target):
+    """Add users current+1..target with their profiles, blocks and match history"""
+    now = datetime.now(timezone.utc)
+    for first_id in range(current + 1, target + 1, 100000):
+        count = min(100000, target - first_id + 1)
+        users, profiles = population.user_rows(first_id, count, now)
+        bulk_insert(session, User, users)
+        bulk_insert(session, UserProfile, profiles)
+        blocks, matches = population.history_rows(first_id, first_id + count - 1, now)
+        bulk_insert(session, BlockedUser, blocks)
+        bulk_insert(session, Match, matches)
+        session.commit()
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+    
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def measure(database, service, queries, seekers, calls, memory_calls):
+    """Time find_match for up to `calls` seekers still free to match"""
+    latencies, query_counts, peaks = [], [], []
+    matches = 0
+    for seeker_id in seekers:
+        if len(latencies) >= calls:
+            break
+        if service.pool.ready and seeker_id not in service.pool:
+            continue  # Paired as someone else's candidate earlier in the run
+        
+        traced = len(latencies) < memory_calls
+        if traced:
+            tracemalloc.start()
+        queries_before = queries.count
+        started = time.perf_counter()
+        match = database.run_sync(service._find_match, seeker_id)
+        latencies.append(time.perf_counter() - started)
+        query_counts.append(queries.count - queries_before)
+        if traced:
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        matches += bool(match)
+    
+    return {
+        "calls": len(latencies),
+        "matches": matches,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+        "queries_per_call": round(statistics.mean(query_counts), 2) if query_counts else 0.0,
+        "peak_kb_per_call": round(statistics.mean(peaks) / 1024, 1) if peaks else None,
+        "max_peak_kb": round(max(peaks) / 1024, 1) if peaks else None,
+    }
+
+def run_database(database_url, sizes, args):
+    engine = create_engine(database_url, **({"connect_args": {"timeout": 60}} if database_url.startswith("sqlite") else {}))
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    database = DatabaseExecutor(engine, max_workers=2)
+    queries = QueryCounter(engine)
+    population = Population(args.seed)
+    
+    def seed_vocabulary(session):
+        bulk_insert(session, InterestToken, [{"id": i, "token": token} for i, token in enumerate(VOCABULARY, 1)])
+        session.commit()
+    database.run_sync(seed_vocabulary)
+    
+    results = []
+    current = 0
+    try:
+        for size in sizes:
+            started = time.perf_counter()
+            database.run_sync(grow, population, current, size)
+            current = size
+            seed_s = time.perf_counter() - started
+            rows = database.run_sync(lambda session: {
+                "users": session.query(func.count(User.id)).scalar(),
+                "blocks": session.query(func.count(BlockedUser.id)).scalar(),
+                "matches": session.query(func.count(Match.id)).scalar(),
+            })
+            print(f"{engine.dialect.name} {size}: seeded in {seed_s:.1f}s {rows}", flush=True)
+            
+            for path in args.paths:
+                # A fresh service per run: cold exclusion cache, and a pool built from the current data
+                service = MatchingService(database)
+                rebuild_s = None
+                if path == "pool":
+                    started = time.perf_counter()
+                    database.run_sync(service.pool.rebuild)
+                    rebuild_s = round(time.perf_counter() - started, 3)
+                    seekers = list(service.pool._entries)
+                else:
+                    seekers = database.run_sync(lambda session: [user_id for (user_id,) in session.query(User.id).filter(
+                        User.is_registered == True, User.status == UserStatus.ACTIVE
+                    ).order_by(func.random()).limit(args.calls * 4)])
+                random.Random(args.seed).shuffle(seekers)
+                
+                calls = args.calls if path == "pool" else args.db_calls
+                result = measure(database, service, queries, seekers, calls, min(calls, args.memory_calls))
+                result.update({"database": engine.dialect.name, "population": size, "path": path,
+                               "seed_s": round(seed_s, 1), "pool_rebuild_s": rebuild_s, "rows": rows,
+                               "exclusions": service.exclusions.stats()})
+                results.append(result)
+                print(f"  {path:<5} calls={result['calls']:<5} p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+                      f"p99={result['p99_ms']}ms queries/call={result['queries_per_call']} "
+                      f"peak={result['peak_kb_per_call']}KB" + (f" rebuild={rebuild_s}s" if rebuild_s is not None else ""), flush=True)
+                
+                # Undo this run's matches so every path sees the same population
+                def end_run_matches(session):
+                    session.query(Match).filter(Match.anonymous_id_1.notin_(["UserAAAA", "UserCCCC"])).delete(
+                        synchronize_session=False)
+                    session.commit()
+                database.run_sync(end_run_matches)
+    finally:
+        database.close()
+        engine.dispose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--calls", type=int, default=200, help="find_match calls per size on the pool path")
+    parser.add_argument("--db-calls", type=int, default=5, help="calls per size on the database fallback path")
+    parser.add_argument("--memory-calls", type=int, default=20, help="calls per run traced for memory")
+    parser.add_argument("--paths", default="pool,db", help="pool, db or both")
+    parser.add_argument("--database-url", action="append", dest="database_urls")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="also write the results as JSON")
+    args = parser.parse_args()
+    args.paths = args.paths.split(",")
+    
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    database_urls = args.database_urls or [f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'population.db')}"]
+    
+    results = []
+    for database_url in database_urls:
+        results.extend(run_database(database_url, sizes, args))
+    
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"generated_at": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(),
+                       "numpy": HAVE_NUMPY, "sizes": sizes, "results": results}, f, indent=2)
+        print(f"results written to {args.json_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Candidate scoring: per-pair loop vs. vectorized batch scoring.
+
+Fills a MatchingPool with synthetic users of one gender pair and ranks them
+for a seeker three ways:
+
+  loop      - score every candidate with calculate_compatibility_score, sort all
+  nlargest  - same per-pair scoring, keep the top 5 with heapq (no NumPy)
+  numpy     - MatchingPool.top_candidates: one vectorized pass plus argpartition
+
+All three must agree on the top scores; the run fails otherwise.
+
+Usage:
+    python benchmarks/scoring_bench.py [--candidates 1000,10000,50000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Gender, UserStatus
+from matching_pool import MatchingPool, PoolEntry
+from matching_service import MatchingService, TOP_MATCHES
+from batch_scoring import HAVE_NUMPY
+
+CITIES = ["Paris", "Lyon", "Berlin", "Madrid", "Rome", "Lisbon", None]
+
+def synthetic_user(user_id, gender, looking_for, rng, vocabulary):
+    age = rng.randint(18, 60)
+    user = SimpleNamespace(id=user_id, telegram_id=str(user_id), is_registered=True, status=UserStatus.ACTIVE)
+    interest_ids = sorted(rng.sample(range(1, vocabulary + 1), rng.randint(0, 6)))
+    user.profile = SimpleNamespace(
+        age=age, min_age=max(18, age - rng.randint(3, 15)), max_age=min(99, age + rng.randint(3, 15)),
+        gender=gender, looking_for=looking_for, city=rng.choice(CITIES),
+        interest_ids=",".join(map(str, interest_ids)) or None,
+        bio=rng.choice(["", "Hi", "Coffee lover, hiker and amateur photographer"]),
+    )
+    return user
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+def run(candidates, repeat, vocabulary, seed=1):
+    rng = random.Random(seed)
+    service = MatchingService(database=None)
+    pool = MatchingPool()
+    for user_id in range(1, candidates + 1):
+        pool.add(synthetic_user(user_id, Gender.FEMALE, Gender.MALE, rng, vocabulary))
+    
+    seeker_user = synthetic_user(candidates + 1, Gender.MALE, Gender.FEMALE, rng, vocabulary)
+    seeker_user.profile.min_age, seeker_user.profile.max_age = 18, 99
+    seeker = PoolEntry(seeker_user, seeker_user.profile)
+    exclude = {seeker.user_id} | set(rng.sample(range(1, candidates + 1), 20))
+    score = service.calculate_compatibility_score
+    
+    def loop():
+        scored = [(entry, score(seeker, entry)) for entry in pool.candidates(seeker, exclude)]
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:TOP_MATCHES]
+    
+    def nlargest():
+        return service._top_matches(seeker, pool.candidates(seeker, exclude))
+    
+    def numpy():
+        return pool.top_candidates(seeker, exclude, TOP_MATCHES, score)
+    
+    results = {}
+    for name, fn in (("loop", loop), ("nlargest", nlargest), ("numpy", numpy)):
+        if name == "numpy" and not HAVE_NUMPY:
+            continue
+        ms, top = timed(fn, repeat)
+        results[name] = (ms, top)
+    
+    # Same top scores, and every returned score matches the per-pair function
+    expected = [entry_score for _, entry_score in results["loop"][1]]
+    for name, (_, top) in results.items():
+        assert [entry_score for _, entry_score in top] == expected, f"{name} disagrees: {top} vs {expected}"
+        for entry, entry_score in top:
+            assert score(seeker, entry) == entry_score, f"{name} scored user {entry.user_id} wrong"
+    
+    eligible = len(pool.candidates(seeker, exclude))
+    return eligible, {name: ms for name, (ms, _) in results.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", default="1000,10000,50000")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--vocabulary", type=int, default=200, help="Distinct interest tokens")
+    args = parser.parse_args()
+    
+    if not HAVE_NUMPY:
+        print("NumPy is not installed; only the per-pair paths are measured")
+    
+    print(f"{'pool':>8} {'eligible':>9} {'loop ms':>9} {'nlargest ms':>12} {'numpy ms':>9} {'speedup':>8}")
+    for candidates in (int(n) for n in args.candidates.split(",")):
+        eligible, timings = run(candidates, args.repeat, args.vocabulary)
+        numpy_ms = timings.get("numpy")
+        speedup = f"{timings['loop'] / numpy_ms:.1f}x" if numpy_ms else "-"
+        numpy_text = f"{numpy_ms:.2f}" if numpy_ms else "-"
+        print(f"{candidates:>8} {eligible:>9} {timings['loop']:>9.2f} {timings['nlargest']:>12.2f} {numpy_text:>9} {speedup:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Local stand-in for the Telegram Bot API, for offline load tests.
+
+Answers every Bot API method the bot uses and records outgoing messages
+(sendMessage / editMessageText) with their arrival time, so a test can wait
+for the bot's response to an update it posted.
+
+Run standalone with:
+    python benchmarks/stub_bot_api.py [--port 8081]
+then start the bot with TELEGRAM_API_URL=http://127.0.0.1:8081
+"""
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Load tests tag texts with markers like "#lt42" to spot them when relayed
+MARKER_PATTERN = re.compile(r"#lt\d+")
+
+BOT_USER = {"id": 1000000, "is_bot": True, "first_name": "Stub", "username": "stub_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+class StubBotAPI:
+    """Threaded HTTP server implementing just enough of the Bot API"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.records = []  # (timestamp, method, chat_id, text)
+        self.by_chat = defaultdict(list)
+        self.method_counts = defaultdict(int)
+        self.markers = {}  # marker -> timestamp first seen in an outgoing message
+        self._message_ids = itertools.count(1)
+        self._condition = threading.Condition()
+        
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_POST(self):
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                params = stub._parse(body, self.headers.get("Content-Type", ""))
+                payload = json.dumps({"ok": True, "result": stub.handle(method, params)}).encode()
+                
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-bot-api", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def _parse(self, body, content_type):
+        if not body:
+            return {}
+        if "json" in content_type:
+            return json.loads(body)
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+    
+    def handle(self, method, params):
+        with self._condition:
+            self.method_counts[method] += 1
+        
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = str(params.get("chat_id"))
+            text = params.get("text", "")
+            with self._condition:
+                record = (time.monotonic(), method, chat_id, text)
+                self.records.append(record)
+                self.by_chat[chat_id].append(record)
+                for marker in MARKER_PATTERN.findall(text):
+                    self.markers.setdefault(marker, record[0])
+                self._condition.notify_all()
+            return {"message_id": next(self._message_ids), "date": int(time.time()),
+                    "chat": {"id": int(chat_id), "type": "private"}, "text": text, "from": BOT_USER}
+        return True
+    
+    def count(self, chat_id):
+        with self._condition:
+            return len(self.by_chat[str(chat_id)])
+    
+    def wait_for(self, predicate, timeout=10):
+        """Block until predicate() holds (checked under the lock); returns its final value"""
+        with self._condition:
+            return self._condition.wait_for(predicate, timeout)
+    
+    def messages_since(self, chat_id, index):
+        return self.by_chat[str(chat_id)][index:]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stub Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    
+    stub = StubBotAPI(args.host, args.port)
+    print(f"Stub Bot API listening on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
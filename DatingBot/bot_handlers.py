@@ -1,92 +1,189 @@
 import logging
 import json
+import math
 import random
 import string
 from datetime import datetime, timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import joinedload
 from sqlalchemy import and_, or_
-from models import User, UserProfile, Match, Message, Report, BlockedUser, Gender, UserStatus, MatchStatus, SubscriptionType
+from config import Config
+from models import User, UserProfile, Match, Report, BlockedUser, Gender, UserStatus, MatchStatus, SubscriptionType
 from matching_service import MatchingService
-from utils import generate_anonymous_id, format_gender_display, can_see_gender, get_premium_info_text, is_owner
+from routing import RoutingTable
+from message_writer import MessageWriter
+from waiting_room import WaitingRoom
+from match_sweeper import InactiveMatchSweeper
+from user_cache import UserCache
+from rate_limit import RateLimiter, shared_store
+from conversation_state import create_store
+from cluster import peer_events
+from interests import encode_interests
+from outbound import SendScheduler, PRIORITY_RELAY, PRIORITY_MATCH_NOTICE, PRIORITY_INFO
+from utils import generate_anonymous_id, format_gender_display, can_see_gender, get_premium_info_text, is_owner, has_priority_matching
 
 logger = logging.getLogger(__name__)
 
+def get_user(session, telegram_id):
+    """Load a user by Telegram ID with their profile eagerly loaded"""
+    return session.query(User).options(joinedload(User.profile)).filter_by(telegram_id=telegram_id).first()
+
+def get_active_match(session, user_id):
+    """Get the user's active match, if any"""
+    return session.query(Match).filter(
+        and_(
+            or_(Match.user1_id == user_id, Match.user2_id == user_id),
+            Match.status == MatchStatus.ACTIVE
+        )
+    ).first()
+
 class BotHandlers:
-    def __init__(self, db):
-        self.db = db
-        self.matching_service = MatchingService(db)
+    """Telegram command and message handlers.
+
+    Database work runs on the DatabaseExecutor pool through the `_..._tx`
+    methods, which take a session and return plain data; the handlers
+    themselves only await those and talk to Telegram.
+    """
+
+    def __init__(self, database, bot):
+        self.database = database
+        self.outbox = SendScheduler(bot)
+        self.routing_table = RoutingTable()
+        self.user_cache = UserCache()
+        self.matching_service = MatchingService(database, self.routing_table)
+        self.message_writer = MessageWriter(database)
+        self.waiting_room = WaitingRoom(self.matching_service, self._announce_match, self._waiting_expired)
+        self.match_sweeper = InactiveMatchSweeper(self.matching_service, self._inactive_matches_ended)
+        self.rate_limit_store = shared_store()
+        self.message_limiter = RateLimiter("messages", Config.MAX_MESSAGES_PER_MINUTE, 60, self.rate_limit_store)
+        self.report_limiter = RateLimiter("reports", Config.MAX_REPORTS_PER_DAY, 24 * 3600, self.rate_limit_store)
+        self.conversations = create_store(database)
+    
+    async def start(self):
+        """Start background services; runs on the update loop"""
+        await self.message_writer.start()
+        await self.outbox.start()
+        await self.waiting_room.start()
+        await self.match_sweeper.start()
+    
+    async def close(self):
+        """Stop background services and flush buffered writes"""
+        await self.match_sweeper.close()
+        await self.waiting_room.close()
+        await self.message_writer.close()
+        await self.outbox.close()
+        if self.rate_limit_store:
+            await self.rate_limit_store.close()
+        await self.conversations.close()
+    
+    async def apply_peer_event(self, kind, args):
+        """Apply a change another worker process made to state this one may have cached (see cluster.PeerEvents)"""
+        try:
+            if kind == "user":
+                self.user_cache.invalidate(args[0])
+            elif kind == "matched":
+                match_id, user1_id, user2_id, created_at = args
+                self.matching_service.exclusions.add_match(user1_id, user2_id, created_at and datetime.fromisoformat(created_at))
+                self.matching_service.pool.remove(user1_id)
+                self.matching_service.pool.remove(user2_id)
+                self.waiting_room.matched_users(user1_id, user2_id)
+            elif kind == "ended":
+                match_id, user_ids = args
+                self.routing_table.remove_match(match_id)
+                await self.database.run(self.matching_service.pool.refresh, user_ids)
+            elif kind == "blocked":
+                self.matching_service.exclusions.add_block(*args)
+            elif kind == "refresh":
+                await self.database.run(self.matching_service.pool.refresh, args[0])
+        
+        except Exception as e:
+            logger.error(f"Error applying peer event {kind}: {e}")
+    
+    async def _load_user(self, telegram_id):
+        """User snapshot from the cache, going to the database only on a miss"""
+        return self.user_cache.get(telegram_id) or await self.database.run(self.user_cache.fetch, telegram_id)
+    
+    def _reply(self, update, text, reply_markup=None, priority=PRIORITY_INFO):
+        """Queue a message to the user who sent the update"""
+        kwargs = {"reply_markup": reply_markup} if reply_markup else {}
+        self.outbox.send(update.effective_user.id, text, priority, **kwargs)
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         try:
             telegram_id = str(update.effective_user.id)
             
-            with self.db.session() as session:
-                # Check if user exists
-                user = session.query(User).filter_by(telegram_id=telegram_id).first()
+            user, created = await self.database.run(
+                self._start_tx, telegram_id, update.effective_user.username, update.effective_user.first_name
+            )
+            
+            if created:
+                welcome_text = (
+                    "🎭 Welcome to Anonymous Dating Bot! 🎭\n\n"
+                    "Find meaningful connections while staying completely anonymous.\n\n"
+                    "To get started, let's set up your profile:\n"
+                    "• Age and gender preferences\n"
+                    "• Interests and bio\n"
+                    "• What you're looking for\n\n"
+                    "Ready to begin? Click the button below!"
+                )
                 
-                if not user:
-                    # Create new user
-                    user = User(
-                        telegram_id=telegram_id,
-                        username=update.effective_user.username,
-                        first_name=update.effective_user.first_name
-                    )
-                    
-                    # Check if user should be set as owner
-                    from config import Config
-                    if int(telegram_id) in Config.OWNER_IDS:
-                        user.subscription_type = SubscriptionType.OWNER
-                    
-                    session.add(user)
-                    session.commit()
-                    
-                    welcome_text = (
-                        "🎭 Welcome to Anonymous Dating Bot! 🎭\n\n"
-                        "Find meaningful connections while staying completely anonymous.\n\n"
-                        "To get started, let's set up your profile:\n"
-                        "• Age and gender preferences\n"
-                        "• Interests and bio\n"
-                        "• What you're looking for\n\n"
-                        "Ready to begin? Click the button below!"
-                    )
-                    
-                    keyboard = [[InlineKeyboardButton("Setup Profile 📝", callback_data="setup_profile")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    
-                    await update.message.reply_text(welcome_text, reply_markup=reply_markup)
-                else:
-                    if user.is_registered:
-                        welcome_back_text = (
-                            f"🎭 Welcome back, {user.first_name or 'Anonymous'}!\n\n"
-                            "What would you like to do today?"
-                        )
-                        
-                        keyboard = [
-                            [InlineKeyboardButton("Find Match 💕", callback_data="find_match")],
-                            [InlineKeyboardButton("My Profile 👤", callback_data="view_profile")],
-                            [InlineKeyboardButton("Help ❓", callback_data="show_help")]
-                        ]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        
-                        await update.message.reply_text(welcome_back_text, reply_markup=reply_markup)
-                    else:
-                        incomplete_text = (
-                            "🎭 Welcome back!\n\n"
-                            "It looks like you haven't completed your profile setup yet.\n"
-                            "Let's finish setting up your profile to start matching!"
-                        )
-                        
-                        keyboard = [[InlineKeyboardButton("Complete Profile 📝", callback_data="setup_profile")]]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        
-                        await update.message.reply_text(incomplete_text, reply_markup=reply_markup)
+                keyboard = [[InlineKeyboardButton("Setup Profile 📝", callback_data="setup_profile")]]
+                reply_markup = InlineKeyboardMarkup(keyboard)
+                
+                self._reply(update, welcome_text, reply_markup=reply_markup)
+            elif user.is_registered:
+                welcome_back_text = (
+                    f"🎭 Welcome back, {user.first_name or 'Anonymous'}!\n\n"
+                    "What would you like to do today?"
+                )
+                
+                keyboard = [
+                    [InlineKeyboardButton("Find Match 💕", callback_data="find_match")],
+                    [InlineKeyboardButton("My Profile 👤", callback_data="view_profile")],
+                    [InlineKeyboardButton("Help ❓", callback_data="show_help")]
+                ]
+                reply_markup = InlineKeyboardMarkup(keyboard)
+                
+                self._reply(update, welcome_back_text, reply_markup=reply_markup)
+            else:
+                incomplete_text = (
+                    "🎭 Welcome back!\n\n"
+                    "It looks like you haven't completed your profile setup yet.\n"
+                    "Let's finish setting up your profile to start matching!"
+                )
+                
+                keyboard = [[InlineKeyboardButton("Complete Profile 📝", callback_data="setup_profile")]]
+                reply_markup = InlineKeyboardMarkup(keyboard)
+                
+                self._reply(update, incomplete_text, reply_markup=reply_markup)
         
         except Exception as e:
             logger.error(f"Error in start_command: {e}")
-            await update.message.reply_text("Sorry, something went wrong. Please try again later.")
+            self._reply(update, "Sorry, something went wrong. Please try again later.")
+    
+    def _start_tx(self, session, telegram_id, username, first_name):
+        """Get the user, creating them on first contact. Returns (user, created)."""
+        # Check if user exists
+        user = self.user_cache.load(session, telegram_id)
+        if user:
+            return user, False
+        
+        # Create new user
+        user = User(
+            telegram_id=telegram_id,
+            username=username,
+            first_name=first_name
+        )
+        
+        # Check if user should be set as owner
+        if int(telegram_id) in Config.OWNER_IDS:
+            user.subscription_type = SubscriptionType.OWNER
+        
+        session.add(user)
+        session.commit()
+        return user, True
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
@@ -113,268 +210,411 @@ class BotHandlers:
             "Need more help? Contact @support"
         )
         
-        await update.message.reply_text(help_text)
+        self._reply(update, help_text)
     
     async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /profile command"""
         try:
             telegram_id = str(update.effective_user.id)
             
-            with self.db.session() as session:
-                user = session.query(User).filter_by(telegram_id=telegram_id).first()
-                
-                if not user:
-                    await update.message.reply_text("Please use /start first to register.")
-                    return
-                
-                if not user.is_registered or not user.profile:
-                    keyboard = [[InlineKeyboardButton("Setup Profile 📝", callback_data="setup_profile")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text("You haven't set up your profile yet!", reply_markup=reply_markup)
-                    return
-                
-                profile = user.profile
-                profile_text = (
-                    f"👤 Your Profile:\n\n"
-                    f"Age: {profile.age}\n"
-                    f"Gender: {profile.gender.value.title()}\n"
-                    f"Looking for: {profile.looking_for.value.title()}\n"
-                    f"Age range: {profile.min_age}-{profile.max_age}\n"
-                    f"City: {profile.city or 'Not specified'}\n"
-                    f"Bio: {profile.bio or 'No bio yet'}\n"
-                    f"Interests: {profile.interests or 'None specified'}"
-                )
-                
-                keyboard = [
-                    [InlineKeyboardButton("Edit Profile ✏️", callback_data="edit_profile")],
-                    [InlineKeyboardButton("Find Match 💕", callback_data="find_match")]
-                ]
+            user = await self._load_user(telegram_id)
+            
+            if not user:
+                self._reply(update, "Please use /start first to register.")
+                return
+            
+            if not user.is_registered or not user.profile:
+                keyboard = [[InlineKeyboardButton("Setup Profile 📝", callback_data="setup_profile")]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(profile_text, reply_markup=reply_markup)
+                self._reply(update, "You haven't set up your profile yet!", reply_markup=reply_markup)
+                return
+            
+            profile = user.profile
+            profile_text = (
+                f"👤 Your Profile:\n\n"
+                f"Age: {profile.age}\n"
+                f"Gender: {profile.gender.value.title()}\n"
+                f"Looking for: {profile.looking_for.value.title()}\n"
+                f"Age range: {profile.min_age}-{profile.max_age}\n"
+                f"City: {profile.city or 'Not specified'}\n"
+                f"Bio: {profile.bio or 'No bio yet'}\n"
+                f"Interests: {profile.interests or 'None specified'}"
+            )
+            
+            keyboard = [
+                [InlineKeyboardButton("Edit Profile ✏️", callback_data="edit_profile")],
+                [InlineKeyboardButton("Find Match 💕", callback_data="find_match")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            self._reply(update, profile_text, reply_markup=reply_markup)
         
         except Exception as e:
             logger.error(f"Error in profile_command: {e}")
-            await update.message.reply_text("Sorry, couldn't load your profile. Please try again later.")
+            self._reply(update, "Sorry, couldn't load your profile. Please try again later.")
     
     async def find_match_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /match command"""
         try:
             telegram_id = str(update.effective_user.id)
             
-            with self.db.session() as session:
-                user = session.query(User).filter_by(telegram_id=telegram_id).first()
-                
-                if not user or not user.is_registered:
-                    await update.message.reply_text("Please complete your profile setup first using /start")
-                    return
-                
-                # Check if user is already in an active match
-                active_match = session.query(Match).filter(
-                    and_(
-                        or_(Match.user1_id == user.id, Match.user2_id == user.id),
-                        Match.status == MatchStatus.ACTIVE
-                    )
-                ).first()
-                
-                if active_match:
-                    await update.message.reply_text(
-                        "You're already in an active conversation! Use /stop_chat to end it before finding a new match."
-                    )
-                    return
-                
-                # Find a match
-                match = await self.matching_service.find_match(user.id)
-                
-                if match:
-                    # Notify both users
-                    partner_id = match.user2_id if match.user1_id == user.id else match.user1_id
-                    user_anonymous_id = match.anonymous_id_1 if match.user1_id == user.id else match.anonymous_id_2
-                    partner_anonymous_id = match.anonymous_id_2 if match.user1_id == user.id else match.anonymous_id_1
-                    
-                    # Get partner info with gender visibility based on subscription
-                    partner = session.query(User).filter_by(id=partner_id).first()
-                    partner_profile = partner.profile if partner else None
-                    
-                    # Format gender display based on user's subscription
-                    gender_display, can_see_gender_bool = format_gender_display(partner_profile, user, session) if partner_profile else ("Gender: Unknown", False)
-                    
-                    # Show additional info for owner
-                    owner_info = ""
-                    if is_owner(user) and partner_profile:
-                        owner_info = f"\n\n👑 OWNER INFO:\n• Real Gender: {partner_profile.gender.value.title()}\n• Age: {partner_profile.age}\n• City: {partner_profile.city or 'Not specified'}"
-                    
-                    match_text = (
-                        f"🎭 Match found! You're now connected with {partner_anonymous_id}\n\n"
-                        f"Your anonymous ID: {user_anonymous_id}\n\n"
-                        f"Partner Info:\n{gender_display}\n"
-                        f"Age range: {partner_profile.min_age}-{partner_profile.max_age} (looking for {user.profile.min_age}-{user.profile.max_age})\n"
-                        f"{owner_info}\n"
-                        "Start chatting by sending a message! Remember:\n"
-                        "• Stay respectful and kind\n"
-                        "• You can end the chat anytime with /stop_chat\n"
-                        "• Report inappropriate behavior with /report\n\n"
-                        "Have fun getting to know each other! 💕"
-                    )
-                    
-                    # Add premium upgrade button if user can't see gender
-                    keyboard = []
-                    if not can_see_gender_bool and not is_owner(user):
-                        keyboard.append([InlineKeyboardButton("🔓 Upgrade to Premium", callback_data="upgrade_premium")])
-                    
-                    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
-                    
-                    await update.message.reply_text(match_text, reply_markup=reply_markup)
-                    
-                    # Notify the partner with their gender visibility
-                    if partner:
-                        # Format gender display for partner
-                        partner_gender_display, partner_can_see = format_gender_display(user.profile, partner, session)
-                        
-                        # Show additional info for owner
-                        partner_owner_info = ""
-                        if is_owner(partner):
-                            partner_owner_info = f"\n\n👑 OWNER INFO:\n• Real Gender: {user.profile.gender.value.title()}\n• Age: {user.profile.age}\n• City: {user.profile.city or 'Not specified'}"
-                        
-                        partner_text = (
-                            f"🎭 You've been matched with {user_anonymous_id}!\n\n"
-                            f"Your anonymous ID: {partner_anonymous_id}\n\n"
-                            f"Partner Info:\n{partner_gender_display}\n"
-                            f"Age range: {user.profile.min_age}-{user.profile.max_age} (looking for {partner_profile.min_age}-{partner_profile.max_age})\n"
-                            f"{partner_owner_info}\n"
-                            "Start chatting by sending a message! Remember:\n"
-                            "• Stay respectful and kind\n"
-                            "• You can end the chat anytime with /stop_chat\n"
-                            "• Report inappropriate behavior with /report\n\n"
-                            "Have fun getting to know each other! 💕"
-                        )
-                        
-                        # Add premium upgrade button for partner if needed
-                        partner_keyboard = []
-                        if not partner_can_see and not is_owner(partner):
-                            partner_keyboard.append([InlineKeyboardButton("🔓 Upgrade to Premium", callback_data="upgrade_premium")])
-                        
-                        partner_reply_markup = InlineKeyboardMarkup(partner_keyboard) if partner_keyboard else None
-                        
-                        await context.bot.send_message(chat_id=partner.telegram_id, text=partner_text, reply_markup=partner_reply_markup)
-                else:
-                    await update.message.reply_text(
-                        "🔍 No matches found right now. We'll keep looking!\n\n"
-                        "Try again in a few minutes, or update your preferences in your profile."
-                    )
+            # Already waiting: answer from memory
+            position = self.waiting_room.position(telegram_id)
+            if position:
+                self._reply(update, self._waiting_text(position, joined=False, tier=self.waiting_room.tier(telegram_id)))
+                return
+            
+            user = await self._load_user(telegram_id)
+            
+            if not user or not user.is_registered:
+                self._reply(update, "Please complete your profile setup first using /start")
+                return
+            
+            # Check if user is already in an active match (a routed user certainly is)
+            if self.routing_table.get(telegram_id) or await self.database.run(get_active_match, user.id):
+                self._reply(update,
+                    "You're already in an active conversation! Use /stop_chat to end it before finding a new match."
+                )
+                return
+            
+            # Find a match (in batch mode the next round pairs everyone waiting)
+            priority = has_priority_matching(user)
+            match = None
+            if not self.waiting_room.batch_mode:
+                match = await self.matching_service.find_match(user.id, priority)
+            
+            if match:
+                # The partner may have been in the waiting room
+                self.waiting_room.matched_users(match.user1_id, match.user2_id)
+                await self._announce_match(user.id, match)
+            else:
+                # Wait for a compatible partner to arrive
+                position = self.waiting_room.join(user.id, telegram_id, priority)
+                self._reply(update, self._waiting_text(position, joined=True, tier=self.waiting_room.tier(telegram_id)))
         
         except Exception as e:
             logger.error(f"Error in find_match_command: {e}")
-            await update.message.reply_text("Sorry, couldn't find a match right now. Please try again later.")
+            self._reply(update, "Sorry, couldn't find a match right now. Please try again later.")
+    
+    async def _announce_match(self, user_id, match):
+        """Send the match notices to both users"""
+        user_notice, partner_notice = await self.database.run(self._match_notices_tx, user_id, match)
+        
+        self.outbox.send(user_notice[0], user_notice[1], PRIORITY_MATCH_NOTICE, reply_markup=user_notice[2])
+        
+        # Notify the partner with their gender visibility
+        if partner_notice:
+            self.outbox.send(partner_notice[0], partner_notice[1], PRIORITY_MATCH_NOTICE, reply_markup=partner_notice[2])
+    
+    async def _inactive_matches_ended(self, ended):
+        """Tell both users of every match the sweeper ended"""
+        text = (
+            f"⌛ Your chat ended after {self.match_sweeper.max_inactive_hours} hours without messages.\n\n"
+            "Use /match to find a new connection! 💕"
+        )
+        for _, user1_telegram_id, user2_telegram_id in ended:
+            for telegram_id in (user1_telegram_id, user2_telegram_id):
+                if telegram_id:
+                    self.outbox.send(telegram_id, text, PRIORITY_MATCH_NOTICE)
+    
+    async def _waiting_expired(self, telegram_id):
+        self.outbox.send(telegram_id,
+            "⌛ We couldn't find a match this time.\n\n"
+            "Use /match to join the waiting room again, or update your preferences in your profile."
+        )
+    
+    def _waiting_text(self, position, joined, tier=None):
+        expected_wait = self.waiting_room.expected_wait(tier)
+        if expected_wait is None:
+            wait_text = "We'll message you as soon as someone compatible is available."
+        else:
+            wait_text = f"Typical wait right now: about {max(1, round(expected_wait / 60))} min."
+        
+        if not joined:
+            header = "⏳ You're still in the waiting room."
+        elif self.waiting_room.batch_mode:
+            header = "🔍 You're in the waiting room! Matches are made every few seconds."
+        else:
+            header = "🔍 No matches right now, so you're in the waiting room!"
+        return (
+            f"{header}\n\n"
+            f"Position in queue: #{position}{' (💎 priority lane)' if tier == 'premium' else ''}\n"
+            f"{wait_text}\n\n"
+            "No need to send /match again. Use /stop_chat to leave the queue."
+        )
+    
+    def _match_notices_tx(self, session, user_id, match):
+        """Build the match notices for both users.
+
+        Returns ((chat_id, text, reply_markup), partner notice or None). Gender
+        views are counted against each viewer here, so this runs in a session.
+        """
+        user = session.query(User).options(joinedload(User.profile)).filter_by(id=user_id).first()
+        
+        # Notify both users
+        partner_id = match.user2_id if match.user1_id == user.id else match.user1_id
+        user_anonymous_id = match.anonymous_id_1 if match.user1_id == user.id else match.anonymous_id_2
+        partner_anonymous_id = match.anonymous_id_2 if match.user1_id == user.id else match.anonymous_id_1
+        
+        # Get partner info with gender visibility based on subscription
+        partner = session.query(User).options(joinedload(User.profile)).filter_by(id=partner_id).first()
+        partner_profile = partner.profile if partner else None
+        
+        # Gender checks below may revert an expired premium; cached snapshots must follow
+        subscriptions = {viewer.telegram_id: viewer.subscription_type for viewer in (user, partner) if viewer}
+        
+        # Format gender display based on user's subscription
+        gender_display, can_see_gender_bool = format_gender_display(partner_profile, user, session) if partner_profile else ("Gender: Unknown", False)
+        
+        # Show additional info for owner
+        owner_info = ""
+        if is_owner(user) and partner_profile:
+            owner_info = f"\n\n👑 OWNER INFO:\n• Real Gender: {partner_profile.gender.value.title()}\n• Age: {partner_profile.age}\n• City: {partner_profile.city or 'Not specified'}"
+        
+        match_text = (
+            f"🎭 Match found! You're now connected with {partner_anonymous_id}\n\n"
+            f"Your anonymous ID: {user_anonymous_id}\n\n"
+            f"Partner Info:\n{gender_display}\n"
+            f"Age range: {partner_profile.min_age}-{partner_profile.max_age} (looking for {user.profile.min_age}-{user.profile.max_age})\n"
+            f"{owner_info}\n"
+            "Start chatting by sending a message! Remember:\n"
+            "• Stay respectful and kind\n"
+            "• You can end the chat anytime with /stop_chat\n"
+            "• Report inappropriate behavior with /report\n\n"
+            "Have fun getting to know each other! 💕"
+        )
+        
+        # Add premium upgrade button if user can't see gender
+        keyboard = []
+        if not can_see_gender_bool and not is_owner(user):
+            keyboard.append([InlineKeyboardButton("🔓 Upgrade to Premium", callback_data="upgrade_premium")])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        user_notice = (user.telegram_id, match_text, reply_markup)
+        
+        if not partner:
+            self._invalidate_changed_subscriptions(subscriptions, [user])
+            return user_notice, None
+        
+        # Format gender display for partner
+        partner_gender_display, partner_can_see = format_gender_display(user.profile, partner, session)
+        
+        # Show additional info for owner
+        partner_owner_info = ""
+        if is_owner(partner):
+            partner_owner_info = f"\n\n👑 OWNER INFO:\n• Real Gender: {user.profile.gender.value.title()}\n• Age: {user.profile.age}\n• City: {user.profile.city or 'Not specified'}"
+        
+        partner_text = (
+            f"🎭 You've been matched with {user_anonymous_id}!\n\n"
+            f"Your anonymous ID: {partner_anonymous_id}\n\n"
+            f"Partner Info:\n{partner_gender_display}\n"
+            f"Age range: {user.profile.min_age}-{user.profile.max_age} (looking for {partner_profile.min_age}-{partner_profile.max_age})\n"
+            f"{partner_owner_info}\n"
+            "Start chatting by sending a message! Remember:\n"
+            "• Stay respectful and kind\n"
+            "• You can end the chat anytime with /stop_chat\n"
+            "• Report inappropriate behavior with /report\n\n"
+            "Have fun getting to know each other! 💕"
+        )
+        
+        # Add premium upgrade button for partner if needed
+        partner_keyboard = []
+        if not partner_can_see and not is_owner(partner):
+            partner_keyboard.append([InlineKeyboardButton("🔓 Upgrade to Premium", callback_data="upgrade_premium")])
+        
+        partner_reply_markup = InlineKeyboardMarkup(partner_keyboard) if partner_keyboard else None
+        
+        self._invalidate_changed_subscriptions(subscriptions, [user, partner])
+        return user_notice, (partner.telegram_id, partner_text, partner_reply_markup)
+    
+    def _invalidate_changed_subscriptions(self, before, users):
+        for viewer in users:
+            if viewer.subscription_type != before[viewer.telegram_id]:
+                self.user_cache.invalidate(viewer.telegram_id)
+                peer_events.publish("user", viewer.telegram_id)
     
     async def stop_chat_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /stop_chat command"""
         try:
             telegram_id = str(update.effective_user.id)
             
-            with self.db.session() as session:
-                user = session.query(User).filter_by(telegram_id=telegram_id).first()
-                
-                if not user:
-                    await update.message.reply_text("Please use /start first to register.")
-                    return
-                
-                # Find active match
-                active_match = session.query(Match).filter(
-                    and_(
-                        or_(Match.user1_id == user.id, Match.user2_id == user.id),
-                        Match.status == MatchStatus.ACTIVE
-                    )
-                ).first()
-                
-                if not active_match:
-                    await update.message.reply_text("You're not currently in any chat.")
-                    return
-                
-                # End the match
-                active_match.status = MatchStatus.ENDED
-                active_match.ended_at = datetime.now(timezone.utc)
-                session.commit()
-                
-                # Notify both users
-                partner_id = active_match.user2_id if active_match.user1_id == user.id else active_match.user1_id
-                partner = session.query(User).filter_by(id=partner_id).first()
-                
-                await update.message.reply_text(
-                    "✋ Chat ended. Thanks for using Anonymous Dating Bot!\n\n"
-                    "Use /match to find a new connection whenever you're ready. 💕"
+            if self.waiting_room.leave(telegram_id):
+                self._reply(update, "👋 You've left the waiting room. Use /match whenever you're ready.")
+                return
+            
+            found_user, ended, partner_telegram_id = await self.database.run(self._stop_chat_tx, telegram_id)
+            
+            if not found_user:
+                self._reply(update, "Please use /start first to register.")
+                return
+            
+            if not ended:
+                self._reply(update, "You're not currently in any chat.")
+                return
+            
+            self._reply(update,
+                "✋ Chat ended. Thanks for using Anonymous Dating Bot!\n\n"
+                "Use /match to find a new connection whenever you're ready. 💕"
+            )
+            
+            if partner_telegram_id:
+                self.outbox.send(
+                    partner_telegram_id,
+                    "✋ Your chat partner has ended the conversation.\n\nUse /match to find a new connection! 💕",
+                    PRIORITY_MATCH_NOTICE
                 )
-                
-                if partner:
-                    await context.bot.send_message(
-                        chat_id=partner.telegram_id,
-                        text="✋ Your chat partner has ended the conversation.\n\nUse /match to find a new connection! 💕"
-                    )
         
         except Exception as e:
             logger.error(f"Error in stop_chat_command: {e}")
-            await update.message.reply_text("Sorry, couldn't end the chat. Please try again.")
+            self._reply(update, "Sorry, couldn't end the chat. Please try again.")
+    
+    def _stop_chat_tx(self, session, telegram_id):
+        """End the user's active match. Returns (found_user, ended, partner_telegram_id)."""
+        user = self.user_cache.load(session, telegram_id)
+        if not user:
+            return False, False, None
+        
+        # Find active match
+        active_match = get_active_match(session, user.id)
+        if not active_match:
+            return True, False, None
+        
+        # End the match
+        active_match.status = MatchStatus.ENDED
+        active_match.ended_at = datetime.now(timezone.utc)
+        session.commit()
+        self.routing_table.remove_match(active_match.id)
+        
+        partner_id = active_match.user2_id if active_match.user1_id == user.id else active_match.user1_id
+        self.matching_service.pool.refresh(session, [user.id, partner_id])
+        peer_events.publish("ended", active_match.id, [user.id, partner_id])
+        partner = session.query(User).filter_by(id=partner_id).first()
+        return True, True, partner.telegram_id if partner else None
     
     async def report_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /report command"""
-        await update.message.reply_text(
-            "🚨 To report inappropriate behavior:\n\n"
-            "1. Use this format: /report <reason>\n"
-            "   Example: /report harassment\n\n"
-            "2. Common reasons: harassment, spam, inappropriate content, fake profile\n\n"
-            "Your report will be reviewed and appropriate action will be taken."
-        )
+        if not context.args:
+            self._reply(update,
+                "🚨 To report inappropriate behavior:\n\n"
+                "1. Use this format: /report <reason>\n"
+                "   Example: /report harassment\n\n"
+                "2. Common reasons: harassment, spam, inappropriate content, fake profile\n\n"
+                "Your report will be reviewed and appropriate action will be taken."
+            )
+            return
+        
+        try:
+            telegram_id = str(update.effective_user.id)
+            
+            # Checked before any database work, so report spam costs nothing
+            decision = await self.report_limiter.hit(telegram_id)
+            if not decision:
+                self._reply(update,
+                    f"🚨 You've reached the limit of {Config.MAX_REPORTS_PER_DAY} reports per day.\n"
+                    "If someone is bothering you, use /block to stop them contacting you."
+                )
+                return
+            
+            reason, description = context.args[0], " ".join(context.args[1:]) or None
+            found_user, reported = await self.database.run(self._report_tx, telegram_id, reason, description)
+            
+            if not found_user:
+                self._reply(update, "Please use /start first to register.")
+                return
+            
+            if not reported:
+                self._reply(update, "There's no chat partner to report yet. Reports apply to your current or most recent chat.")
+                return
+            
+            self._reply(update,
+                "✅ Thanks, your report has been recorded and will be reviewed.\n\n"
+                "Use /block if you don't want to be matched with this user again."
+            )
+        
+        except Exception as e:
+            logger.error(f"Error in report_command: {e}")
+            self._reply(update, "Sorry, couldn't submit your report. Please try again.")
+    
+    def _report_tx(self, session, telegram_id, reason, description):
+        """Report the partner of the user's active or most recent match. Returns (found_user, reported)."""
+        user = self.user_cache.load(session, telegram_id)
+        if not user:
+            return False, False
+        
+        match = get_active_match(session, user.id) or session.query(Match).filter(
+            or_(Match.user1_id == user.id, Match.user2_id == user.id)
+        ).order_by(Match.created_at.desc()).first()
+        if not match:
+            return True, False
+        
+        session.add(Report(
+            reporter_id=user.id,
+            reported_id=match.user2_id if match.user1_id == user.id else match.user1_id,
+            match_id=match.id,
+            reason=reason[:200],
+            description=description[:Config.MAX_MESSAGE_LENGTH] if description else None,
+        ))
+        session.commit()
+        return True, True
     
     async def block_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /block command"""
         try:
             telegram_id = str(update.effective_user.id)
             
-            with self.db.session() as session:
-                user = session.query(User).filter_by(telegram_id=telegram_id).first()
-                
-                if not user:
-                    await update.message.reply_text("Please use /start first to register.")
-                    return
-                
-                # Find active match
-                active_match = session.query(Match).filter(
-                    and_(
-                        or_(Match.user1_id == user.id, Match.user2_id == user.id),
-                        Match.status == MatchStatus.ACTIVE
-                    )
-                ).first()
-                
-                if not active_match:
-                    await update.message.reply_text("You're not currently in any chat to block.")
-                    return
-                
-                # Block the user
-                partner_id = active_match.user2_id if active_match.user1_id == user.id else active_match.user1_id
-                
-                existing_block = session.query(BlockedUser).filter_by(
-                    blocker_id=user.id,
-                    blocked_id=partner_id
-                ).first()
-                
-                if not existing_block:
-                    blocked_user = BlockedUser(blocker_id=user.id, blocked_id=partner_id)
-                    session.add(blocked_user)
-                
-                # End the match
-                active_match.status = MatchStatus.BLOCKED
-                active_match.ended_at = datetime.now(timezone.utc)
-                session.commit()
-                
-                await update.message.reply_text(
-                    "🚫 User has been blocked and chat ended.\n\n"
-                    "You won't be matched with this user again.\n"
-                    "Use /match to find a new connection."
-                )
+            found_user, blocked = await self.database.run(self._block_tx, telegram_id)
+            
+            if not found_user:
+                self._reply(update, "Please use /start first to register.")
+                return
+            
+            if not blocked:
+                self._reply(update, "You're not currently in any chat to block.")
+                return
+            
+            self._reply(update,
+                "🚫 User has been blocked and chat ended.\n\n"
+                "You won't be matched with this user again.\n"
+                "Use /match to find a new connection."
+            )
         
         except Exception as e:
             logger.error(f"Error in block_command: {e}")
-            await update.message.reply_text("Sorry, couldn't block the user. Please try again.")
+            self._reply(update, "Sorry, couldn't block the user. Please try again.")
+    
+    def _block_tx(self, session, telegram_id):
+        """Block the current partner and end the match. Returns (found_user, blocked)."""
+        user = self.user_cache.load(session, telegram_id)
+        if not user:
+            return False, False
+        
+        # Find active match
+        active_match = get_active_match(session, user.id)
+        if not active_match:
+            return True, False
+        
+        # Block the user
+        partner_id = active_match.user2_id if active_match.user1_id == user.id else active_match.user1_id
+        
+        existing_block = session.query(BlockedUser).filter_by(
+            blocker_id=user.id,
+            blocked_id=partner_id
+        ).first()
+        
+        if not existing_block:
+            blocked_user = BlockedUser(blocker_id=user.id, blocked_id=partner_id)
+            session.add(blocked_user)
+        
+        # End the match
+        active_match.status = MatchStatus.BLOCKED
+        active_match.ended_at = datetime.now(timezone.utc)
+        session.commit()
+        self.routing_table.remove_match(active_match.id)
+        self.matching_service.exclusions.add_block(user.id, partner_id)
+        self.matching_service.pool.refresh(session, [user.id, partner_id])
+        peer_events.publish("blocked", user.id, partner_id)
+        peer_events.publish("ended", active_match.id, [user.id, partner_id])
+        return True, True
     
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle inline keyboard button callbacks"""
@@ -416,8 +656,11 @@ class BotHandlers:
     
     async def handle_gender_selection(self, query, context):
         """Handle gender selection during profile setup"""
+        telegram_id = str(query.from_user.id)
         gender = query.data.split("_")[1]
-        context.user_data["gender"] = gender
+        setup = await self.conversations.get(telegram_id) or {}
+        setup["gender"] = gender
+        await self.conversations.set(telegram_id, setup)
         
         text = (
             f"👍 Got it! You selected: {gender.title()}\n\n"
@@ -435,15 +678,18 @@ class BotHandlers:
     
     async def handle_looking_for_selection(self, query, context):
         """Handle 'looking for' selection during profile setup"""
+        telegram_id = str(query.from_user.id)
         looking_for = query.data.split("_")[1]
-        context.user_data["looking_for"] = looking_for
+        setup = await self.conversations.get(telegram_id) or {}
+        setup["looking_for"] = looking_for
         
         text = (
             f"✨ Perfect! Looking for: {looking_for.title()}\n\n"
             "Now please send me your age (just the number, like: 25)"
         )
         
-        context.user_data["setup_step"] = "age"
+        setup["setup_step"] = "age"
+        await self.conversations.set(telegram_id, setup)
         await query.edit_message_text(text)
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -451,93 +697,116 @@ class BotHandlers:
         try:
             telegram_id = str(update.effective_user.id)
             
-            # Check if user is in profile setup
-            if "setup_step" in context.user_data:
-                await self.handle_profile_setup_message(update, context)
+            # Flood control comes before any lookup or write
+            decision = await self.message_limiter.hit(telegram_id)
+            if not decision:
+                if decision.warn:
+                    self._reply(update,
+                        f"⏳ You're sending messages too fast. Please wait {math.ceil(decision.retry_after)} seconds; "
+                        "messages sent until then won't be delivered."
+                    )
                 return
             
-            with self.db.session() as session:
-                user = session.query(User).filter_by(telegram_id=telegram_id).first()
-                
-                if not user:
-                    await update.message.reply_text("Please use /start first to register.")
+            # Fast path: the routing table knows the partner without any queries
+            route = self.routing_table.get(telegram_id)
+            
+            # Check if user is in profile setup; a user with a route is only looked up if they began it here
+            if not route or self.conversations.might_have(telegram_id):
+                setup = await self.conversations.get(telegram_id)
+                if setup and "setup_step" in setup:
+                    await self.handle_profile_setup_message(update, setup)
                     return
+            
+            found_user = True
+            if not route:
+                found_user, route = await self.database.run(self._lookup_route_tx, telegram_id)
+            
+            if not found_user:
+                self._reply(update, "Please use /start first to register.")
+                return
+            
+            if route:
+                # Save message to database (buffered in batched mode)
+                await self.message_writer.write(route.match_id, route.user_id, route.partner_id, update.message.text)
+                
+                # Forward to partner
+                forward_text = f"💬 {route.anonymous_id}: {update.message.text}"
+                self.outbox.send(route.partner_telegram_id, forward_text, PRIORITY_RELAY)
+            elif route is None:
+                # No active match
+                keyboard = [[InlineKeyboardButton("Find Match 💕", callback_data="find_match")]]
+                reply_markup = InlineKeyboardMarkup(keyboard)
                 
-                # Check if user is in an active match
-                active_match = session.query(Match).filter(
-                    and_(
-                        or_(Match.user1_id == user.id, Match.user2_id == user.id),
-                        Match.status == MatchStatus.ACTIVE
-                    )
-                ).first()
-                
-                if active_match:
-                    # Forward message to partner
-                    partner_id = active_match.user2_id if active_match.user1_id == user.id else active_match.user1_id
-                    partner = session.query(User).filter_by(id=partner_id).first()
-                    
-                    if partner:
-                        # Save message to database
-                        message = Message(
-                            match_id=active_match.id,
-                            sender_id=user.id,
-                            receiver_id=partner_id,
-                            content=update.message.text
-                        )
-                        session.add(message)
-                        session.commit()
-                        
-                        # Get anonymous IDs
-                        sender_anonymous_id = active_match.anonymous_id_1 if active_match.user1_id == user.id else active_match.anonymous_id_2
-                        
-                        # Forward to partner
-                        forward_text = f"💬 {sender_anonymous_id}: {update.message.text}"
-                        await context.bot.send_message(chat_id=partner.telegram_id, text=forward_text)
-                else:
-                    # No active match
-                    keyboard = [[InlineKeyboardButton("Find Match 💕", callback_data="find_match")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    
-                    await update.message.reply_text(
-                        "You're not currently matched with anyone.\nWould you like to find a match?",
-                        reply_markup=reply_markup
-                    )
+                self._reply(update,
+                    "You're not currently matched with anyone.\nWould you like to find a match?",
+                    reply_markup=reply_markup
+                )
         
         except Exception as e:
             logger.error(f"Error in handle_message: {e}")
-            await update.message.reply_text("Sorry, something went wrong. Please try again.")
+            self._reply(update, "Sorry, something went wrong. Please try again.")
+    
+    def _lookup_route_tx(self, session, telegram_id):
+        """Find the route for a user missing from the routing table. Returns (found_user, route).
+
+        route is None when there's no active match, or False when the partner no
+        longer exists. An active match found here is added to the routing table.
+        """
+        user = self.user_cache.load(session, telegram_id)
+        if not user:
+            return False, None
+        
+        # Check if user is in an active match
+        active_match = get_active_match(session, user.id)
+        if not active_match:
+            return True, None
+        
+        partner_id = active_match.user2_id if active_match.user1_id == user.id else active_match.user1_id
+        partner = session.query(User).filter_by(id=partner_id).first()
+        if not partner:
+            return True, False
+        
+        if active_match.user1_id == user.id:
+            self.routing_table.add_match(active_match, user.telegram_id, partner.telegram_id)
+        else:
+            self.routing_table.add_match(active_match, partner.telegram_id, user.telegram_id)
+        
+        return True, self.routing_table.get(telegram_id)
     
-    async def handle_profile_setup_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle messages during profile setup"""
+    async def handle_profile_setup_message(self, update: Update, setup):
+        """Handle messages during profile setup; setup is the user's stored wizard state"""
         try:
-            step = context.user_data.get("setup_step")
+            telegram_id = str(update.effective_user.id)
+            step = setup.get("setup_step")
             
             if step == "age":
                 try:
                     age = int(update.message.text)
                     if age < 18 or age > 99:
-                        await update.message.reply_text("Please enter an age between 18 and 99.")
+                        self._reply(update, "Please enter an age between 18 and 99.")
                         return
                     
-                    context.user_data["age"] = age
-                    context.user_data["setup_step"] = "bio"
+                    setup["age"] = age
+                    setup["setup_step"] = "bio"
+                    await self.conversations.set(telegram_id, setup)
                     
-                    await update.message.reply_text(
+                    self._reply(update,
                         f"Great! Age: {age}\n\n"
                         "Now tell me a bit about yourself (bio). Keep it interesting but brief! "
                         "Or send 'skip' to skip this step."
                     )
                 except ValueError:
-                    await update.message.reply_text("Please enter a valid age number (like: 25)")
+                    self._reply(update, "Please enter a valid age number (like: 25)")
                     return
             
             elif step == "bio":
                 bio = update.message.text.strip()
                 if bio.lower() != "skip":
-                    context.user_data["bio"] = bio
+                    setup["bio"] = bio
                 
-                context.user_data["setup_step"] = "interests"
-                await update.message.reply_text(
+                setup["setup_step"] = "interests"
+                await self.conversations.set(telegram_id, setup)
+                self._reply(update,
                     "Perfect! Now tell me your interests (separated by commas).\n"
                     "Example: music, movies, hiking, cooking\n"
                     "Or send 'skip' to skip this step."
@@ -546,10 +815,11 @@ class BotHandlers:
             elif step == "interests":
                 interests = update.message.text.strip()
                 if interests.lower() != "skip":
-                    context.user_data["interests"] = interests
+                    setup["interests"] = interests
                 
-                context.user_data["setup_step"] = "city"
-                await update.message.reply_text(
+                setup["setup_step"] = "city"
+                await self.conversations.set(telegram_id, setup)
+                self._reply(update,
                     "Awesome! What city are you in?\n"
                     "This helps us find matches near you.\n"
                     "Or send 'skip' to skip this step."
@@ -558,66 +828,79 @@ class BotHandlers:
             elif step == "city":
                 city = update.message.text.strip()
                 if city.lower() != "skip":
-                    context.user_data["city"] = city
+                    setup["city"] = city
                 
                 # Complete profile setup
-                await self.complete_profile_setup(update, context)
+                await self.complete_profile_setup(update, setup)
         
         except Exception as e:
             logger.error(f"Error in profile setup: {e}")
-            await update.message.reply_text("Sorry, something went wrong. Please try /start again.")
+            self._reply(update, "Sorry, something went wrong. Please try /start again.")
     
-    async def complete_profile_setup(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def complete_profile_setup(self, update: Update, setup):
         """Complete the profile setup process"""
         try:
             telegram_id = str(update.effective_user.id)
             
-            with self.db.session() as session:
-                user = session.query(User).filter_by(telegram_id=telegram_id).first()
-                
-                if not user:
-                    await update.message.reply_text("Please use /start first to register.")
-                    return
-                
-                # Create or update profile
-                if user.profile:
-                    profile = user.profile
-                else:
-                    profile = UserProfile(user_id=user.id)
-                
-                profile.gender = Gender(context.user_data["gender"])
-                profile.looking_for = Gender(context.user_data["looking_for"])
-                profile.age = context.user_data["age"]
-                profile.bio = context.user_data.get("bio", "")
-                profile.interests = context.user_data.get("interests", "")
-                profile.city = context.user_data.get("city", "")
-                
-                if not user.profile:
-                    session.add(profile)
-                
-                user.is_registered = True
-                session.commit()
-                
-                # Clear setup data
-                context.user_data.clear()
-                
-                success_text = (
-                    "🎉 Profile setup complete!\n\n"
-                    f"Age: {profile.age}\n"
-                    f"Gender: {profile.gender.value.title()}\n"
-                    f"Looking for: {profile.looking_for.value.title()}\n"
-                    f"City: {profile.city or 'Not specified'}\n\n"
-                    "You're all set to start meeting people! 💕"
-                )
-                
-                keyboard = [[InlineKeyboardButton("Find My First Match! 💕", callback_data="find_match")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(success_text, reply_markup=reply_markup)
+            profile = await self.database.run(self._complete_profile_tx, telegram_id, setup)
+            
+            if not profile:
+                self._reply(update, "Please use /start first to register.")
+                return
+            
+            # Clear setup data
+            await self.conversations.delete(telegram_id)
+            
+            success_text = (
+                "🎉 Profile setup complete!\n\n"
+                f"Age: {profile.age}\n"
+                f"Gender: {profile.gender.value.title()}\n"
+                f"Looking for: {profile.looking_for.value.title()}\n"
+                f"City: {profile.city or 'Not specified'}\n\n"
+                "You're all set to start meeting people! 💕"
+            )
+            
+            keyboard = [[InlineKeyboardButton("Find My First Match! 💕", callback_data="find_match")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            self._reply(update, success_text, reply_markup=reply_markup)
         
         except Exception as e:
             logger.error(f"Error completing profile setup: {e}")
-            await update.message.reply_text("Sorry, couldn't complete your profile. Please try again.")
+            self._reply(update, "Sorry, couldn't complete your profile. Please try again.")
+    
+    def _complete_profile_tx(self, session, telegram_id, setup_data):
+        """Create or update the user's profile from the setup data"""
+        user = get_user(session, telegram_id)
+        if not user:
+            return None
+        
+        # Create or update profile
+        if user.profile:
+            profile = user.profile
+        else:
+            profile = UserProfile(user_id=user.id)
+        
+        profile.gender = Gender(setup_data["gender"])
+        profile.looking_for = Gender(setup_data["looking_for"])
+        profile.age = setup_data["age"]
+        profile.bio = setup_data.get("bio", "")
+        profile.interests = setup_data.get("interests", "")
+        profile.interest_ids = encode_interests(session, profile.interests)  # Normalized once, here
+        profile.city = setup_data.get("city", "")
+        
+        if not user.profile:
+            user.profile = profile
+        
+        user.is_registered = True
+        session.commit()
+        self.user_cache.put(user)
+        
+        # Make the new or edited profile visible to matching
+        self.matching_service.pool.refresh(session, [user.id])
+        peer_events.publish("user", user.telegram_id)
+        peer_events.publish("refresh", [user.id])
+        return profile
     
     async def find_match_callback(self, query, context):
         """Handle find match button callback"""
@@ -687,30 +970,38 @@ class BotHandlers:
         """Handle /premium command"""
         telegram_id = str(update.effective_user.id)
         
-        with self.db.session() as session:
-            user = session.query(User).filter_by(telegram_id=telegram_id).first()
-            
-            if not user:
-                await update.message.reply_text("Please use /start first to register.")
-                return
-            
-            can_see, reason = can_see_gender(user, session)
-            
-            if user.subscription_type == SubscriptionType.OWNER:
-                status_text = "👑 OWNER STATUS\n\nYou have full access to all features including:\n• Unlimited gender visibility\n• All user data access\n• Premium features\n• Administrative controls"
-            elif user.subscription_type == SubscriptionType.PREMIUM:
-                if user.premium_expires_at:
-                    expires = user.premium_expires_at.strftime("%Y-%m-%d")
-                    status_text = f"💎 PREMIUM ACTIVE\n\nYour premium subscription expires on: {expires}\n\nPremium benefits:\n• Unlimited gender visibility\n• Priority matching\n• Advanced filters\n• No ads"
-                else:
-                    status_text = "💎 PREMIUM ACTIVE\n\nYou have premium access with unlimited features!"
+        user = await self.database.run(self._premium_tx, telegram_id)
+        
+        if not user:
+            self._reply(update, "Please use /start first to register.")
+            return
+        
+        if user.subscription_type == SubscriptionType.OWNER:
+            status_text = "👑 OWNER STATUS\n\nYou have full access to all features including:\n• Unlimited gender visibility\n• All user data access\n• Premium features\n• Administrative controls"
+        elif user.subscription_type == SubscriptionType.PREMIUM:
+            if user.premium_expires_at:
+                expires = user.premium_expires_at.strftime("%Y-%m-%d")
+                status_text = f"💎 PREMIUM ACTIVE\n\nYour premium subscription expires on: {expires}\n\nPremium benefits:\n• Unlimited gender visibility\n• Priority matching\n• Advanced filters\n• No ads"
             else:
-                views_left = max(0, Config.FREE_GENDER_VIEWS - user.gender_views_used)
-                status_text = f"🆓 FREE ACCOUNT\n\nGender views remaining: {views_left}/{Config.FREE_GENDER_VIEWS}\n\n{get_premium_info_text()}"
-            
-            keyboard = []
-            if user.subscription_type == SubscriptionType.FREE:
-                keyboard.append([InlineKeyboardButton("💎 Upgrade to Premium", callback_data="upgrade_premium")])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
-            await update.message.reply_text(status_text, reply_markup=reply_markup)
+                status_text = "💎 PREMIUM ACTIVE\n\nYou have premium access with unlimited features!"
+        else:
+            views_left = max(0, Config.FREE_GENDER_VIEWS - user.gender_views_used)
+            status_text = f"🆓 FREE ACCOUNT\n\nGender views remaining: {views_left}/{Config.FREE_GENDER_VIEWS}\n\n{get_premium_info_text()}"
+        
+        keyboard = []
+        if user.subscription_type == SubscriptionType.FREE:
+            keyboard.append([InlineKeyboardButton("💎 Upgrade to Premium", callback_data="upgrade_premium")])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        self._reply(update, status_text, reply_markup=reply_markup)
+    
+    def _premium_tx(self, session, telegram_id):
+        user = session.query(User).filter_by(telegram_id=telegram_id).first()
+        if user:
+            # Reverts expired premium subscriptions
+            subscription_type = user.subscription_type
+            can_see_gender(user, session)
+            if user.subscription_type != subscription_type:
+                self.user_cache.invalidate(telegram_id)
+                peer_events.publish("user", telegram_id)
+        return user
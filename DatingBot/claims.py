@@ -0,0 +1,50 @@
+import threading
+from contextlib import contextmanager
+from models import User
+
+class ClaimTable:
+    """Users some thread in this process is currently pairing.
+    
+    A claim is taken before a user is checked and matched, and released after
+    the match is committed, so two concurrent searches can never both pick
+    the same user. Claims never block: a user someone else holds is simply
+    skipped. Across processes, lock_users() adds the database-level guarantee.
+    """
+
+    def __init__(self):
+        self._claimed = set()
+        self._lock = threading.Lock()
+        self.conflicts = 0
+    
+    def __len__(self):
+        return len(self._claimed)
+    
+    @contextmanager
+    def hold(self, user_id):
+        """Yields True if the user was claimed for the block, False if already held"""
+        with self._lock:
+            claimed = user_id not in self._claimed
+            if claimed:
+                self._claimed.add(user_id)
+            else:
+                self.conflicts += 1
+        try:
+            yield claimed
+        finally:
+            if claimed:
+                with self._lock:
+                    self._claimed.discard(user_id)
+
+def lock_users(session, user_ids):
+    """Row-lock the given users until the transaction ends, skipping rows other transactions hold.
+    
+    SELECT ... FOR UPDATE SKIP LOCKED on Postgres; a no-op on SQLite, which
+    has no row locks (the ClaimTable covers it within the process). Returns
+    False if any of the rows is locked elsewhere.
+    """
+    return len(locked_user_ids(session, user_ids)) == len(set(user_ids))
+
+def locked_user_ids(session, user_ids):
+    """Like lock_users(), but returns the ids that were locked"""
+    rows = session.query(User.id).filter(User.id.in_(user_ids)).with_for_update(skip_locked=True).all()
+    return {user_id for (user_id,) in rows}
@@ -0,0 +1,203 @@
+"""Multi-worker mode: one front process, N bot worker processes.
+
+The front process serves /webhook and hands each update's raw JSON to the
+worker that owns its user (user id modulo the worker count), so all of a
+user's updates are handled in order by one process. Every worker runs the
+full bot: its own Application, update dispatcher, database pool and caches.
+
+Caches are per worker, so a worker that changes something another worker may
+have cached publishes a peer event (see PeerEvents); the front process fans
+events out to every other worker, which applies them to its own caches.
+
+Workers are forked from the front process after the database is initialized
+(fork start method, so Linux/macOS only).
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from telegram import Update
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# How long a peer event may wait for room in a full worker inbox before it is dropped
+EVENT_PUT_TIMEOUT = 1.0
+
+# Update fields that carry the acting user under "from" (or "user")
+USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request",
+    "poll_answer", "business_message", "edited_business_message", "message_reaction",
+)
+
+def partition_key(data):
+    """The id of the user an update's JSON is from, else its update_id"""
+    for field in USER_FIELDS:
+        payload = data.get(field)
+        if payload:
+            sender = payload.get("from") or payload.get("user")
+            if sender and "id" in sender:
+                return sender["id"]
+    return data.get("update_id") or 0
+
+class PeerEvents:
+    """Publishes this worker's cache changes to the other workers.
+    
+    A no-op until connect() is called in a cluster worker. Events are small
+    tuples (kind, args) applied by BotHandlers.apply_peer_event:
+
+      user      (telegram_id,)                      cached user snapshot is stale
+      matched   (match_id, user1_id, user2_id, at)  both users left the pool
+      ended     (match_id, user_ids)                route gone, users may be available again
+      blocked   (blocker_id, blocked_id)            exclusion sets gained a block
+      refresh   (user_ids,)                         availability or profile changed
+    """
+
+    def __init__(self):
+        self._bus = None
+        self._index = None
+        self.published = 0
+    
+    def connect(self, bus, index):
+        self._bus = bus
+        self._index = index
+    
+    def publish(self, kind, *args):
+        if self._bus is not None:
+            self._bus.put((self._index, kind, args))
+            self.published += 1
+
+peer_events = PeerEvents()
+
+class WorkerCluster:
+    """Front-process side of multi-worker mode.
+    
+    target(index, workers, inbox, bus) is run in each forked worker process;
+    it serves the inbox with serve_inbox(). Inboxes are bounded: when a
+    worker falls behind, submit() returns False and the webhook answers 503
+    so Telegram retries later.
+    """
+
+    def __init__(self, target, workers=None, queue_size=None):
+        self.target = target
+        self.workers = workers or Config.WORKERS
+        self.queue_size = queue_size or Config.WORKER_QUEUE_SIZE
+        self._context = multiprocessing.get_context("fork")
+        self._inboxes = []
+        self._processes = []
+        self._bus = None
+        self._relay = None
+        
+        self._stalled = [False] * self.workers  # Workers whose last event put timed out
+        
+        self.submitted = [0] * self.workers
+        self.dropped = 0
+        self.events_relayed = 0
+        self.events_dropped = [0] * self.workers
+    
+    def start(self):
+        self._bus = self._context.Queue()
+        for index in range(self.workers):
+            inbox = self._context.Queue(maxsize=self.queue_size)
+            process = self._context.Process(target=self.target, args=(index, self.workers, inbox, self._bus),
+                                            name=f"bot-worker-{index}", daemon=True)
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        
+        self._relay = threading.Thread(target=self._relay_events, name="peer-events", daemon=True)
+        self._relay.start()
+        logger.info(f"Started {self.workers} bot worker processes")
+    
+    def stop(self, timeout=30):
+        """Ask every worker to finish its queued updates and shut down"""
+        for inbox, process in zip(self._inboxes, self._processes):
+            if process.is_alive():
+                try:
+                    inbox.put(None, timeout=EVENT_PUT_TIMEOUT)
+                except queue.Full:
+                    pass  # A stuck worker is terminated below
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time; terminating it")
+                process.terminate()
+        self._bus.put(None)
+        self._relay.join(timeout)
+    
+    def worker_for(self, data):
+        return partition_key(data) % self.workers
+    
+    def submit(self, data):
+        """Queue an update's JSON for its user's worker. Returns False if that worker is backed up."""
+        index = self.worker_for(data)
+        try:
+            self._inboxes[index].put_nowait(("update", data))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted[index] += 1
+        return True
+    
+    def _relay_events(self):
+        while True:
+            event = self._bus.get()
+            if event is None:
+                return
+            source, kind, args = event
+            for index, (inbox, process) in enumerate(zip(self._inboxes, self._processes)):
+                if index == source or not process.is_alive():
+                    continue
+                self._deliver_event(index, inbox, ("event", kind, args))
+            self.events_relayed += 1
+    
+    def _deliver_event(self, index, inbox, item):
+        """Queue an event for one worker without letting a stuck worker hold up the others.
+        
+        A worker whose last put timed out only gets events there is room for
+        right away, until one fits again. Dropped events leave that worker's
+        caches stale; the database checks at match time still keep pairing
+        correct.
+        """
+        try:
+            if self._stalled[index]:
+                inbox.put_nowait(item)
+            else:
+                inbox.put(item, timeout=EVENT_PUT_TIMEOUT)
+        except queue.Full:
+            if not self._stalled[index]:
+                logger.warning(f"bot-worker-{index} is not taking peer events; dropping them until it catches up")
+            self._stalled[index] = True
+            self.events_dropped[index] += 1
+            return
+        self._stalled[index] = False
+    
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for process in self._processes if process.is_alive()),
+            "submitted": list(self.submitted),
+            "queue_depths": [inbox.qsize() for inbox in self._inboxes],
+            "dropped": self.dropped,
+            "events_relayed": self.events_relayed,
+            "events_dropped": list(self.events_dropped),
+        }
+
+def serve_inbox(inbox, dispatcher, bot, apply_event):
+    """Worker loop: feed updates to the dispatcher and peer events to apply_event(kind, args) until None"""
+    while True:
+        item = inbox.get()
+        if item is None:
+            return
+        
+        if item[0] == "update":
+            update = Update.de_json(item[1], bot)
+            # A full dispatcher holds the inbox back, which makes the front answer 503
+            while not dispatcher.submit(update):
+                time.sleep(0.01)
+        else:
+            _, kind, args = item
+            asyncio.run_coroutine_threadsafe(apply_event(kind, args), dispatcher.loop)
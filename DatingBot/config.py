@@ -5,9 +5,17 @@ class Config:
     # Bot Configuration
     TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
     WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+    TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "").rstrip("/")  # Empty means api.telegram.org
     
     # Database Configuration
     DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///anonymous_dating.db")
+    DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", 10))  # Threads for blocking DB work; keep <= pool size + overflow
+    MESSAGE_PERSISTENCE = os.environ.get("MESSAGE_PERSISTENCE", "batched").lower()  # "sync" or "batched"
+    MESSAGE_BATCH_SIZE = int(os.environ.get("MESSAGE_BATCH_SIZE", 100))  # Flush after this many buffered messages
+    MESSAGE_FLUSH_INTERVAL_MS = int(os.environ.get("MESSAGE_FLUSH_INTERVAL_MS", 200))  # ...or after this long
+    MESSAGE_BUFFER_MAX = int(os.environ.get("MESSAGE_BUFFER_MAX", 10000))  # Relays wait for a flush beyond this
+    MESSAGE_BUFFER_LIMIT = int(os.environ.get("MESSAGE_BUFFER_LIMIT", 100000))  # While writes fail, the oldest messages beyond this are dropped
+    MESSAGE_RETRY_MAX_SECONDS = float(os.environ.get("MESSAGE_RETRY_MAX_SECONDS", 30))  # Longest backoff between failed flushes
     
     # Flask Configuration
     SECRET_KEY = os.environ.get("FLASK_SECRET_KEY", "anonymous_dating_bot_secret_key")
@@ -16,6 +24,7 @@ class Config:
     DEBUG = os.environ.get("DEBUG", "False").lower() == "true"
     PORT = int(os.environ.get("PORT", 5000))
     HOST = "0.0.0.0"
+    SERVER_MODE = os.environ.get("SERVER_MODE", "flask").lower()  # "flask" or "asgi"
     
     # Owner Configuration (your Telegram ID)
     OWNER_TELEGRAM_ID = os.environ.get("OWNER_TELEGRAM_ID", "")
@@ -34,7 +43,10 @@ class Config:
     MAX_MATCH_RETRIES = 5
     MATCH_COOLDOWN_HOURS = 1  # How long to wait before allowing new match after ending one
     INACTIVE_MATCH_HOURS = 24  # How long before ending inactive matches
+    MATCH_SWEEP_INTERVAL_SECONDS = float(os.environ.get("MATCH_SWEEP_INTERVAL_SECONDS", 300))  # How often idle matches are looked for
     RECENT_MATCH_DAYS = 7  # Don't rematch with users from last N days
+    EXCLUSION_CACHE_SIZE = int(os.environ.get("EXCLUSION_CACHE_SIZE", 50000))  # Users whose block/recent-match sets stay cached
+    EXCLUSION_BLOOM_THRESHOLD = int(os.environ.get("EXCLUSION_BLOOM_THRESHOLD", 10000))  # Block lists larger than this are kept as a Bloom filter
     
     # Privacy & Safety
     MAX_BIO_LENGTH = 500
@@ -43,13 +55,46 @@ class Config:
     MIN_AGE = 18
     MAX_AGE = 99
     
+    # Content Moderation
+    MODERATION_RULES_FILE = os.environ.get("MODERATION_RULES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "moderation_rules.txt"))  # Word/pattern rules by category
+    MODERATION_RELOAD_SECONDS = float(os.environ.get("MODERATION_RELOAD_SECONDS", 10))  # How often the rule file is checked for changes; 0 disables reloading
+    
+    # Profile setup state
+    CONVERSATION_STATE_STORE = os.environ.get("CONVERSATION_STATE_STORE", "")  # "memory", "database" (DATABASE_URL) or a separate SQLAlchemy URL; unset: "memory" with one worker, else "database"
+    CONVERSATION_STATE_TTL_MINUTES = int(os.environ.get("CONVERSATION_STATE_TTL_MINUTES", 60))  # Forget a half-finished signup after this long
+    
     # Anonymous ID Configuration
     ANONYMOUS_ID_LENGTH = 8
     ANONYMOUS_ID_PREFIX = "User"
     
+    # User Cache
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 100000))  # User/profile snapshots kept in memory
+    USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", 300))  # Snapshots are reloaded after this long
+    
+    # Update Dispatching
+    DISPATCHER_WORKERS = int(os.environ.get("DISPATCHER_WORKERS", 8))  # Worker shards; each user maps to one shard
+    UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", 1000))  # Max updates waiting to be processed
+    UPDATE_DEDUP_WINDOW = int(os.environ.get("UPDATE_DEDUP_WINDOW", 10000))  # Recent update_ids remembered
+    UPDATE_HWM_FILE = os.environ.get("UPDATE_HWM_FILE", "")  # Optional file persisting the highest update_id seen
+    WORKERS = int(os.environ.get("WORKERS", 1))  # Bot worker processes behind the webhook (flask mode); users are partitioned by id
+    WORKER_QUEUE_SIZE = int(os.environ.get("WORKER_QUEUE_SIZE", 1000))  # Updates waiting for one worker process before the webhook answers 503
+    
+    # Waiting room for /match
+    MATCH_QUEUE_INTERVAL_SECONDS = float(os.environ.get("MATCH_QUEUE_INTERVAL_SECONDS", 2))  # How often queued users are retried
+    MATCH_QUEUE_TIMEOUT_MINUTES = int(os.environ.get("MATCH_QUEUE_TIMEOUT_MINUTES", 30))  # Give up on a queued user after this long
+    PREMIUM_LANE_WEIGHT = int(os.environ.get("PREMIUM_LANE_WEIGHT", 3))  # Queued premium users served per free user
+    MATCH_BATCH_MODE = os.environ.get("MATCH_BATCH_MODE", "False").lower() == "true"  # Queue every /match and pair the queue in periodic batch rounds
+    
+    # Outbound Telegram limits
+    OUTBOUND_GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", 30))  # Messages per second across all chats
+    OUTBOUND_PER_CHAT_RATE = float(os.environ.get("OUTBOUND_PER_CHAT_RATE", 1))  # Messages per second to one chat
+    OUTBOUND_PER_CHAT_BURST = int(os.environ.get("OUTBOUND_PER_CHAT_BURST", 3))  # Short bursts allowed per chat
+    
     # Rate Limiting
-    MAX_MESSAGES_PER_MINUTE = 10
-    MAX_REPORTS_PER_DAY = 5
+    MAX_MESSAGES_PER_MINUTE = int(os.environ.get("MAX_MESSAGES_PER_MINUTE", 10))  # Chat messages one user may send; 0 disables the limit
+    MAX_REPORTS_PER_DAY = int(os.environ.get("MAX_REPORTS_PER_DAY", 5))  # Reports one user may file; 0 disables the limit
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))  # Users tracked per limiter before the least recent are dropped
+    RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL")  # Share limits across processes through Redis (optional)
     
     # Logging
     LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
@@ -0,0 +1,176 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import create_engine, select, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from config import Config
+from database import DatabaseExecutor
+from models import ConversationState
+
+logger = logging.getLogger(__name__)
+
+class MemoryStateStore:
+    """Conversation state in this process only; lost on restart.
+    
+    Entries are kept in write order, so expired ones are always at the front
+    and are dropped as new state is written.
+    """
+
+    def __init__(self, ttl_seconds=None):
+        self.ttl = ttl_seconds or Config.CONVERSATION_STATE_TTL_MINUTES * 60
+        self._entries = OrderedDict()  # telegram_id -> (data, expires_at)
+        
+        self.writes = 0
+        self.expired = 0
+    
+    def might_have(self, telegram_id):
+        return str(telegram_id) in self._entries
+    
+    async def get(self, telegram_id):
+        entry = self._entries.get(str(telegram_id))
+        if entry is None:
+            return None
+        data, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[str(telegram_id)]
+            self.expired += 1
+            return None
+        return dict(data)
+    
+    async def set(self, telegram_id, data):
+        now = time.monotonic()
+        self._entries[str(telegram_id)] = (dict(data), now + self.ttl)
+        self._entries.move_to_end(str(telegram_id))
+        self.writes += 1
+        
+        while self._entries:
+            _, expires_at = next(iter(self._entries.values()))
+            if expires_at >= now:
+                break
+            self._entries.popitem(last=False)
+            self.expired += 1
+    
+    async def delete(self, telegram_id):
+        self._entries.pop(str(telegram_id), None)
+    
+    async def close(self):
+        pass
+    
+    def stats(self):
+        return {"backend": "memory", "entries": len(self._entries), "writes": self.writes, "expired": self.expired}
+
+class SqlStateStore:
+    """Conversation state in a conversation_states table (SQLite file or Postgres).
+    
+    Each step is one upsert of a compact JSON row, so any process sharing the
+    database can continue a user's signup. Expired rows are ignored on read
+    and deleted in one statement at most every purge_seconds.
+    
+    Other processes' writes are only visible through get(); might_have()
+    answers for state written by this process, which lets callers skip the
+    lookup for users who are certainly not mid-signup here.
+    """
+
+    def __init__(self, database, ttl_seconds=None, purge_seconds=None):
+        self.database = database
+        self.ttl = ttl_seconds or Config.CONVERSATION_STATE_TTL_MINUTES * 60
+        self.purge_seconds = purge_seconds or max(60, self.ttl / 4)
+        self._local = set()  # telegram_ids with state written by this process
+        self._next_purge = 0.0
+        self._owns_database = False
+        
+        self.reads = 0
+        self.writes = 0
+        self.purged = 0
+    
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """A store on its own database, e.g. sqlite:////var/lib/bot/state.db"""
+        engine = create_engine(url, pool_pre_ping=True)
+        ConversationState.__table__.create(engine, checkfirst=True)
+        store = cls(DatabaseExecutor(engine, max_workers=2), **kwargs)
+        store._owns_database = True
+        return store
+    
+    def might_have(self, telegram_id):
+        return str(telegram_id) in self._local
+    
+    async def get(self, telegram_id):
+        self.reads += 1
+        data = await self.database.run(self._get_tx, str(telegram_id))
+        if data is None:
+            self._local.discard(str(telegram_id))
+        return data
+    
+    async def set(self, telegram_id, data):
+        now = time.monotonic()
+        purge = now >= self._next_purge
+        if purge:
+            self._next_purge = now + self.purge_seconds
+        
+        self.purged += await self.database.run(self._set_tx, str(telegram_id), json.dumps(data, separators=(",", ":")), purge)
+        self._local.add(str(telegram_id))
+        self.writes += 1
+    
+    async def delete(self, telegram_id):
+        self._local.discard(str(telegram_id))
+        await self.database.run(self._delete_tx, str(telegram_id))
+    
+    async def close(self):
+        if self._owns_database:
+            self.database.close()
+            self.database.engine.dispose()
+    
+    def _get_tx(self, session, telegram_id):
+        data = session.execute(
+            select(ConversationState.data).where(
+                ConversationState.telegram_id == telegram_id,
+                ConversationState.expires_at > datetime.now(timezone.utc),
+            )
+        ).scalar()
+        return json.loads(data) if data else None
+    
+    def _set_tx(self, session, telegram_id, data, purge):
+        """Upsert the state, first deleting expired rows if purge; returns how many were deleted"""
+        now = datetime.now(timezone.utc)
+        purged = 0
+        if purge:
+            purged = session.execute(delete(ConversationState).where(ConversationState.expires_at <= now)).rowcount
+        
+        dialect = postgresql if session.bind.dialect.name == "postgresql" else sqlite
+        values = {"data": data, "expires_at": now + timedelta(seconds=self.ttl)}
+        session.execute(
+            dialect.insert(ConversationState).values(telegram_id=telegram_id, **values)
+            .on_conflict_do_update(index_elements=[ConversationState.telegram_id], set_=values)
+        )
+        session.commit()
+        return purged
+    
+    def _delete_tx(self, session, telegram_id):
+        session.execute(delete(ConversationState).where(ConversationState.telegram_id == telegram_id))
+        session.commit()
+    
+    def stats(self):
+        return {
+            "backend": self.database.engine.dialect.name,
+            "local_entries": len(self._local),
+            "reads": self.reads,
+            "writes": self.writes,
+            "purged": self.purged,
+        }
+
+def create_store(database):
+    """The store CONVERSATION_STATE_STORE asks for: "memory", "database" (the
+    bot's own database) or a SQLAlchemy URL for a separate one.
+    
+    Unset, a single worker keeps state in memory; with several workers a
+    user's next answer may reach another process, so it goes to the database.
+    """
+    setting = Config.CONVERSATION_STATE_STORE or ("memory" if Config.WORKERS <= 1 else "database")
+    if setting == "memory":
+        return MemoryStateStore()
+    if setting == "database":
+        return SqlStateStore(database)
+    return SqlStateStore.from_url(setting)
@@ -0,0 +1,37 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import sessionmaker
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class DatabaseExecutor:
+    """Runs blocking database work on a bounded thread pool.
+
+    Handlers are coroutines on the update loop; a synchronous query or commit
+    there stalls every other update. Work functions take a session as their
+    first argument and run on a pool thread with a session of their own.
+    Sessions don't expire on commit, so returned objects keep their loaded
+    columns after the session closes (relationships must be loaded inside).
+    """
+
+    def __init__(self, engine, max_workers=None):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine, expire_on_commit=False)
+        self.max_workers = max_workers or Config.DB_EXECUTOR_WORKERS
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+    
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(session, *args, **kwargs) on the pool and return its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self.run_sync, fn, *args, **kwargs))
+    
+    def run_sync(self, fn, *args, **kwargs):
+        """Run fn(session, *args, **kwargs) in the calling thread"""
+        with self.Session() as session:
+            return fn(session, *args, **kwargs)
+    
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,88 @@
+import logging
+import os
+from collections import deque
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class UpdateDeduplicator:
+    """Remembers recent update_ids so redelivered updates are dropped.
+
+    Telegram redelivers an update when the webhook answers slowly. The last
+    `window` accepted ids are kept in a ring buffer plus a set for O(1)
+    membership tests. Optionally the highest accepted id is persisted to
+    `hwm_path`, so after a restart anything at or below it is dropped too.
+
+    Not thread-safe on its own; the dispatcher calls it under its lock.
+    """
+
+    def __init__(self, window=None, hwm_path=None, save_every=100):
+        self.window = window or Config.UPDATE_DEDUP_WINDOW
+        self.hwm_path = Config.UPDATE_HWM_FILE if hwm_path is None else hwm_path
+        self.save_every = save_every
+        
+        self._ring = deque()
+        self._seen = set()
+        self.high_water_mark = 0
+        self._restored_hwm = self._load()
+        self._unsaved = 0
+        
+        self.duplicates = 0
+    
+    def _load(self):
+        if not self.hwm_path or not os.path.exists(self.hwm_path):
+            return 0
+        try:
+            with open(self.hwm_path) as f:
+                hwm = int(f.read().strip() or 0)
+            logger.info(f"Restored update high-water mark {hwm}")
+            self.high_water_mark = hwm
+            return hwm
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading update high-water mark: {e}")
+            return 0
+    
+    def is_duplicate(self, update_id):
+        """Check an update id without recording it; counts the duplicates found"""
+        if update_id in self._seen or (update_id is not None and update_id <= self._restored_hwm):
+            self.duplicates += 1
+            return True
+        return False
+    
+    def record(self, update_id):
+        """Remember an accepted update id"""
+        if update_id is None:
+            return
+        
+        self._seen.add(update_id)
+        self._ring.append(update_id)
+        if len(self._ring) > self.window:
+            self._seen.discard(self._ring.popleft())
+        
+        if update_id > self.high_water_mark:
+            self.high_water_mark = update_id
+            self._unsaved += 1
+    
+    def needs_save(self):
+        return bool(self.hwm_path) and self._unsaved >= self.save_every
+    
+    def save(self):
+        """Persist the high-water mark (no-op without hwm_path)"""
+        if not self.hwm_path or not self._unsaved:
+            return
+        
+        try:
+            tmp_path = f"{self.hwm_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(self.high_water_mark))
+            os.replace(tmp_path, self.hwm_path)
+            self._unsaved = 0
+        except OSError as e:
+            logger.error(f"Error saving update high-water mark: {e}")
+    
+    def stats(self):
+        return {
+            "window": len(self._ring),
+            "high_water_mark": self.high_water_mark,
+            "duplicates_dropped": self.duplicates,
+        }
@@ -0,0 +1,236 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+from config import Config
+from dedup import UpdateDeduplicator
+
+logger = logging.getLogger(__name__)
+
+class _Shard:
+    """FIFO of (update, enqueued_at) pairs drained by a single worker task"""
+
+    def __init__(self):
+        self.items = collections.deque()
+        self.wakeup = asyncio.Event()
+    
+    def put(self, item):
+        self.items.append(item)
+        self.wakeup.set()
+    
+    async def get(self):
+        while not self.items:
+            self.wakeup.clear()
+            await self.wakeup.wait()
+        return self.items.popleft()
+    
+    def head_wait(self, now):
+        """How long the oldest queued update has been waiting"""
+        try:
+            return now - self.items[0][1]
+        except IndexError:
+            # Empty, or emptied by the loop since stats() (metrics thread) looked
+            return 0.0
+
+class UpdateDispatcher:
+    """Long-lived asyncio loop that feeds Telegram updates to the bot application.
+
+    The webhook hands updates over through a bounded queue instead of spinning up
+    a thread and an event loop per request, so the bot's HTTP client and
+    connection pool are shared by every update.
+
+    Updates are hash-partitioned by user id over one shard per worker: a user's
+    updates are processed strictly in order, different users run in parallel.
+    """
+
+    def __init__(self, application, workers=None, max_queue_size=None, on_startup=None, on_shutdown=None,
+                 deduplicator=None):
+        self.application = application
+        self.deduplicator = deduplicator or UpdateDeduplicator()
+        self.on_startup = on_startup or []  # Coroutine functions run on the loop once the application is initialized
+        self.on_shutdown = on_shutdown or []  # ...and before it is shut down
+        self.workers = workers or Config.DISPATCHER_WORKERS
+        self.max_queue_size = max_queue_size or Config.UPDATE_QUEUE_SIZE
+        
+        self._loop = None
+        self._thread = None
+        self._shards = []
+        self._tasks = []
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = 0
+        
+        # Counters
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self._wait_total = 0.0
+        self._processing_total = 0.0
+        self._processing_max = 0.0
+        self._wait_max = 0.0
+    
+    @property
+    def loop(self):
+        return self._loop
+    
+    def start(self):
+        """Start the dispatcher loop in a background thread and wait until it is ready"""
+        if self._thread:
+            return
+        
+        self._thread = threading.Thread(target=self._run_loop, name="update-dispatcher", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        logger.info(f"Update dispatcher started with {self.workers} workers (queue size {self.max_queue_size})")
+    
+    async def start_async(self):
+        """Start the dispatcher on the running loop (ASGI mode)"""
+        self._loop = asyncio.get_running_loop()
+        await self._startup()
+        self._ready.set()
+        logger.info(f"Update dispatcher started with {self.workers} workers (queue size {self.max_queue_size})")
+    
+    async def stop_async(self):
+        """Stop the dispatcher started with start_async"""
+        await self._shutdown()
+    
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._startup())
+        finally:
+            self._ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+    
+    async def _startup(self):
+        self._shards = [_Shard() for _ in range(self.workers)]
+        await self.application.initialize()
+        for hook in self.on_startup:
+            await hook()
+        self._tasks = [asyncio.create_task(self._worker(shard)) for shard in self._shards]
+    
+    async def _shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for hook in self.on_shutdown:
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Error in dispatcher shutdown hook: {e}")
+        await self.application.shutdown()
+        self.deduplicator.save()
+    
+    def stop(self, timeout=10):
+        """Stop the workers, shut the application down and close the loop"""
+        if not self._thread:
+            return
+        
+        try:
+            self.run_coroutine(self._shutdown(), timeout=timeout)
+        except Exception as e:
+            logger.error(f"Error shutting down update dispatcher: {e}")
+        
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+    
+    def run_coroutine(self, coro, timeout=None):
+        """Run a coroutine on the dispatcher loop from another thread and return its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+    
+    def submit(self, update):
+        """Queue an update for processing. Returns False if the queue is full.
+
+        Redelivered updates (an update_id seen recently) are dropped here,
+        before any handler runs, and reported as accepted so Telegram stops
+        retrying them. Safe to call from any thread, including the dispatcher
+        loop itself.
+        """
+        update_id = getattr(update, "update_id", None)
+        with self._lock:
+            if self.deduplicator.is_duplicate(update_id):
+                return True
+            if self._pending >= self.max_queue_size:
+                self.dropped += 1
+                return False
+            self.deduplicator.record(update_id)
+            self._pending += 1
+            self.submitted += 1
+            save_hwm = self.deduplicator.needs_save()
+        
+        if save_hwm:
+            self.deduplicator.save()
+        
+        shard = self._shards[self.shard_for(update)]
+        self._loop.call_soon_threadsafe(shard.put, (update, time.monotonic()))
+        return True
+    
+    def shard_for(self, update):
+        """Pick the shard for an update: by user, falling back to chat, then update id"""
+        if getattr(update, "effective_user", None):
+            key = update.effective_user.id
+        elif getattr(update, "effective_chat", None):
+            key = update.effective_chat.id
+        else:
+            key = getattr(update, "update_id", 0) or 0
+        return hash(key) % self.workers
+    
+    async def _worker(self, shard):
+        worker_id = self._shards.index(shard)
+        while True:
+            update, enqueued_at = await shard.get()
+            started_at = time.monotonic()
+            try:
+                await self.application.process_update(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Dispatcher worker {worker_id} failed to process update: {e}")
+            finally:
+                finished_at = time.monotonic()
+                self._record(started_at - enqueued_at, finished_at - started_at)
+                with self._lock:
+                    self._pending -= 1
+    
+    def _record(self, wait, processing):
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        self._processing_total += processing
+        self._processing_max = max(self._processing_max, processing)
+    
+    def reject_if_full(self):
+        """Cheap capacity check for ingress, before an update is parsed"""
+        if self._pending >= self.max_queue_size:
+            with self._lock:
+                self.dropped += 1
+            return True
+        return False
+    
+    def stats(self):
+        """Return queue depth and latency counters"""
+        completed = self.processed + self.failed
+        now = time.monotonic()
+        shard_depths = [len(shard.items) for shard in self._shards]
+        head_of_line_wait = max((shard.head_wait(now) for shard in self._shards), default=0.0)
+        return {
+            "workers": self.workers,
+            "queue_depth": self._pending,
+            "max_queue_size": self.max_queue_size,
+            "shard_queue_depths": shard_depths,
+            "head_of_line_wait_ms": round(head_of_line_wait * 1000, 3),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "failed": self.failed,
+            "duplicates_dropped": self.deduplicator.duplicates,
+            "dedup_high_water_mark": self.deduplicator.high_water_mark,
+            "avg_queue_wait_ms": round(self._wait_total / completed * 1000, 3) if completed else 0.0,
+            "max_queue_wait_ms": round(self._wait_max * 1000, 3),
+            "avg_processing_ms": round(self._processing_total / completed * 1000, 3) if completed else 0.0,
+            "max_processing_ms": round(self._processing_max * 1000, 3),
+        }
@@ -0,0 +1,208 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import or_
+from config import Config
+from models import BlockedUser, Match
+
+logger = logging.getLogger(__name__)
+
+def _epoch(dt):
+    # SQLite hands back naive datetimes; they are stored as UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+class BloomFilter:
+    """Fixed-size Bloom filter over integer ids (no false negatives)"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.to_bytes(8, "little", signed=True), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+    
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+class UserExclusions:
+    """Who one user must not be matched with.
+    
+    blocked holds users blocked by or blocking the user. Past the Bloom
+    threshold it is None and only the Bloom filter is kept; a hit there is
+    verified against the database. recent maps partners from the
+    recent-match window to when they were matched (epoch seconds).
+    """
+    __slots__ = ("user_id", "blocked", "bloom", "recent")
+    
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.blocked = set()
+        self.bloom = None
+        self.recent = {}
+    
+    def add_blocked(self, other_id):
+        if self.bloom is not None:
+            self.bloom.add(other_id)
+        else:
+            self.blocked.add(other_id)
+    
+    def add_recent(self, other_id, matched_at):
+        self.recent[other_id] = max(self.recent.get(other_id, 0), matched_at)
+
+class ExclusionCache:
+    """Per-user exclusion sets for matching, loaded once and updated in place.
+    
+    Blocks and new matches are applied incrementally (add_block, add_match);
+    recent matches age out of the window on read. Entries are evicted least
+    recently used beyond max_users. A block or match that lands while a user's
+    entry is loading is recorded and replayed into the loaded entry, since the
+    load may have read the database before it was committed.
+    """
+
+    def __init__(self, max_users=None, bloom_threshold=None):
+        self.max_users = max_users or Config.EXCLUSION_CACHE_SIZE
+        self.bloom_threshold = bloom_threshold or Config.EXCLUSION_BLOOM_THRESHOLD
+        self._entries = OrderedDict()  # user_id -> UserExclusions
+        self._lock = threading.Lock()
+        self._loading = {}  # user_id -> [loads in flight, (other_id, matched_at or None for a block) written meanwhile]
+        
+        self.hits = 0
+        self.misses = 0
+        self.bloom_checks = 0
+        self.bloom_false_positives = 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, session, user_id):
+        """The user's exclusions, loaded from the database on a miss"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            loading = self._loading.setdefault(user_id, [0, []])
+            loading[0] += 1
+        
+        try:
+            entry = self._load(session, user_id)
+        except Exception:
+            with self._lock:
+                self._finish_load(user_id, loading)
+            raise
+        
+        with self._lock:
+            for other_id, matched_at in loading[1]:
+                if matched_at is None:
+                    entry.add_blocked(other_id)
+                else:
+                    entry.add_recent(other_id, matched_at)
+            self._finish_load(user_id, loading)
+            # A concurrent load may have won; keep the first so incremental updates aren't lost
+            entry = self._entries.setdefault(user_id, entry)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return entry
+    
+    def _finish_load(self, user_id, loading):
+        loading[0] -= 1
+        if not loading[0]:
+            del self._loading[user_id]
+    
+    def _load(self, session, user_id):
+        entry = UserExclusions(user_id)
+        
+        # Users this user has blocked, and users that have blocked this user
+        block_count = session.query(BlockedUser).filter(
+            or_(BlockedUser.blocker_id == user_id, BlockedUser.blocked_id == user_id)
+        ).count()
+        if block_count > self.bloom_threshold:
+            entry.blocked = None
+            entry.bloom = BloomFilter(block_count * 2)
+        for blocked_id, blocker_id in session.query(BlockedUser.blocked_id, BlockedUser.blocker_id).filter(
+            or_(BlockedUser.blocker_id == user_id, BlockedUser.blocked_id == user_id)
+        ).yield_per(1000):
+            entry.add_blocked(blocked_id if blocker_id == user_id else blocker_id)
+        
+        # Users this user has matched with recently
+        cutoff = datetime.now(timezone.utc) - timedelta(days=Config.RECENT_MATCH_DAYS)
+        for user1_id, user2_id, created_at in session.query(Match.user1_id, Match.user2_id, Match.created_at).filter(
+            or_(Match.user1_id == user_id, Match.user2_id == user_id),
+            Match.created_at >= cutoff
+        ):
+            entry.add_recent(user2_id if user1_id == user_id else user1_id, _epoch(created_at))
+        
+        return entry
+    
+    def add_block(self, blocker_id, blocked_id):
+        with self._lock:
+            for user_id, other_id in ((blocker_id, blocked_id), (blocked_id, blocker_id)):
+                entry = self._entries.get(user_id)
+                if entry is not None:
+                    entry.add_blocked(other_id)
+                if user_id in self._loading:
+                    self._loading[user_id][1].append((other_id, None))
+    
+    def add_match(self, user1_id, user2_id, created_at=None):
+        matched_at = _epoch(created_at) if created_at else time.time()
+        with self._lock:
+            for user_id, other_id in ((user1_id, user2_id), (user2_id, user1_id)):
+                entry = self._entries.get(user_id)
+                if entry is not None:
+                    entry.add_recent(other_id, matched_at)
+                if user_id in self._loading:
+                    self._loading[user_id][1].append((other_id, matched_at))
+    
+    def excluded_ids(self, entry, now=None):
+        """A copy of the entry's exact excluded ids: recent partners still in the window and (small) block lists"""
+        cutoff = (now or time.time()) - Config.RECENT_MATCH_DAYS * 86400
+        # add_match and add_block write to entries from other threads, under the same lock
+        with self._lock:
+            expired = [partner_id for partner_id, matched_at in entry.recent.items() if matched_at < cutoff]
+            for partner_id in expired:
+                del entry.recent[partner_id]
+            
+            excluded = set(entry.recent)
+            if entry.blocked is not None:
+                excluded |= entry.blocked
+        return excluded
+    
+    def is_blocked(self, session, entry, other_id):
+        """Exact block check for users whose block list is only kept as a Bloom filter"""
+        if entry.bloom is None or other_id not in entry.bloom:
+            return False
+        
+        self.bloom_checks += 1
+        blocked = session.query(BlockedUser.id).filter(or_(
+            (BlockedUser.blocker_id == entry.user_id) & (BlockedUser.blocked_id == other_id),
+            (BlockedUser.blocker_id == other_id) & (BlockedUser.blocked_id == entry.user_id)
+        )).first() is not None
+        if not blocked:
+            self.bloom_false_positives += 1
+        return blocked
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "cached_users": len(self._entries),
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "bloom_checks": self.bloom_checks,
+            "bloom_false_positives": self.bloom_false_positives,
+        }
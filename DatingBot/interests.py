@@ -0,0 +1,78 @@
+import logging
+import threading
+from sqlalchemy.exc import IntegrityError
+from models import InterestToken, UserProfile
+
+logger = logging.getLogger(__name__)
+
+# token -> id cache of committed tokens; ids never change once assigned
+_token_ids = {}
+_token_lock = threading.Lock()
+
+def tokenize(interests):
+    """Normalized interest tokens, exactly as scoring has always compared them.
+    
+    Note that "a, ,b" yields an empty token too; it is kept so scores don't change.
+    """
+    if not interests:
+        return set()
+    return set(interest.strip().lower() for interest in interests.split(','))
+
+def _token_id(session, token):
+    token_id = _token_ids.get(token)
+    if token_id is not None:
+        return token_id
+    
+    row = session.query(InterestToken).filter_by(token=token).first()
+    if row:
+        with _token_lock:
+            _token_ids[token] = row.id
+        return row.id
+    
+    # New token; not cached until a later lookup sees it committed
+    try:
+        with session.begin_nested():
+            row = InterestToken(token=token)
+            session.add(row)
+    except IntegrityError:
+        # Another transaction added it first
+        row = session.query(InterestToken).filter_by(token=token).one()
+    return row.id
+
+def encode_interests(session, interests):
+    """Token ids for an interests string, stored as sorted comma-separated ints (None if empty)"""
+    tokens = tokenize(interests)
+    if not tokens:
+        return None
+    return ",".join(str(token_id) for token_id in sorted(_token_id(session, token) for token in tokens))
+
+def decode_interest_ids(interest_ids):
+    """Stored token ids as a frozenset of ints"""
+    if not interest_ids:
+        return frozenset()
+    return frozenset(int(token_id) for token_id in interest_ids.split(','))
+
+def city_key(city):
+    """City as compared for the same-city bonus"""
+    return city.lower() if city else None
+
+def backfill_interest_ids(session, batch_size=500):
+    """Encode interests for profiles written before interest_ids existed"""
+    count = 0
+    while True:
+        profiles = session.query(UserProfile).filter(
+            UserProfile.interest_ids.is_(None),
+            UserProfile.interests.isnot(None),
+            UserProfile.interests != ""
+        ).limit(batch_size).all()
+        if not profiles:
+            break
+        
+        for profile in profiles:
+            profile.interest_ids = encode_interests(session, profile.interests)
+        session.commit()
+        count += len(profiles)
+    
+    if count:
+        logger.info(f"Encoded interests for {count} profiles")
+    return count
@@ -1,14 +1,18 @@
+import asyncio
 import os
+import sys
 import logging
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-import asyncio
-import threading
 from config import Config
 from models import db
 from bot_handlers import BotHandlers
+from database import DatabaseExecutor
+import migrations
+from dispatcher import UpdateDispatcher
+import cluster as worker_cluster
 
 # Configure logging
 logging.basicConfig(
@@ -35,34 +39,58 @@ if not bot_token:
     logger.error("TELEGRAM_BOT_TOKEN environment variable not set")
     exit(1)
 
-# Global bot application
+# Global bot application, handlers, update dispatcher and database executor
 bot_app = None
+bot_handlers = None
+dispatcher = None
+database = None
+
+# Worker processes, in the front process of multi-worker mode (WORKERS > 1)
+cluster = None
+
+def build_application():
+    """A bot Application pointed at the configured Bot API server"""
+    builder = Application.builder().token(bot_token)
+    if Config.TELEGRAM_API_URL:
+        # e.g. a local Bot API server, or the stub used by the load tests
+        builder = builder.base_url(f"{Config.TELEGRAM_API_URL}/bot").base_file_url(f"{Config.TELEGRAM_API_URL}/file/bot")
+    return builder.build()
 
 def create_bot_application():
     """Create and configure the bot application"""
-    global bot_app
+    global bot_app, bot_handlers, database
     
     # Create application
-    bot_app = Application.builder().token(bot_token).build()
+    bot_app = build_application()
+    
+    # Database work runs on a bounded thread pool, off the update loop
+    with app.app_context():
+        database = DatabaseExecutor(db.engine)
     
     # Initialize bot handlers
-    handlers = BotHandlers(db)
+    bot_handlers = BotHandlers(database, bot_app.bot)
+    
+    # Load active matches into the relay routing table
+    database.run_sync(bot_handlers.routing_table.rebuild)
+    
+    # Load users waiting to be matched into the matching pool
+    database.run_sync(bot_handlers.matching_service.pool.rebuild)
     
     # Add command handlers
-    bot_app.add_handler(CommandHandler("start", handlers.start_command))
-    bot_app.add_handler(CommandHandler("help", handlers.help_command))
-    bot_app.add_handler(CommandHandler("profile", handlers.profile_command))
-    bot_app.add_handler(CommandHandler("match", handlers.find_match_command))
-    bot_app.add_handler(CommandHandler("stop_chat", handlers.stop_chat_command))
-    bot_app.add_handler(CommandHandler("report", handlers.report_command))
-    bot_app.add_handler(CommandHandler("block", handlers.block_command))
-    bot_app.add_handler(CommandHandler("premium", handlers.premium_command))
+    bot_app.add_handler(CommandHandler("start", bot_handlers.start_command))
+    bot_app.add_handler(CommandHandler("help", bot_handlers.help_command))
+    bot_app.add_handler(CommandHandler("profile", bot_handlers.profile_command))
+    bot_app.add_handler(CommandHandler("match", bot_handlers.find_match_command))
+    bot_app.add_handler(CommandHandler("stop_chat", bot_handlers.stop_chat_command))
+    bot_app.add_handler(CommandHandler("report", bot_handlers.report_command))
+    bot_app.add_handler(CommandHandler("block", bot_handlers.block_command))
+    bot_app.add_handler(CommandHandler("premium", bot_handlers.premium_command))
     
     # Add callback query handler for inline keyboards
-    bot_app.add_handler(CallbackQueryHandler(handlers.button_callback))
+    bot_app.add_handler(CallbackQueryHandler(bot_handlers.button_callback))
     
     # Add message handler for text messages
-    bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_message))
+    bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_handlers.handle_message))
     
     return bot_app
 
@@ -71,18 +99,16 @@ def webhook():
     """Handle incoming webhook requests from Telegram"""
     try:
         json_data = request.get_json()
-        if json_data:
+        if json_data and cluster:
+            # Multi-worker mode: the worker that owns this user parses and handles it
+            if not cluster.submit(json_data):
+                return jsonify({"status": "busy"}), 503
+        elif json_data:
             update = Update.de_json(json_data, bot_app.bot)
             
-            # Process update in a separate thread to avoid blocking
-            def process_update():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(bot_app.process_update(update))
-                loop.close()
-            
-            thread = threading.Thread(target=process_update)
-            thread.start()
+            # Hand the update to the dispatcher loop; ask Telegram to retry if we're backed up
+            if not dispatcher.submit(update):
+                return jsonify({"status": "busy"}), 503
             
         return jsonify({"status": "ok"})
     except Exception as e:
@@ -94,6 +120,31 @@ def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "service": "anonymous_dating_bot"})
 
+def collect_metrics():
+    """Gather runtime counters for the /metrics endpoint"""
+    if cluster:
+        # Each worker keeps its own counters; the front process only sees its queues
+        return {"cluster": cluster.stats()}
+    return {
+        "dispatcher": dispatcher.stats() if dispatcher else None,
+        "messages": bot_handlers.message_writer.stats() if bot_handlers else None,
+        "outbound": bot_handlers.outbox.stats() if bot_handlers else None,
+        "user_cache": bot_handlers.user_cache.stats() if bot_handlers else None,
+        "matching": bot_handlers.matching_service.stats() if bot_handlers else None,
+        "waiting_room": bot_handlers.waiting_room.stats() if bot_handlers else None,
+        "match_sweeper": bot_handlers.match_sweeper.stats() if bot_handlers else None,
+        "rate_limits": {
+            "messages": bot_handlers.message_limiter.stats(),
+            "reports": bot_handlers.report_limiter.stats(),
+        } if bot_handlers else None,
+        "conversations": bot_handlers.conversations.stats() if bot_handlers else None,
+    }
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Dispatcher queue and latency counters"""
+    return jsonify(collect_metrics())
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint"""
@@ -102,50 +153,141 @@ def root():
         "status": "running",
         "endpoints": {
             "webhook": "/webhook",
-            "health": "/health"
+            "health": "/health",
+            "metrics": "/metrics"
         }
     })
 
-def setup_webhook():
-    """Set up webhook with Telegram"""
+async def register_webhook(bot=None):
+    """Register the webhook URL with Telegram"""
     try:
         # Get the webhook URL from environment or construct it
         webhook_url = os.environ.get("WEBHOOK_URL", "")
         if webhook_url:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            async def set_webhook():
-                await bot_app.bot.set_webhook(url=f"{webhook_url}/webhook")
-                logger.info(f"Webhook set to: {webhook_url}/webhook")
-            
-            loop.run_until_complete(set_webhook())
-            loop.close()
+            await (bot or bot_app.bot).set_webhook(url=f"{webhook_url}/webhook")
+            logger.info(f"Webhook set to: {webhook_url}/webhook")
         else:
             logger.warning("WEBHOOK_URL not set, webhook not configured")
     except Exception as e:
         logger.error(f"Error setting webhook: {e}")
 
-if __name__ == '__main__':
+def setup_webhook():
+    """Set up webhook with Telegram"""
+    if cluster:
+        asyncio.run(register_front_webhook())
+    else:
+        dispatcher.run_coroutine(register_webhook())
+
+async def register_front_webhook():
+    """Register the webhook from the front process, which has no bot application of its own"""
+    async with build_application().bot as bot:
+        await register_webhook(bot)
+
+def init_database():
+    """Create database tables"""
     with app.app_context():
         # Import models to ensure tables are created
         import models
-        from models import SubscriptionType
         
         # Create database tables
         db.create_all()
         logger.info("Database tables created")
         
+        # Add indexes (and other additions) missing from existing tables
+        migrations.upgrade(db.engine)
+        
         # Set owner privileges for configured owner IDs (after users register)
         logger.info("Database setup complete. Owner privileges will be set when users first use the bot.")
-        
-        # Create bot application
-        create_bot_application()
-        logger.info("Bot application created")
+
+def start_bot():
+    """Create the bot application and start the update dispatcher on a background loop"""
+    global dispatcher
+    
+    # Create bot application
+    create_bot_application()
+    logger.info("Bot application created")
+    
+    # Start the long-lived update dispatcher
+    dispatcher = UpdateDispatcher(bot_app, on_startup=[bot_handlers.start], on_shutdown=[bot_handlers.close])
+    dispatcher.start()
+
+def stop_bot():
+    """Stop the dispatcher, flushing buffered work, and release the database pool"""
+    dispatcher.stop()
+    database.close()
+
+def start_cluster(workers=None):
+    """Fork the bot worker processes; this process then only routes webhook updates to them.
+    
+    Returns False without starting anything on SQLite, where pairing can't be
+    made safe across processes.
+    """
+    global cluster
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            # lock_users is a no-op on SQLite and match claims only cover one process,
+            # so two workers could put the same user into two active matches
+            logger.error("WORKERS > 1 needs Postgres: SQLite can't lock users across processes; running one bot process")
+            return False
+    cluster = worker_cluster.WorkerCluster(run_worker, workers)
+    cluster.start()
+    return True
+
+def stop_cluster():
+    """Let every worker drain its queue and shut down"""
+    cluster.stop()
+
+def run_worker(index, workers, inbox, bus):
+    """Body of one worker process: a full bot fed with its users' updates by the front process"""
+    # Outbound Telegram limits are global to the bot; split them between the workers
+    Config.OUTBOUND_GLOBAL_RATE /= workers
+    if Config.UPDATE_HWM_FILE:
+        Config.UPDATE_HWM_FILE = f"{Config.UPDATE_HWM_FILE}.{index}"
+    worker_cluster.peer_events.connect(bus, index)
+    
+    with app.app_context():
+        # Pooled connections were opened by the front process; this process opens its own
+        db.engine.dispose(close=False)
+        start_bot()
+    
+    try:
+        worker_cluster.serve_inbox(inbox, dispatcher, bot_app.bot, bot_handlers.apply_peer_event)
+    finally:
+        stop_bot()
+
+def run_flask():
+    """Serve the webhook with Flask, dispatching updates on a background loop (or to worker processes)"""
+    with app.app_context():
+        if Config.WORKERS <= 1 or not start_cluster():
+            start_bot()
         
         # Setup webhook
         setup_webhook()
         
         # Start Flask app
-        port = int(os.environ.get('PORT', 5000))
-        app.run(host='0.0.0.0', port=port, debug=False)
+        try:
+            app.run(host=Config.HOST, port=Config.PORT, debug=False)
+        finally:
+            if cluster:
+                stop_cluster()
+            else:
+                stop_bot()
+
+def run_asgi():
+    """Serve the webhook from the ASGI app, on the same loop as the bot application"""
+    import uvicorn
+    import asgi
+    
+    if Config.WORKERS > 1:
+        logger.warning("WORKERS is only supported with SERVER_MODE=flask; serving from one process")
+    uvicorn.run(asgi.app, host=Config.HOST, port=Config.PORT, log_level=Config.LOG_LEVEL.lower())
+
+if __name__ == '__main__':
+    # asgi.py does "import main"; let that find this module instead of loading a second copy
+    sys.modules["main"] = sys.modules[__name__]
+    init_database()
+    
+    if Config.SERVER_MODE == "asgi":
+        run_asgi()
+    else:
+        run_flask()
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class InactiveMatchSweeper:
+    """Periodically ends active matches nobody has written in for too long.
+    
+    Each sweep is one set-based UPDATE ... RETURNING over matches whose
+    last_activity_at is older than max_inactive_hours; on_ended(ended) is then
+    called with [(match_id, user1 telegram_id, user2 telegram_id)] so both
+    users can be told.
+    """
+
+    def __init__(self, matching_service, on_ended, interval=None, max_inactive_hours=None):
+        self.matching_service = matching_service
+        self.on_ended = on_ended
+        self.interval = interval or Config.MATCH_SWEEP_INTERVAL_SECONDS
+        self.max_inactive_hours = max_inactive_hours or Config.INACTIVE_MATCH_HOURS
+        
+        self._task = None
+        self._closing = False
+        
+        self.sweeps = 0
+        self.ended = 0
+        self.last_sweep_ms = None
+    
+    async def start(self):
+        if not self._task:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+    
+    async def close(self):
+        if self._task:
+            self._closing = True
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _run(self):
+        while not self._closing:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in inactive match sweep: {e}")
+    
+    async def sweep(self):
+        """End idle matches once; returns how many were ended"""
+        started = time.perf_counter()
+        ended = await self.matching_service.end_inactive_matches(self.max_inactive_hours)
+        self.sweeps += 1
+        self.last_sweep_ms = (time.perf_counter() - started) * 1000
+        self.ended += len(ended)
+        
+        if ended:
+            await self.on_ended(ended)
+        return len(ended)
+    
+    def stats(self):
+        return {
+            "sweeps": self.sweeps,
+            "ended": self.ended,
+            "last_sweep_ms": round(self.last_sweep_ms, 1) if self.last_sweep_ms is not None else None,
+        }
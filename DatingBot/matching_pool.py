@@ -0,0 +1,242 @@
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from operator import itemgetter
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+from models import User, UserProfile, Match, UserStatus, MatchStatus
+from interests import decode_interest_ids, city_key
+from batch_scoring import HAVE_NUMPY, CandidateColumns, top_k, np
+
+logger = logging.getLogger(__name__)
+
+AGE_BUCKET_YEARS = 5
+
+class PoolEntry:
+    """Snapshot of the profile fields matching needs.
+    
+    Interests, city and bio are kept pre-normalized (token id set, lowercased
+    city, bio length) under the same names as the UserProfile properties, so
+    it can be passed straight to MatchingService.calculate_compatibility_score.
+    """
+    __slots__ = ("user_id", "telegram_id", "gender", "looking_for", "age", "min_age", "max_age",
+                 "city_key", "interest_set", "bio_length")
+    
+    def __init__(self, user, profile):
+        self.user_id = user.id
+        self.telegram_id = user.telegram_id
+        self.gender = profile.gender
+        self.looking_for = profile.looking_for
+        self.age = profile.age
+        self.min_age = profile.min_age
+        self.max_age = profile.max_age
+        self.city_key = city_key(profile.city)
+        self.interest_set = decode_interest_ids(profile.interest_ids)
+        self.bio_length = len(profile.bio) if profile.bio else 0
+    
+    @property
+    def key(self):
+        return (self.gender, self.looking_for)
+
+def is_poolable(user):
+    return bool(user and user.profile and user.is_registered and user.status == UserStatus.ACTIVE)
+
+class MatchingPool:
+    """In-memory index of every user who can be matched right now.
+    
+    Entries are keyed by (gender, looking_for) and then by age bucket, so a
+    candidate search only touches users of the wanted gender pair in the
+    wanted age range. Users leave the pool when they are matched or stop being active
+    and come back when their match ends. Until rebuild() has run the pool is
+    not ready and MatchingService falls back to the database query.
+    
+    With NumPy installed, each gender pair is also mirrored into columnar
+    arrays and top_candidates() scores them in one vectorized pass.
+    """
+
+    def __init__(self, bucket_years=AGE_BUCKET_YEARS):
+        self.bucket_years = bucket_years
+        self._entries = {}  # user_id -> PoolEntry
+        self._index = defaultdict(lambda: defaultdict(set))  # (gender, looking_for) -> age bucket -> user ids
+        self._lock = threading.Lock()
+        self.ready = False
+        self.version = 0  # Bumped whenever users are added, so waiters know when to retry
+        
+        # Columnar mirror for batch scoring (NumPy only)
+        self._columns = {}  # (gender, looking_for) -> CandidateColumns
+        self._interest_index = defaultdict(set)  # interest token id -> user ids
+        self._posting_arrays = {}  # interest token id -> cached array of _interest_index[token]
+        self._city_ids = {}  # city_key -> small int, 0 meaning no city
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, user_id):
+        return user_id in self._entries
+    
+    def _bucket(self, age):
+        return age // self.bucket_years
+    
+    def _insert(self, entry):
+        self._entries[entry.user_id] = entry
+        self._index[entry.key][self._bucket(entry.age)].add(entry.user_id)
+        
+        if HAVE_NUMPY:
+            columns = self._columns.get(entry.key)
+            if columns is None:
+                columns = self._columns[entry.key] = CandidateColumns()
+            columns.add(entry, self._city_id(entry.city_key))
+            for token_id in entry.interest_set:
+                self._interest_index[token_id].add(entry.user_id)
+                self._posting_arrays.pop(token_id, None)
+    
+    def _discard(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry:
+            buckets = self._index[entry.key]
+            bucket = buckets[self._bucket(entry.age)]
+            bucket.discard(user_id)
+            if not bucket:
+                del buckets[self._bucket(entry.age)]
+            
+            if HAVE_NUMPY:
+                self._columns[entry.key].remove(user_id)
+                for token_id in entry.interest_set:
+                    self._interest_index[token_id].discard(user_id)
+                    self._posting_arrays.pop(token_id, None)
+        return entry
+    
+    def _city_id(self, key):
+        if not key:
+            return 0
+        city_id = self._city_ids.get(key)
+        if city_id is None:
+            city_id = self._city_ids[key] = len(self._city_ids) + 1
+        return city_id
+    
+    def _posting_array(self, token_id):
+        array = self._posting_arrays.get(token_id)
+        if array is None:
+            user_ids = self._interest_index.get(token_id, ())
+            array = self._posting_arrays[token_id] = np.fromiter(user_ids, np.int64, len(user_ids))
+        return array
+    
+    def add(self, user, profile=None):
+        """Add or refresh a user; ignored unless they are registered and active"""
+        profile = profile or user.profile
+        if not (profile and user.is_registered and user.status == UserStatus.ACTIVE):
+            self.remove(user.id)
+            return False
+        
+        entry = PoolEntry(user, profile)
+        with self._lock:
+            self._discard(user.id)
+            self._insert(entry)
+            self.version += 1
+        return True
+    
+    def remove(self, user_id):
+        with self._lock:
+            return self._discard(user_id)
+    
+    def get(self, user_id):
+        return self._entries.get(user_id)
+    
+    def candidates(self, profile, exclude_ids=()):
+        """Entries compatible with the given profile, minus exclude_ids"""
+        key = (profile.looking_for, profile.gender)
+        with self._lock:
+            buckets = self._index.get(key)
+            if not buckets:
+                return []
+            
+            ids = set()
+            for bucket in range(self._bucket(profile.min_age), self._bucket(profile.max_age) + 1):
+                ids.update(buckets.get(bucket, ()))
+            ids.difference_update(exclude_ids)
+            entries = [self._entries[user_id] for user_id in ids]
+        
+        return [
+            entry for entry in entries
+            if profile.min_age <= entry.age <= profile.max_age and entry.min_age <= profile.age <= entry.max_age
+        ]
+    
+    def top_candidates(self, profile, exclude_ids, k, score):
+        """The k best-scoring compatible entries as [(entry, score)], best first.
+        
+        score(profile, entry) is the per-pair scoring function, used when
+        NumPy isn't available; otherwise all candidates are scored at once.
+        """
+        if not HAVE_NUMPY:
+            scored = ((entry, score(profile, entry)) for entry in self.candidates(profile, exclude_ids))
+            return heapq.nlargest(k, scored, key=itemgetter(1))
+        
+        with self._lock:
+            columns = self._columns.get((profile.looking_for, profile.gender))
+            if columns is None:
+                return []
+            
+            postings = [self._posting_array(token_id) for token_id in profile.interest_set
+                        if token_id in self._interest_index]
+            user_ids, scores = top_k(columns, profile, self._city_ids.get(profile.city_key, 0),
+                                     exclude_ids, postings, k)
+            return [(self._entries[user_id], entry_score) for user_id, entry_score in zip(user_ids, scores)]
+    
+    def rebuild(self, session):
+        """Reload every registered, active user who is not in an active match"""
+        busy = session.query(Match.user1_id).filter(Match.status == MatchStatus.ACTIVE).union(
+            session.query(Match.user2_id).filter(Match.status == MatchStatus.ACTIVE)
+        )
+        busy_ids = {row[0] for row in busy}
+        
+        users = session.query(User).join(UserProfile).options(joinedload(User.profile)).filter(
+            User.is_registered == True,
+            User.status == UserStatus.ACTIVE
+        ).all()
+        
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self._columns.clear()
+            self._interest_index.clear()
+            self._posting_arrays.clear()
+            for user in users:
+                if user.id not in busy_ids:
+                    self._insert(PoolEntry(user, user.profile))
+            self.ready = True
+            self.version += 1
+        
+        logger.info(f"Matching pool rebuilt with {len(self._entries)} available users")
+        return len(self._entries)
+    
+    def refresh(self, session, user_ids):
+        """Re-read the given users and put back those who are free to match.
+        
+        Called when a match ends or a profile changes.
+        """
+        user_ids = [user_id for user_id in user_ids if user_id is not None]
+        if not user_ids:
+            return
+        
+        busy = session.query(Match.user1_id, Match.user2_id).filter(
+            Match.status == MatchStatus.ACTIVE,
+            or_(Match.user1_id.in_(user_ids), Match.user2_id.in_(user_ids))
+        ).all()
+        busy_ids = {user_id for row in busy for user_id in row}
+        
+        # Callers have just committed; reload so the identity map doesn't hide the new state
+        users = session.query(User).options(joinedload(User.profile)).populate_existing().filter(
+            User.id.in_(user_ids)
+        ).all()
+        for user in users:
+            if user.id in busy_ids or not is_poolable(user):
+                self.remove(user.id)
+            else:
+                self.add(user)
+    
+    def stats(self):
+        with self._lock:
+            by_key = {f"{gender.value}->{looking_for.value}": sum(len(ids) for ids in buckets.values())
+                      for (gender, looking_for), buckets in self._index.items()}
+        return {"ready": self.ready, "size": len(self._entries), "by_gender_pair": by_key}
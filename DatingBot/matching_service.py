@@ -1,119 +1,311 @@
+import heapq
 import logging
 import random
+from contextlib import ExitStack
+from operator import itemgetter
 from datetime import datetime, timezone, timedelta
-from sqlalchemy import and_, or_, not_
-from models import User, UserProfile, Match, BlockedUser, Gender, MatchStatus
+from sqlalchemy import or_, not_, update
+from sqlalchemy.orm import joinedload
+from models import User, UserProfile, Match, Gender, UserStatus, MatchStatus
+from matching_pool import MatchingPool, PoolEntry
+from claims import ClaimTable, lock_users, locked_user_ids
+from exclusions import ExclusionCache
+from batch_matching import greedy_pairs
 from utils import generate_anonymous_id
+from cluster import peer_events
 
 logger = logging.getLogger(__name__)
 
+TOP_MATCHES = 5  # A match is picked at random among this many best-scoring candidates
+BATCH_CANDIDATES = 10  # Best candidates per user considered in a batch round
+
 class MatchingService:
-    def __init__(self, db):
-        self.db = db
+    def __init__(self, database, routing_table=None):
+        self.database = database
+        self.routing_table = routing_table
+        self.pool = MatchingPool()
+        self.claims = ClaimTable()
+        self.exclusions = ExclusionCache()
+        
+        self.pool_lookups = 0
+        self.db_fallbacks = 0
+        self.stale_candidates = 0
     
-    async def find_match(self, user_id):
-        """Find a compatible match for the given user"""
+    async def find_match(self, user_id, priority=False):
+        """Find a compatible match for the given user.
+        
+        Priority (premium) users get the best available candidate; others a
+        random one among the top few.
+        """
         try:
-            with self.db.session() as session:
-                user = session.query(User).filter_by(id=user_id).first()
-                if not user or not user.profile:
-                    return None
-                
-                user_profile = user.profile
-                
-                # Get users that this user has blocked
-                blocked_user_ids = session.query(BlockedUser.blocked_id).filter_by(blocker_id=user_id).subquery()
-                
-                # Get users that have blocked this user
-                blocked_by_user_ids = session.query(BlockedUser.blocker_id).filter_by(blocked_id=user_id).subquery()
-                
-                # Get users that this user has already matched with recently (within last 7 days)
-                recent_match_user_ids = session.query(
-                    Match.user1_id, Match.user2_id
-                ).filter(
-                    and_(
-                        or_(Match.user1_id == user_id, Match.user2_id == user_id),
-                        Match.created_at >= datetime.now(timezone.utc) - timedelta(days=7)
-                    )
-                ).all()
-                
-                # Flatten the recent match user IDs
-                recent_matched_ids = set()
-                for match in recent_match_user_ids:
-                    if match.user1_id != user_id:
-                        recent_matched_ids.add(match.user1_id)
-                    if match.user2_id != user_id:
-                        recent_matched_ids.add(match.user2_id)
-                
-                # Find compatible users
-                potential_matches = session.query(User).join(UserProfile).filter(
-                    # Basic filters
-                    User.id != user_id,
-                    User.is_registered == True,
-                    User.status.in_(['active']),
-                    
-                    # Age compatibility
-                    UserProfile.age >= user_profile.min_age,
-                    UserProfile.age <= user_profile.max_age,
-                    UserProfile.min_age <= user_profile.age,
-                    UserProfile.max_age >= user_profile.age,
-                    
-                    # Gender compatibility
-                    UserProfile.gender == user_profile.looking_for,
-                    UserProfile.looking_for == user_profile.gender,
-                    
-                    # Exclude blocked users
-                    not_(User.id.in_(blocked_user_ids)),
-                    not_(User.id.in_(blocked_by_user_ids)),
-                    
-                    # Exclude users already in active matches
-                    not_(User.id.in_(
-                        session.query(Match.user1_id).filter(Match.status == MatchStatus.ACTIVE).union(
-                            session.query(Match.user2_id).filter(Match.status == MatchStatus.ACTIVE)
-                        )
-                    ))
-                ).all()
-                
-                # Filter out recently matched users
-                potential_matches = [u for u in potential_matches if u.id not in recent_matched_ids]
-                
-                if not potential_matches:
-                    return None
-                
-                # Apply additional compatibility scoring (optional enhancement)
-                scored_matches = []
-                for match_user in potential_matches:
-                    score = self.calculate_compatibility_score(user_profile, match_user.profile)
-                    scored_matches.append((match_user, score))
-                
-                # Sort by compatibility score (highest first)
-                scored_matches.sort(key=lambda x: x[1], reverse=True)
-                
-                # Take top 5 matches and randomly select one (adds some variety)
-                top_matches = scored_matches[:5] if len(scored_matches) >= 5 else scored_matches
-                selected_match_user = random.choice(top_matches)[0]
-                
-                # Create the match
-                anonymous_id_1 = generate_anonymous_id()
-                anonymous_id_2 = generate_anonymous_id()
-                
-                match = Match(
-                    user1_id=user_id,
-                    user2_id=selected_match_user.id,
-                    status=MatchStatus.ACTIVE,
-                    anonymous_id_1=anonymous_id_1,
-                    anonymous_id_2=anonymous_id_2
+            return await self.database.run(self._find_match, user_id, priority)
+        
+        except Exception as e:
+            logger.error(f"Error finding match for user {user_id}: {e}")
+            return None
+    
+    def _find_match(self, session, user_id, priority=False):
+        user = session.query(User).options(joinedload(User.profile)).filter_by(id=user_id).first()
+        if not user or not user.profile:
+            return None
+        
+        # Hold the seeker for the whole search, so nobody pairs them meanwhile
+        with self.claims.hold(user_id) as claimed:
+            if not claimed or not lock_users(session, [user_id]):
+                # Another search is pairing this user right now
+                return None
+            if not self._is_still_available(session, user_id):
+                return None
+            
+            user_profile = PoolEntry(user, user.profile)
+            exclusions = self.exclusions.get(session, user_id)
+            excluded_ids = self.exclusions.excluded_ids(exclusions)
+            excluded_ids.add(user_id)
+            
+            # Top candidates come from the in-memory pool; the database query is the fallback
+            if self.pool.ready:
+                self.pool_lookups += 1
+            top_matches = self._best_candidates(session, user_profile, exclusions, excluded_ids, TOP_MATCHES,
+                                                from_pool=self.pool.ready)
+            
+            match = self._claim_and_create(session, user, top_matches, best_first=priority)
+            if not match and self.pool.ready and top_matches:
+                # Every pooled candidate was stale or taken; let the database have the final word
+                self.db_fallbacks += 1
+                top_matches = self._best_candidates(session, user_profile, exclusions, excluded_ids, TOP_MATCHES,
+                                                    from_pool=False)
+                match = self._claim_and_create(session, user, top_matches, best_first=priority)
+            
+            return match
+    
+    def _query_candidates(self, session, user_profile, excluded_ids):
+        """Compatible users straight from the database, as PoolEntry snapshots"""
+        potential_matches = session.query(User).join(UserProfile).options(joinedload(User.profile)).filter(
+            # Basic filters
+            User.is_registered == True,
+            User.status == UserStatus.ACTIVE,
+            not_(User.id.in_(excluded_ids)),
+            
+            # Age compatibility
+            UserProfile.age >= user_profile.min_age,
+            UserProfile.age <= user_profile.max_age,
+            UserProfile.min_age <= user_profile.age,
+            UserProfile.max_age >= user_profile.age,
+            
+            # Gender compatibility
+            UserProfile.gender == user_profile.looking_for,
+            UserProfile.looking_for == user_profile.gender,
+            
+            # Exclude users already in active matches
+            not_(User.id.in_(
+                session.query(Match.user1_id).filter(Match.status == MatchStatus.ACTIVE).union(
+                    session.query(Match.user2_id).filter(Match.status == MatchStatus.ACTIVE)
                 )
+            ))
+        ).all()
+        
+        return [PoolEntry(match_user, match_user.profile) for match_user in potential_matches]
+    
+    def _best_candidates(self, session, user_profile, exclusions, excluded_ids, k, from_pool=True):
+        """The k best candidates as [(entry, score)], best first, from the pool or the database"""
+        if exclusions.bloom is None:
+            # The block list is exact and already part of excluded_ids
+            if from_pool:
+                return self.pool.top_candidates(user_profile, excluded_ids, k, self.calculate_compatibility_score)
+            return self._top_matches(user_profile, self._query_candidates(session, user_profile, excluded_ids), k)
+        
+        # Blocks are only known through a Bloom filter: walk the candidates best first and
+        # verify each one until k are left or there are no more
+        if from_pool:
+            ranked = self._pool_ranked(user_profile, excluded_ids, k)
+        else:
+            ranked = self._top_matches(user_profile, self._query_candidates(session, user_profile, excluded_ids))
+        
+        best = []
+        for candidate, score in ranked:
+            if not self.exclusions.is_blocked(session, exclusions, candidate.user_id):
+                best.append((candidate, score))
+                if len(best) == k:
+                    break
+        return best
+    
+    def _pool_ranked(self, user_profile, excluded_ids, k):
+        """Every pooled candidate best first, fetched from the pool in doubling pages"""
+        seen = set(excluded_ids)
+        page_size = k * 2
+        while True:
+            page = self.pool.top_candidates(user_profile, seen, page_size, self.calculate_compatibility_score)
+            yield from page
+            if len(page) < page_size:
+                return
+            seen.update(candidate.user_id for candidate, _ in page)
+            page_size *= 2
+    
+    def _top_matches(self, user_profile, candidates, k=None):
+        """Score candidates one by one and keep the best k (highest score first; all of them if k is None)"""
+        scored_matches = ((candidate, self.calculate_compatibility_score(user_profile, candidate))
+                          for candidate in candidates)
+        if k is None:
+            return sorted(scored_matches, key=itemgetter(1), reverse=True)
+        return heapq.nlargest(k, scored_matches, key=itemgetter(1))
+    
+    def _claim_and_create(self, session, user, top_matches, best_first=False):
+        """Match the user with one of the top candidates that can be claimed and is still free.
+        
+        The caller holds the user's claim and row lock. Each candidate is
+        claimed in-process and row-locked (SKIP LOCKED) before the final
+        availability check, and released only after the match is committed.
+        """
+        # Randomly select among the top matches (adds some variety); priority users take the best first
+        top_matches = [candidate for candidate, _ in top_matches]
+        if not best_first:
+            random.shuffle(top_matches)
+        
+        for candidate in top_matches:
+            with self.claims.hold(candidate.user_id) as claimed:
+                if not claimed or not lock_users(session, [candidate.user_id]):
+                    # Being paired by another search; try the next one
+                    continue
                 
-                session.add(match)
-                session.commit()
+                if not self._is_still_available(session, candidate.user_id):
+                    # The pool was out of date for this user
+                    self.stale_candidates += 1
+                    self.pool.remove(candidate.user_id)
+                    continue
                 
-                logger.info(f"Match created: User {user_id} matched with User {selected_match_user.id}")
-                return match
+                return self._create_match(session, user, candidate)
+        return None
+    
+    def _create_match(self, session, user, candidate):
+        # Create the match
+        anonymous_id_1 = generate_anonymous_id()
+        anonymous_id_2 = generate_anonymous_id()
+        
+        match = Match(
+            user1_id=user.id,
+            user2_id=candidate.user_id,
+            status=MatchStatus.ACTIVE,
+            anonymous_id_1=anonymous_id_1,
+            anonymous_id_2=anonymous_id_2
+        )
+        
+        session.add(match)
+        session.commit()
+        
+        self._match_created(match, user.telegram_id, candidate.telegram_id)
+        logger.info(f"Match created: User {user.id} matched with User {candidate.user_id}")
+        return match
+    
+    def _match_created(self, match, user1_telegram_id, user2_telegram_id):
+        """In-memory bookkeeping once a match is committed"""
+        self.exclusions.add_match(match.user1_id, match.user2_id, match.created_at)
+        self.pool.remove(match.user1_id)
+        self.pool.remove(match.user2_id)
+        if self.routing_table is not None:
+            self.routing_table.add_match(match, user1_telegram_id, user2_telegram_id)
+        peer_events.publish("matched", match.id, match.user1_id, match.user2_id, match.created_at and match.created_at.isoformat())
+    
+    async def match_batch(self, user_ids):
+        """Pair the given waiting users in one round; returns the new matches"""
+        try:
+            return await self.database.run(self._match_batch, user_ids)
         
         except Exception as e:
-            logger.error(f"Error finding match for user {user_id}: {e}")
-            return None
+            logger.error(f"Error in batch matching round: {e}")
+            return []
+    
+    def _match_batch(self, session, user_ids):
+        """Score each user's best pool candidates, pick pairs greedily by score, insert all matches at once.
+        
+        user_ids are in priority order (longest waiting first), which breaks
+        score ties. Every chosen user is claimed and row-locked like in
+        find_match before the matches are created.
+        """
+        entries = {}
+        edges = []
+        seen = set()
+        for user_id in user_ids:
+            entry = self.pool.get(user_id)
+            if entry is None:
+                continue
+            
+            exclusions = self.exclusions.get(session, user_id)
+            excluded_ids = self.exclusions.excluded_ids(exclusions)
+            excluded_ids.add(user_id)
+            for candidate, score in self._best_candidates(session, entry, exclusions, excluded_ids, BATCH_CANDIDATES):
+                pair = (min(user_id, candidate.user_id), max(user_id, candidate.user_id))
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                entries[user_id] = entry
+                entries[candidate.user_id] = candidate
+                edges.append((score, user_id, candidate.user_id))
+        
+        pairs = greedy_pairs(edges)
+        if not pairs:
+            return []
+        
+        with ExitStack() as stack:
+            # Claim both sides of every pair; pairs with a user held elsewhere are dropped
+            claimed = []
+            for user1_id, user2_id, _ in pairs:
+                holds = [stack.enter_context(self.claims.hold(user_id)) for user_id in (user1_id, user2_id)]
+                if all(holds):
+                    claimed.append((user1_id, user2_id))
+            
+            ids = [user_id for pair in claimed for user_id in pair]
+            if not ids:
+                return []
+            ready = locked_user_ids(session, ids) & self._available_user_ids(session, ids)
+            for user_id in set(ids) - ready:
+                self.stale_candidates += 1
+                self.pool.remove(user_id)
+            
+            matches = [
+                Match(
+                    user1_id=user1_id,
+                    user2_id=user2_id,
+                    status=MatchStatus.ACTIVE,
+                    anonymous_id_1=generate_anonymous_id(),
+                    anonymous_id_2=generate_anonymous_id()
+                )
+                for user1_id, user2_id in claimed if user1_id in ready and user2_id in ready
+            ]
+            if not matches:
+                return []
+            
+            # One multi-row INSERT for the whole round
+            session.add_all(matches)
+            session.commit()
+            
+            for match in matches:
+                self._match_created(match, entries[match.user1_id].telegram_id, entries[match.user2_id].telegram_id)
+        
+        logger.info(f"Batch round created {len(matches)} matches from {len(user_ids)} waiting users")
+        return matches
+    
+    def _available_user_ids(self, session, user_ids):
+        """The subset of user_ids that is registered, active and not in an active match"""
+        active = {user_id for (user_id,) in session.query(User.id).filter(
+            User.id.in_(user_ids),
+            User.is_registered == True,
+            User.status == UserStatus.ACTIVE
+        )}
+        busy = session.query(Match.user1_id, Match.user2_id).filter(
+            Match.status == MatchStatus.ACTIVE,
+            or_(Match.user1_id.in_(user_ids), Match.user2_id.in_(user_ids))
+        ).all()
+        return active - {user_id for row in busy for user_id in row}
+    
+    def _is_still_available(self, session, user_id):
+        """Consistency check of a pooled candidate against the database"""
+        user = session.query(User).filter_by(id=user_id).first()
+        if not user or not user.is_registered or user.status != UserStatus.ACTIVE:
+            return False
+        return not session.query(Match.id).filter(
+            Match.status == MatchStatus.ACTIVE,
+            or_(Match.user1_id == user_id, Match.user2_id == user_id)
+        ).first()
     
     def calculate_compatibility_score(self, profile1, profile2):
         """Calculate compatibility score between two profiles"""
@@ -123,7 +315,7 @@ class MatchingService:
         score += 50
         
         # City bonus (same city gets extra points)
-        if profile1.city and profile2.city and profile1.city.lower() == profile2.city.lower():
+        if profile1.city_key and profile1.city_key == profile2.city_key:
             score += 20
         
         # Age compatibility bonus (closer ages get more points)
@@ -135,60 +327,77 @@ class MatchingService:
         elif age_diff <= 10:
             score += 5
         
-        # Interest matching bonus
-        if profile1.interests and profile2.interests:
-            interests1 = set(interest.strip().lower() for interest in profile1.interests.split(','))
-            interests2 = set(interest.strip().lower() for interest in profile2.interests.split(','))
-            
-            common_interests = interests1.intersection(interests2)
-            score += len(common_interests) * 5  # 5 points per common interest
+        # Interest matching bonus (interests are token ids, normalized when the profile was saved)
+        common_interests = profile1.interest_set & profile2.interest_set
+        score += len(common_interests) * 5  # 5 points per common interest
         
         # Bio length bonus (users with bios are more serious)
-        if profile1.bio and profile2.bio:
-            if len(profile1.bio) > 20 and len(profile2.bio) > 20:
-                score += 10
+        if profile1.bio_length > 20 and profile2.bio_length > 20:
+            score += 10
         
         return min(score, 100)  # Cap at 100 points
     
     async def get_user_match_history(self, user_id, limit=10):
         """Get recent match history for a user"""
         try:
-            with self.db.session() as session:
-                matches = session.query(Match).filter(
-                    or_(Match.user1_id == user_id, Match.user2_id == user_id)
-                ).order_by(Match.created_at.desc()).limit(limit).all()
-                
-                return matches
+            return await self.database.run(self._get_user_match_history, user_id, limit)
         
         except Exception as e:
             logger.error(f"Error getting match history for user {user_id}: {e}")
             return []
     
+    def _get_user_match_history(self, session, user_id, limit):
+        return session.query(Match).filter(
+            or_(Match.user1_id == user_id, Match.user2_id == user_id)
+        ).order_by(Match.created_at.desc()).limit(limit).all()
+    
     async def end_inactive_matches(self, max_inactive_hours=24):
-        """End matches that have been inactive for too long"""
+        """End matches with no activity for too long. Returns [(match_id, user1 telegram_id, user2 telegram_id)]."""
         try:
-            cutoff_time = datetime.now(timezone.utc) - timedelta(hours=max_inactive_hours)
-            
-            with self.db.session() as session:
-                # Find active matches with no recent messages
-                inactive_matches = session.query(Match).filter(
-                    Match.status == MatchStatus.ACTIVE,
-                    Match.created_at < cutoff_time,
-                    ~Match.messages.any()  # No messages in this match
-                ).all()
-                
-                count = 0
-                for match in inactive_matches:
-                    match.status = MatchStatus.ENDED
-                    match.ended_at = datetime.now(timezone.utc)
-                    count += 1
-                
-                if count > 0:
-                    session.commit()
-                    logger.info(f"Ended {count} inactive matches")
-                
-                return count
+            return await self.database.run(self._end_inactive_matches, max_inactive_hours)
         
         except Exception as e:
             logger.error(f"Error ending inactive matches: {e}")
-            return 0
+            return []
+    
+    def _end_inactive_matches(self, session, max_inactive_hours):
+        now = datetime.now(timezone.utc)
+        cutoff_time = now - timedelta(hours=max_inactive_hours)
+        
+        # End every idle active match in one statement
+        ended = session.execute(
+            update(Match).where(
+                Match.status == MatchStatus.ACTIVE,
+                Match.last_activity_at < cutoff_time
+            ).values(status=MatchStatus.ENDED, ended_at=now)
+            .returning(Match.id, Match.user1_id, Match.user2_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        session.commit()
+        if not ended:
+            return []
+        
+        user_ids = [user_id for _, user1_id, user2_id in ended for user_id in (user1_id, user2_id)]
+        telegram_ids = dict(session.query(User.id, User.telegram_id).filter(User.id.in_(user_ids)))
+        
+        if self.routing_table is not None:
+            for match_id, _, _ in ended:
+                self.routing_table.remove_match(match_id)
+        self.pool.refresh(session, user_ids)
+        for match_id, user1_id, user2_id in ended:
+            peer_events.publish("ended", match_id, [user1_id, user2_id])
+        
+        logger.info(f"Ended {len(ended)} inactive matches")
+        return [(match_id, telegram_ids.get(user1_id), telegram_ids.get(user2_id))
+                for match_id, user1_id, user2_id in ended]
+    
+    def stats(self):
+        stats = self.pool.stats()
+        stats.update({
+            "pool_lookups": self.pool_lookups,
+            "db_fallbacks": self.db_fallbacks,
+            "stale_candidates": self.stale_candidates,
+            "claim_conflicts": self.claims.conflicts,
+            "exclusions": self.exclusions.stats(),
+        })
+        return stats
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from sqlalchemy import insert, update
+from config import Config
+from models import Message, Match
+
+logger = logging.getLogger(__name__)
+
+class MessageWriter:
+    """Persists relayed chat messages, either synchronously or write-behind.
+
+    In "sync" mode every message is inserted and committed before the relay
+    is sent. In "batched" mode messages are buffered and written with one
+    multi-row INSERT every `batch_size` messages or `flush_interval_ms`,
+    whichever comes first, and on shutdown. A crash can lose at most the
+    unflushed buffer.
+
+    A failed flush puts its rows back at the head of the buffer and is
+    retried with exponential backoff; relays keep going meanwhile. Rows are
+    only given up (and counted as failed) when the buffer grows past
+    buffer_limit, oldest first, or when they still can't be written at
+    shutdown.
+    """
+
+    def __init__(self, database, mode=None, batch_size=None, flush_interval_ms=None, max_buffer=None,
+                 buffer_limit=None, retry_max_seconds=None):
+        self.database = database
+        self.mode = mode or Config.MESSAGE_PERSISTENCE
+        self.batch_size = batch_size or Config.MESSAGE_BATCH_SIZE
+        self.flush_interval = (flush_interval_ms or Config.MESSAGE_FLUSH_INTERVAL_MS) / 1000
+        self.max_buffer = max_buffer or Config.MESSAGE_BUFFER_MAX
+        self.buffer_limit = max(self.max_buffer, buffer_limit or Config.MESSAGE_BUFFER_LIMIT)
+        self.retry_max = retry_max_seconds or Config.MESSAGE_RETRY_MAX_SECONDS
+        
+        self._buffer = []
+        self._flush_lock = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self._retry_at = 0.0  # No flush before this while backing off
+        self._failures = 0  # Consecutive failed flushes
+        
+        # Counters
+        self.written = 0
+        self.flushes = 0
+        self.failed = 0
+        self.retries = 0
+        self._flush_total = 0.0
+        self._flush_max = 0.0
+    
+    async def start(self):
+        if self.mode == "batched" and not self._task:
+            self._flush_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._flush_loop())
+    
+    async def close(self):
+        """Stop the flusher and write whatever is still buffered"""
+        if self._task:
+            # A batch filling up right as we cancel sets the wakeup, and wait_for can then
+            # return normally and lose the cancel; the loop exits on this flag instead
+            self._stopping = True
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        
+        if not await self.flush() and self._buffer:
+            logger.error(f"Giving up on {len(self._buffer)} buffered messages at shutdown")
+            self.failed += len(self._buffer)
+            self._buffer = []
+    
+    async def write(self, match_id, sender_id, receiver_id, content):
+        """Persist one relayed message"""
+        row = {
+            "match_id": match_id,
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "content": content,
+            "created_at": datetime.now(timezone.utc),
+        }
+        
+        if not self._task:
+            try:
+                await self._write_rows([row])
+            except Exception:
+                self.failed += 1
+                raise
+            return
+        
+        self._buffer.append(row)
+        if len(self._buffer) > self.buffer_limit:
+            dropped = len(self._buffer) - self.buffer_limit
+            del self._buffer[:dropped]
+            self.failed += dropped
+            logger.warning(f"Message buffer full while writes are failing; dropped {dropped} oldest messages")
+        
+        if len(self._buffer) >= self.max_buffer and not self._backing_off():
+            # The database is falling behind; make this writer wait for the flush
+            await self.flush()
+        elif len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+    
+    def _backing_off(self):
+        return time.monotonic() < self._retry_at
+    
+    async def flush(self):
+        """Write out the current buffer. Returns False if the write failed (the rows stay buffered)."""
+        if not self._buffer:
+            return True
+        
+        async with self._flush_lock:
+            rows, self._buffer = self._buffer, []
+            if not rows:
+                return True
+            try:
+                await self._write_rows(rows)
+            except Exception as e:
+                # Back at the head, ahead of anything buffered during the write
+                self._buffer[:0] = rows
+                self._failures += 1
+                delay = min(self.retry_max, self.flush_interval * 2 ** self._failures)
+                self._retry_at = time.monotonic() + delay
+                logger.error(f"Error writing {len(rows)} messages, retrying in {delay:.2f}s: {e}")
+                return False
+            
+            if self._failures:
+                self.retries += self._failures
+                self._failures = 0
+                self._retry_at = 0.0
+            return True
+    
+    async def _flush_loop(self):
+        while not self._stopping:
+            timeout = max(self.flush_interval, self._retry_at - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            
+            if not self._backing_off():
+                await self.flush()
+    
+    async def _write_rows(self, rows):
+        started_at = time.monotonic()
+        await self.database.run(self._insert_tx, rows)
+        
+        elapsed = time.monotonic() - started_at
+        self.written += len(rows)
+        self.flushes += 1
+        self._flush_total += elapsed
+        self._flush_max = max(self._flush_max, elapsed)
+    
+    def _insert_tx(self, session, rows):
+        session.execute(insert(Message), rows)
+        
+        # Keep the idle-match sweeper's timestamp current, one UPDATE per batch
+        session.execute(
+            update(Match).where(Match.id.in_({row["match_id"] for row in rows}))
+            .values(last_activity_at=max(row["created_at"] for row in rows))
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+    
+    def stats(self):
+        """Return buffer size and flush latency counters"""
+        return {
+            "mode": self.mode,
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "failed": self.failed,
+            "retries": self.retries,
+            "backing_off": self._backing_off(),
+            "flushes": self.flushes,
+            "avg_batch_size": round(self.written / self.flushes, 1) if self.flushes else 0.0,
+            "avg_flush_ms": round(self._flush_total / self.flushes * 1000, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self._flush_max * 1000, 3),
+        }
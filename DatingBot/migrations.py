@@ -0,0 +1,94 @@
+"""Schema upgrades that db.create_all() doesn't perform on existing databases.
+
+create_all() only creates missing tables; columns and indexes declared later
+on existing tables have to be added here, along with any data backfills.
+Every step is idempotent and runs at startup.
+
+Usage:
+    python migrations.py [--database-url URL]
+"""
+import argparse
+import logging
+from sqlalchemy import create_engine, inspect, update, select, func
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+from config import Config
+from models import db, Match, Message
+from interests import backfill_interest_ids
+
+logger = logging.getLogger(__name__)
+
+def ensure_columns(engine):
+    """Add any declared (nullable) column that is missing from an existing table"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_sql = CreateColumn(column).compile(dialect=engine.dialect)
+                    connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column_sql}")
+                    added.append(f"{table.name}.{column.name}")
+    
+    if added:
+        logger.info(f"Added columns: {', '.join(added)}")
+    return added
+
+def ensure_indexes(engine):
+    """Create any declared index that is missing from an existing table"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+    
+    if created:
+        logger.info(f"Created indexes: {', '.join(created)}")
+    return created
+
+def backfill_last_activity(session):
+    """Set matches.last_activity_at, where missing, to the last message (or creation) time"""
+    last_message = select(func.max(Message.created_at)).where(Message.match_id == Match.id).scalar_subquery()
+    result = session.execute(
+        update(Match).where(Match.last_activity_at.is_(None))
+        .values(last_activity_at=func.coalesce(last_message, Match.created_at))
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    if result.rowcount:
+        logger.info(f"Backfilled last_activity_at for {result.rowcount} matches")
+    return result.rowcount
+
+def upgrade(engine):
+    """Bring an existing database up to the current models"""
+    db.metadata.create_all(engine)  # New tables
+    changes = ensure_columns(engine)
+    changes += ensure_indexes(engine)
+    
+    with Session(engine) as session:
+        backfill_interest_ids(session)
+        backfill_last_activity(session)
+    return changes
+
+if __name__ == '__main__':
+    logging.basicConfig(format=Config.LOG_FORMAT, level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Apply schema upgrades")
+    parser.add_argument("--database-url", default=Config.DATABASE_URL)
+    args = parser.parse_args()
+    
+    changes = upgrade(create_engine(args.database_url))
+    print(f"{len(changes)} column(s)/index(es) added")
@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.orm import relationship
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
@@ -68,6 +68,7 @@ class UserProfile(db.Model):
     looking_for = Column(Enum(Gender), nullable=False)
     bio = Column(Text, nullable=True)
     interests = Column(Text, nullable=True)  # JSON string of interests
+    interest_ids = Column(Text, nullable=True)  # Sorted InterestToken ids, e.g. "3,17,42"; set with interests
     min_age = Column(Integer, default=18)
     max_age = Column(Integer, default=50)
     city = Column(String(100), nullable=True)
@@ -77,9 +78,39 @@ class UserProfile(db.Model):
     # Relationships
     user = relationship("User", back_populates="profile")
     
+    __table_args__ = (
+        Index('ix_user_profiles_user_id', 'user_id'),
+        # Candidate search in MatchingService.find_match
+        Index('ix_user_profiles_gender_looking_age', 'gender', 'looking_for', 'age'),
+    )
+    
+    # Normalized scoring features (same names as on matching_pool.PoolEntry)
+    @property
+    def interest_set(self):
+        from interests import decode_interest_ids
+        return decode_interest_ids(self.interest_ids)
+    
+    @property
+    def city_key(self):
+        from interests import city_key
+        return city_key(self.city)
+    
+    @property
+    def bio_length(self):
+        return len(self.bio) if self.bio else 0
+    
     def __repr__(self):
         return f'<UserProfile {self.user_id}>'
 
+class InterestToken(db.Model):
+    __tablename__ = 'interest_tokens'
+    
+    id = Column(Integer, primary_key=True)
+    token = Column(String(100), unique=True, nullable=False)  # Lowercased, stripped interest
+    
+    def __repr__(self):
+        return f'<InterestToken {self.id}: {self.token}>'
+
 class Match(db.Model):
     __tablename__ = 'matches'
     
@@ -89,6 +120,7 @@ class Match(db.Model):
     status = Column(Enum(MatchStatus), default=MatchStatus.PENDING)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     ended_at = Column(DateTime, nullable=True)
+    last_activity_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))  # Creation or last relayed message; drives the idle sweeper
     anonymous_id_1 = Column(String(20), nullable=False)  # Anonymous ID for user1
     anonymous_id_2 = Column(String(20), nullable=False)  # Anonymous ID for user2
     
@@ -97,6 +129,20 @@ class Match(db.Model):
     user2 = relationship("User", foreign_keys=[user2_id], back_populates="received_matches")
     messages = relationship("Message", back_populates="match", cascade="all, delete-orphan")
     
+    __table_args__ = (
+        # Match history and recent-match exclusion, per side
+        Index('ix_matches_user1_created', 'user1_id', 'created_at'),
+        Index('ix_matches_user2_created', 'user2_id', 'created_at'),
+        # Active-match lookups only ever touch a small slice of the table
+        Index('ix_matches_active_user1', 'user1_id',
+              postgresql_where=(status == MatchStatus.ACTIVE), sqlite_where=(status == MatchStatus.ACTIVE)),
+        Index('ix_matches_active_user2', 'user2_id',
+              postgresql_where=(status == MatchStatus.ACTIVE), sqlite_where=(status == MatchStatus.ACTIVE)),
+        # Idle-match sweeper
+        Index('ix_matches_active_last_activity', 'last_activity_at',
+              postgresql_where=(status == MatchStatus.ACTIVE), sqlite_where=(status == MatchStatus.ACTIVE)),
+    )
+    
     def __repr__(self):
         return f'<Match {self.id}: {self.user1_id} -> {self.user2_id}>'
 
@@ -116,6 +162,10 @@ class Message(db.Model):
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
     receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
     
+    __table_args__ = (
+        Index('ix_messages_match_id', 'match_id'),
+    )
+    
     def __repr__(self):
         return f'<Message {self.id}: {self.sender_id} -> {self.receiver_id}>'
 
@@ -135,6 +185,10 @@ class Report(db.Model):
     reporter = relationship("User", foreign_keys=[reporter_id], back_populates="reports_made")
     reported = relationship("User", foreign_keys=[reported_id], back_populates="reports_received")
     
+    __table_args__ = (
+        Index('ix_reports_reporter_created', 'reporter_id', 'created_at'),
+    )
+    
     def __repr__(self):
         return f'<Report {self.id}: {self.reporter_id} -> {self.reported_id}>'
 
@@ -146,5 +200,25 @@ class BlockedUser(db.Model):
     blocked_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     
+    __table_args__ = (
+        Index('ix_blocked_users_blocker_blocked', 'blocker_id', 'blocked_id'),
+        Index('ix_blocked_users_blocked', 'blocked_id'),
+    )
+    
     def __repr__(self):
         return f'<BlockedUser {self.blocker_id} -> {self.blocked_id}>'
+
+class ConversationState(db.Model):
+    __tablename__ = 'conversation_states'
+    
+    telegram_id = Column(String(50), primary_key=True)
+    data = Column(Text, nullable=False)  # Compact JSON of the profile wizard's answers so far
+    expires_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        # Purge of abandoned signups
+        Index('ix_conversation_states_expires_at', 'expires_at'),
+    )
+    
+    def __repr__(self):
+        return f'<ConversationState {self.telegram_id}>'
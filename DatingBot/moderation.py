@@ -0,0 +1,244 @@
+"""Compiled content moderation.
+
+The rule file (moderation_rules.txt) lists words, substrings and regexes by
+category. A rule set compiles them once: literals into an Aho-Corasick
+automaton (pyahocorasick, optional) and everything else into one combined
+regex whose named groups map back to rules. A check is then one scan per
+automaton instead of a re.search per pattern. Without pyahocorasick, word
+rules are looked up per token and substrings join the combined regex.
+
+Checks can be scoped to some categories (e.g. bios only reject violence and
+drugs); each scope is compiled on first use.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from config import Config
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+RULE_KINDS = ("word", "substring", "regex")
+
+class Rule:
+    __slots__ = ("category", "kind", "value")
+    
+    def __init__(self, category, kind, value):
+        self.category = category
+        self.kind = kind
+        self.value = value
+    
+    def pattern(self):
+        if self.kind == "word":
+            return rf"\b{re.escape(self.value)}\b"
+        if self.kind == "substring":
+            return re.escape(self.value)
+        return self.value
+
+class Verdict:
+    """Why a text was flagged: the rule's category and the matched text"""
+    __slots__ = ("category", "match")
+    
+    def __init__(self, category, match):
+        self.category = category
+        self.match = match
+    
+    def __repr__(self):
+        return f"<Verdict {self.category}: {self.match!r}>"
+
+def parse_rules(text):
+    """Rules from rule-file text; raises ValueError on a malformed line or regex"""
+    rules = []
+    category = None
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            category = line[1:-1].strip()
+            continue
+        
+        kind, _, value = line.partition(":")
+        kind, value = kind.strip(), value.strip()
+        if category is None or kind not in RULE_KINDS or not value:
+            raise ValueError(f"line {number}: expected '<{'|'.join(RULE_KINDS)}>: <value>' inside a [category]")
+        if kind == "regex":
+            try:
+                re.compile(value)
+            except re.error as e:
+                raise ValueError(f"line {number}: bad regex {value!r}: {e}")
+        else:
+            value = value.lower()
+        rules.append(Rule(category, kind, value))
+    return rules
+
+_TOKEN = re.compile(r"\w+")
+
+class _Matcher:
+    """One category scope compiled for single-pass matching.
+    
+    Without pyahocorasick, single-token word rules become a dict looked up
+    once per token of the text, so their cost doesn't grow with the word list.
+    """
+
+    def __init__(self, rules):
+        literals = [rule for rule in rules if rule.kind != "regex"] if ahocorasick else []
+        self._words = {} if ahocorasick else {
+            rule.value: rule for rule in reversed(rules) if rule.kind == "word" and _TOKEN.fullmatch(rule.value)
+        }
+        patterns = [
+            rule for rule in rules
+            if rule.kind == "regex" or (not ahocorasick and self._words.get(rule.value) is not rule)
+        ]
+        
+        self._automaton = None
+        if literals:
+            self._automaton = ahocorasick.Automaton()
+            for rule in literals:
+                self._automaton.add_word(rule.value, rule)
+            self._automaton.make_automaton()
+        
+        self._regex = None
+        self._group_rules = {}
+        if patterns:
+            groups = []
+            for index, rule in enumerate(patterns):
+                self._group_rules[f"r{index}"] = rule
+                groups.append(f"(?P<r{index}>{rule.pattern()})")
+            self._regex = re.compile("|".join(groups))
+    
+    def check(self, text):
+        if self._automaton is not None:
+            for end, rule in self._automaton.iter(text):
+                start = end - len(rule.value) + 1
+                if rule.kind == "word" and not _at_word_boundaries(text, start, end):
+                    continue
+                return Verdict(rule.category, text[start:end + 1])
+        
+        if self._words:
+            for token in _TOKEN.findall(text):
+                rule = self._words.get(token)
+                if rule is not None:
+                    return Verdict(rule.category, token)
+        
+        if self._regex is not None:
+            match = self._regex.search(text)
+            if match:
+                return Verdict(self._group_rules[match.lastgroup].category, match.group())
+        return None
+
+def _at_word_boundaries(text, start, end):
+    before = text[start - 1] if start > 0 else " "
+    after = text[end + 1] if end + 1 < len(text) else " "
+    return not (before.isalnum() or before == "_") and not (after.isalnum() or after == "_")
+
+class RuleSet:
+    """Parsed rules plus their compiled matchers, one per category scope"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.categories = frozenset(rule.category for rule in rules)
+        self._matchers = {}
+        self._lock = threading.Lock()
+    
+    def matcher(self, categories=None):
+        scope = self.categories if categories is None else frozenset(categories) & self.categories
+        matcher = self._matchers.get(scope)
+        if matcher is None:
+            with self._lock:
+                matcher = self._matchers.get(scope)
+                if matcher is None:
+                    matcher = self._matchers[scope] = _Matcher([rule for rule in self.rules if rule.category in scope])
+        return matcher
+
+class ModerationEngine:
+    """Checks text against the rule file, reloading it when the file changes.
+    
+    The file's modification time is looked at no more than once every
+    reload_seconds; a rule file that fails to parse is logged and the
+    previous rules stay in force.
+    """
+
+    def __init__(self, path=None, reload_seconds=None):
+        self.path = path or Config.MODERATION_RULES_FILE
+        self.reload_seconds = Config.MODERATION_RELOAD_SECONDS if reload_seconds is None else reload_seconds
+        self._rules = RuleSet([])
+        self._mtime = None
+        self._next_reload_check = 0.0
+        self._reload_lock = threading.Lock()
+        
+        self.checks = 0
+        self.flagged = {}  # category -> count
+        self.reloads = 0
+        self.reload_errors = 0
+        
+        self.reload()
+    
+    def reload(self):
+        """Load the rule file now; returns True if the rules were replaced"""
+        with self._reload_lock:
+            try:
+                mtime = os.path.getmtime(self.path)
+                with open(self.path, encoding="utf-8") as f:
+                    rules = RuleSet(parse_rules(f.read()))
+                rules.matcher()  # Compile the full scope before it goes live
+            except (OSError, ValueError) as e:
+                self.reload_errors += 1
+                logger.error(f"Moderation rules not loaded from {self.path}: {e}")
+                return False
+            
+            self._rules = rules
+            self._mtime = mtime
+            self.reloads += 1
+            logger.info(f"Loaded {len(rules.rules)} moderation rules in {len(rules.categories)} categories")
+            return True
+    
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_reload_check:
+            return
+        self._next_reload_check = now + self.reload_seconds
+        try:
+            changed = os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            return
+        if changed:
+            self.reload()
+    
+    def check(self, text, categories=None):
+        """The first rule the text breaks, as a Verdict, or None if it is clean"""
+        if not text:
+            return None
+        if self.reload_seconds:
+            self._maybe_reload()
+        
+        self.checks += 1
+        verdict = self._rules.matcher(categories).check(text.lower())
+        if verdict:
+            self.flagged[verdict.category] = self.flagged.get(verdict.category, 0) + 1
+        return verdict
+    
+    def stats(self):
+        return {
+            "rules": len(self._rules.rules),
+            "automaton": ahocorasick is not None,
+            "checks": self.checks,
+            "flagged": dict(self.flagged),
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+        }
+
+_engine = None
+
+def get_engine():
+    """The process-wide engine, created on first use"""
+    global _engine
+    if _engine is None:
+        _engine = ModerationEngine()
+    return _engine
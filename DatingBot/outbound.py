@@ -0,0 +1,275 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from telegram.error import RetryAfter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lowest value is sent first
+PRIORITY_RELAY = 0
+PRIORITY_MATCH_NOTICE = 1
+PRIORITY_INFO = 2
+
+PRIORITY_NAMES = {PRIORITY_RELAY: "relay", PRIORITY_MATCH_NOTICE: "match_notice", PRIORITY_INFO: "info"}
+
+# Telegram's limit on message text length
+MAX_TEXT_LENGTH = 4096
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+    
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+    
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class _Outgoing:
+    __slots__ = ("priority", "text", "kwargs", "enqueued_at")
+    
+    def __init__(self, priority, text, kwargs, enqueued_at):
+        self.priority = priority
+        self.text = text
+        self.kwargs = kwargs
+        self.enqueued_at = enqueued_at
+
+class _ChatQueue:
+    __slots__ = ("chat_id", "items", "bucket", "paused_until", "scheduled", "in_flight")
+    
+    def __init__(self, chat_id, bucket):
+        self.chat_id = chat_id
+        self.items = deque()
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.scheduled = False
+        self.in_flight = False
+
+class SendScheduler:
+    """Outbound message scheduler honouring Telegram's flood limits.
+
+    Every send passes a global token bucket (~30 msg/s) and a per-chat one
+    (~1 msg/s with a small burst). Each chat is a FIFO, so a user sees messages
+    in the order they were queued; across chats, the chat whose next message
+    has the best priority class goes first (relay > match notice > info).
+    When a chat falls behind, consecutive queued relays are coalesced into one
+    message. A RetryAfter from Telegram pauses the chat and the global lane for
+    the requested time and the message is retried.
+
+    Sends are fire-and-forget: callers queue and move on, failures are logged.
+    """
+
+    def __init__(self, bot, global_rate=None, per_chat_rate=None, per_chat_burst=None):
+        self.bot = bot
+        self.global_rate = global_rate or Config.OUTBOUND_GLOBAL_RATE
+        self.per_chat_rate = per_chat_rate or Config.OUTBOUND_PER_CHAT_RATE
+        self.per_chat_burst = per_chat_burst or Config.OUTBOUND_PER_CHAT_BURST
+        
+        self._chats = {}
+        self._ready = []  # (priority, seq, chat_id) for chats that may send now
+        self._waiting = []  # (not_before, seq, chat_id) for rate-limited chats
+        self._seq = itertools.count()
+        self._global = TokenBucket(self.global_rate, self.global_rate, time.monotonic())
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self._in_flight = set()
+        
+        # Counters
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.retry_after_events = 0
+        self._taken = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+    
+    async def start(self):
+        if not self._task:
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+    
+    async def close(self, timeout=5):
+        """Give queued messages a chance to go out, then stop"""
+        if not self._task:
+            return
+        
+        deadline = time.monotonic() + timeout
+        while (self._pending_count() or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        
+        # A send() from another handler during shutdown can set the wakeup in the same tick as
+        # this cancel; wait_for then returns normally and drops it, so _run() also checks the flag
+        self._stopping = True
+        self._task.cancel()
+        await asyncio.gather(self._task, *self._in_flight, return_exceptions=True)
+        self._task = None
+    
+    def send(self, chat_id, text, priority=PRIORITY_INFO, **kwargs):
+        """Queue a message for chat_id; extra kwargs go to bot.send_message"""
+        chat_id = str(chat_id)
+        now = time.monotonic()
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue(
+                chat_id, TokenBucket(self.per_chat_rate, self.per_chat_burst, now)
+            )
+        
+        chat.items.append(_Outgoing(priority, text, kwargs, now))
+        self.queued += 1
+        self._schedule(chat, now)
+        if self._wakeup:
+            self._wakeup.set()
+    
+    def _schedule(self, chat, now):
+        if chat.scheduled or chat.in_flight or not chat.items:
+            return
+        
+        chat.scheduled = True
+        not_before = max(chat.paused_until, now + chat.bucket.delay(now))
+        if not_before <= now:
+            heapq.heappush(self._ready, (chat.items[0].priority, next(self._seq), chat.chat_id))
+        else:
+            heapq.heappush(self._waiting, (not_before, next(self._seq), chat.chat_id))
+    
+    def _promote(self, now):
+        while self._waiting and self._waiting[0][0] <= now:
+            _, seq, chat_id = heapq.heappop(self._waiting)
+            chat = self._chats[chat_id]
+            heapq.heappush(self._ready, (chat.items[0].priority, seq, chat_id))
+    
+    async def _run(self):
+        while not self._stopping:
+            now = time.monotonic()
+            self._promote(now)
+            
+            if not self._ready:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            delay = max(self._paused_until - now, self._global.delay(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            
+            _, _, chat_id = heapq.heappop(self._ready)
+            chat = self._chats[chat_id]
+            chat.scheduled = False
+            
+            self._global.consume(now)
+            chat.bucket.consume(now)
+            chat.in_flight = True
+            
+            task = asyncio.create_task(self._deliver(chat, self._take(chat, now)))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            
+            if self._taken % 1000 == 0 and len(self._chats) > 1000:
+                self._evict_idle(now)
+    
+    def _take(self, chat, now):
+        """Pop the chat's next message, folding queued relays behind it into one"""
+        item = chat.items.popleft()
+        if item.priority == PRIORITY_RELAY and not item.kwargs:
+            texts = [item.text]
+            length = len(item.text)
+            while chat.items:
+                following = chat.items[0]
+                if following.priority != PRIORITY_RELAY or following.kwargs:
+                    break
+                if length + 1 + len(following.text) > MAX_TEXT_LENGTH:
+                    break
+                chat.items.popleft()
+                texts.append(following.text)
+                length += 1 + len(following.text)
+                self.coalesced += 1
+            if len(texts) > 1:
+                item = _Outgoing(item.priority, "\n".join(texts), item.kwargs, item.enqueued_at)
+        
+        wait = now - item.enqueued_at
+        self._taken += 1
+        self._queue_wait_total += wait
+        self._queue_wait_max = max(self._queue_wait_max, wait)
+        return item
+    
+    async def _deliver(self, chat, item):
+        try:
+            await self.bot.send_message(chat_id=chat.chat_id, text=item.text, **item.kwargs)
+            self.sent += 1
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            seconds = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+            logger.warning(f"Flood control hit sending to {chat.chat_id}, retrying in {seconds}s")
+            
+            self.retry_after_events += 1
+            until = time.monotonic() + seconds
+            chat.paused_until = until
+            self._paused_until = max(self._paused_until, until)
+            chat.items.appendleft(item)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error sending message to {chat.chat_id}: {e}")
+        finally:
+            chat.in_flight = False
+            self._schedule(chat, time.monotonic())
+            self._wakeup.set()
+    
+    def _evict_idle(self, now):
+        for chat_id in [c for c, chat in self._chats.items()
+                        if not chat.items and not chat.in_flight and not chat.scheduled and chat.bucket.is_full(now)]:
+            del self._chats[chat_id]
+    
+    def _pending_count(self):
+        return sum(len(chat.items) for chat in self._chats.values())
+    
+    def stats(self):
+        """Return queue and delivery counters"""
+        # Runs on the metrics thread while the loop adds and drops chats; work from snapshots
+        chats = list(self._chats.items())
+        pending = {name: 0 for name in PRIORITY_NAMES.values()}
+        for _, chat in chats:
+            for item in list(chat.items):
+                pending[PRIORITY_NAMES[item.priority]] += 1
+        
+        return {
+            "pending": pending,
+            "chats": len(chats),
+            "queued": self.queued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "retry_after_events": self.retry_after_events,
+            "avg_queue_wait_ms": round(self._queue_wait_total / self._taken * 1000, 3) if self._taken else 0.0,
+            "max_queue_wait_ms": round(self._queue_wait_max * 1000, 3),
+        }
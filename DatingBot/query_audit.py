@@ -0,0 +1,148 @@
+"""Query-plan audit for the queries issued by MatchingService and BotHandlers.
+
+Runs each database operation inside a transaction that is rolled back,
+captures the SQL it issues, and EXPLAINs every statement. Statements whose
+plan contains a full table scan are flagged. On Postgres, sequential scans
+are disabled for the audit so a remaining "Seq Scan" means no usable index.
+
+Usage:
+    python query_audit.py [--database-url URL]
+
+Exits with status 1 if any statement is flagged.
+"""
+import argparse
+import re
+import sys
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from config import Config
+from models import db, User, UserProfile, Match, BlockedUser, Gender, MatchStatus
+from bot_handlers import BotHandlers, get_user, get_active_match
+from conversation_state import SqlStateStore
+
+def seed_fixture(session):
+    """Make sure the audited queries have rows to work with"""
+    users = []
+    for telegram_id, gender, looking_for in (("900000001", Gender.MALE, Gender.FEMALE),
+                                             ("900000002", Gender.FEMALE, Gender.MALE),
+                                             ("900000003", Gender.FEMALE, Gender.MALE)):
+        user = User(telegram_id=telegram_id, is_registered=True)
+        user.profile = UserProfile(age=25, gender=gender, looking_for=looking_for)
+        session.add(user)
+        users.append(user)
+    session.flush()
+    
+    session.add(Match(user1_id=users[0].id, user2_id=users[1].id, status=MatchStatus.ENDED,
+                      anonymous_id_1="UserAUDIT1", anonymous_id_2="UserAUDIT2"))
+    session.add(BlockedUser(blocker_id=users[0].id, blocked_id=users[1].id))
+    session.flush()
+    return users
+
+# Startup loads that read every eligible row on purpose; their plans are shown but not flagged
+FULL_LOAD_OPERATIONS = {"MatchingPool.rebuild"}
+
+def audited_operations(handlers, users):
+    """(name, fn(session)) for each hot database operation"""
+    user = users[0]
+    return [
+        ("get_user", lambda s: get_user(s, user.telegram_id)),
+        ("get_active_match", lambda s: get_active_match(s, user.id)),
+        ("BotHandlers._lookup_route_tx", lambda s: handlers._lookup_route_tx(s, user.telegram_id)),
+        ("UserCache.fetch", lambda s: handlers.user_cache.fetch(s, user.telegram_id)),
+        ("MatchingService._find_match", lambda s: handlers.matching_service._find_match(s, user.id)),
+        ("MatchingService._get_user_match_history", lambda s: handlers.matching_service._get_user_match_history(s, user.id, 10)),
+        ("MatchingService._end_inactive_matches", lambda s: handlers.matching_service._end_inactive_matches(s, 24)),
+        ("BotHandlers._stop_chat_tx", lambda s: handlers._stop_chat_tx(s, user.telegram_id)),
+        ("BotHandlers._report_tx", lambda s: handlers._report_tx(s, user.telegram_id, "spam", None)),
+        ("BotHandlers._block_tx", lambda s: handlers._block_tx(s, user.telegram_id)),
+        ("SqlStateStore._set_tx", lambda s: SqlStateStore(handlers.database)._set_tx(s, user.telegram_id, "{}", True)),
+        ("SqlStateStore._get_tx", lambda s: SqlStateStore(handlers.database)._get_tx(s, user.telegram_id)),
+        ("RoutingTable.rebuild", lambda s: handlers.routing_table.rebuild(s)),
+        ("MatchingPool.rebuild", lambda s: handlers.matching_service.pool.rebuild(s)),
+        ("MatchingPool.refresh", lambda s: handlers.matching_service.pool.refresh(s, [u.id for u in users])),
+    ]
+
+def _is_table_scan(line):
+    match = re.match(r"SCAN (\w+)", line)
+    if not match or "INDEX" in line:
+        return False
+    name = re.sub(r"_\d+$", "", match.group(1))  # Strip alias suffixes like users_1
+    return name in db.metadata.tables
+
+def explain(connection, statement, parameters):
+    if connection.dialect.name == "postgresql":
+        rows = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters).fetchall()
+        plan = [row[0] for row in rows]
+        flagged = [line.strip() for line in plan if "Seq Scan" in line]
+    else:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        plan = [row[-1] for row in rows]
+        # "SCAN t" is a full scan of t; "SCAN t USING (COVERING) INDEX" walks an index and
+        # scans of subquery results (anon_1) aren't table scans
+        flagged = [line for line in plan if _is_table_scan(line)]
+    return plan, flagged
+
+def enable_sqlite_savepoints(engine):
+    """pysqlite manages transactions itself and breaks SAVEPOINT; let SQLAlchemy emit BEGIN
+    so the audit's rollback really discards the fixture"""
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, "begin")
+    def on_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+def run_audit(engine, out=sys.stdout):
+    handlers = BotHandlers(database=None, bot=None)
+    flagged_total = 0
+    
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            if connection.dialect.name == "postgresql":
+                connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            
+            session = Session(bind=connection, join_transaction_mode="create_savepoint", expire_on_commit=False)
+            users = seed_fixture(session)
+            
+            for name, operation in audited_operations(handlers, users):
+                captured = []
+                
+                def capture(conn, cursor, statement, parameters, context, executemany):
+                    if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                        captured.append((statement, parameters))
+                
+                event.listen(connection, "before_cursor_execute", capture)
+                try:
+                    operation(session)
+                    session.flush()
+                finally:
+                    event.remove(connection, "before_cursor_execute", capture)
+                
+                print(f"== {name}", file=out)
+                for statement, parameters in captured:
+                    plan, flagged = explain(connection, statement, parameters)
+                    if name in FULL_LOAD_OPERATIONS:
+                        flagged = []
+                    flagged_total += len(flagged)
+                    print(f"  {' '.join(statement.split())[:160]}", file=out)
+                    for line in plan:
+                        marker = "!!" if line.strip() in flagged else "  "
+                        print(f"    {marker} {line}", file=out)
+        finally:
+            transaction.rollback()
+    
+    print(f"\n{flagged_total} full table scan(s) flagged", file=out)
+    return flagged_total
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="EXPLAIN the bot's hot queries and flag table scans")
+    parser.add_argument("--database-url", default=Config.DATABASE_URL)
+    args = parser.parse_args()
+    
+    engine = create_engine(args.database_url)
+    if engine.dialect.name == "sqlite":
+        enable_sqlite_savepoints(engine)
+    db.metadata.create_all(engine)
+    sys.exit(1 if run_audit(engine) else 0)
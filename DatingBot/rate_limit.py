@@ -0,0 +1,199 @@
+import logging
+import math
+import time
+from collections import OrderedDict
+from config import Config
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Stale entries dropped per hit, so eviction cost stays bounded on every call
+EVICT_PER_HIT = 4
+# Float slack on the sliding count, so a retry at exactly retry_after is allowed
+ESTIMATE_TOLERANCE = 1e-9
+
+class RateDecision:
+    """Result of a hit: whether it is allowed, seconds until it would be, and
+    whether this is the first refusal of the window (tell the user once)"""
+    __slots__ = ("allowed", "retry_after", "warn")
+    
+    def __init__(self, allowed, retry_after=0.0, warn=False):
+        self.allowed = allowed
+        self.retry_after = retry_after
+        self.warn = warn
+    
+    def __bool__(self):
+        return self.allowed
+
+ALLOWED = RateDecision(True)
+
+class _Window:
+    """Counters for one key: hits in the current and previous fixed window"""
+    __slots__ = ("index", "count", "previous", "warned")
+    
+    def __init__(self, index):
+        self.index = index
+        self.count = 0
+        self.previous = 0
+        self.warned = False
+    
+    def roll(self, index):
+        if index != self.index:
+            self.previous = self.count if index == self.index + 1 else 0
+            self.count = 0
+            self.warned = False
+            self.index = index
+
+def _estimate(previous, count, elapsed_fraction):
+    """Sliding-window count: the previous window weighted by how much of it still overlaps"""
+    return previous * (1 - elapsed_fraction) + count
+
+def _retry_after(limit, previous, count, window, elapsed):
+    """Seconds until the sliding count leaves room for one more hit, assuming no more hits"""
+    if count >= limit or not previous:
+        return window - elapsed
+    # previous * (1 - t / window) + count + 1 <= limit  =>  t >= window * (1 - (limit - count - 1) / previous)
+    return max(0.0, window * (1 - (limit - count - 1) / previous) - elapsed)
+
+class RateLimiter:
+    """Per-key sliding-window limit: at most `limit` hits in any `window` seconds.
+    
+    The window is approximated from two fixed-window counters per key (the
+    current one, and the previous one weighted by its remaining overlap), so
+    each key costs a few integers however many hits it makes. Keys untouched
+    for a full window carry no state worth keeping and are evicted as other
+    keys are hit; max_keys bounds the table outright.
+    
+    With a SharedRateStore the counters live in Redis instead, so every
+    process enforces one limit per key. If Redis fails, the local counters
+    take over until it is reachable again.
+    """
+
+    def __init__(self, name, limit, window, store=None, max_keys=None):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.store = store
+        self.max_keys = max_keys or Config.RATE_LIMIT_MAX_KEYS
+        self._windows = OrderedDict()  # key -> _Window, least recently hit first
+        
+        self.allowed = 0
+        self.throttled = 0
+        self.throttled_keys = 0  # Keys refused at least once in a window
+        self.evicted = 0
+        self.store_errors = 0
+    
+    async def hit(self, key, now=None):
+        """Count one hit for key; returns a RateDecision (truthy when allowed)"""
+        if not self.limit:
+            return ALLOWED
+        now = time.time() if now is None else now
+        
+        decision = None
+        if self.store is not None:
+            try:
+                decision = await self.store.hit(self.name, str(key), self.limit, self.window, now)
+            except Exception as e:
+                self.store_errors += 1
+                logger.warning(f"Rate limit store failed for {self.name}, using local counters: {e}")
+        if decision is None:
+            decision = self._hit_local(str(key), now)
+        
+        if decision.allowed:
+            self.allowed += 1
+        else:
+            self.throttled += 1
+            if decision.warn:
+                self.throttled_keys += 1
+        return decision
+    
+    def _hit_local(self, key, now):
+        index, elapsed = divmod(now, self.window)
+        index = int(index)
+        
+        entry = self._windows.get(key)
+        if entry is None:
+            entry = self._windows[key] = _Window(index)
+        else:
+            entry.roll(index)
+            self._windows.move_to_end(key)
+        self._evict(index)
+        
+        if _estimate(entry.previous, entry.count, elapsed / self.window) + 1 > self.limit + ESTIMATE_TOLERANCE:
+            warn = not entry.warned
+            entry.warned = True
+            return RateDecision(False, _retry_after(self.limit, entry.previous, entry.count, self.window, elapsed), warn)
+        entry.count += 1
+        return ALLOWED
+    
+    def _evict(self, index):
+        # The front of the table is the least recently hit; a key idle since before
+        # the previous window has an estimate of zero, same as having no entry
+        for _ in range(EVICT_PER_HIT):
+            key, entry = next(iter(self._windows.items()))
+            if entry.index >= index - 1 and len(self._windows) <= self.max_keys:
+                break
+            del self._windows[key]
+            self.evicted += 1
+    
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "window_seconds": self.window,
+            "backend": "redis" if self.store is not None else "memory",
+            "keys": len(self._windows),
+            "allowed": self.allowed,
+            "throttled": self.throttled,
+            "throttled_keys": self.throttled_keys,
+            "evicted": self.evicted,
+            "store_errors": self.store_errors,
+        }
+
+class SharedRateStore:
+    """Sliding-window counters in Redis, shared by every bot process.
+    
+    Each key has one counter per fixed window (expiring after two windows);
+    a hit is one pipelined round trip that increments the current counter
+    and reads the previous one. A refused hit is taken back out again.
+    """
+
+    def __init__(self, url, prefix="ratelimit"):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+    
+    async def hit(self, name, key, limit, window, now):
+        index, elapsed = divmod(now, window)
+        index = int(index)
+        current_key = f"{self.prefix}:{name}:{key}:{index}"
+        previous_key = f"{self.prefix}:{name}:{key}:{index - 1}"
+        
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.incr(current_key)
+            pipe.expire(current_key, math.ceil(window * 2))
+            pipe.get(previous_key)
+            count, _, previous = await pipe.execute()
+        previous = int(previous or 0)
+        
+        if _estimate(previous, count, elapsed / window) <= limit + ESTIMATE_TOLERANCE:
+            return ALLOWED
+        
+        count = await self.client.decr(current_key)
+        retry_after = _retry_after(limit, previous, count, window, elapsed)
+        warned_key = f"{self.prefix}:{name}:{key}:{index}:warned"
+        warn = bool(await self.client.set(warned_key, 1, nx=True, ex=math.ceil(window)))
+        return RateDecision(False, retry_after, warn)
+    
+    async def close(self):
+        await self.client.aclose()
+
+def shared_store():
+    """The Redis store when RATE_LIMIT_REDIS_URL is configured, else None (per-process limits)"""
+    if not Config.RATE_LIMIT_REDIS_URL:
+        return None
+    return SharedRateStore(Config.RATE_LIMIT_REDIS_URL)
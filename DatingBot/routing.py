@@ -0,0 +1,75 @@
+import logging
+import threading
+from collections import namedtuple
+from sqlalchemy.orm import aliased
+from models import User, Match, MatchStatus
+
+logger = logging.getLogger(__name__)
+
+# Where a user's chat messages go while they are in an active match
+Route = namedtuple("Route", ["match_id", "user_id", "partner_id", "partner_telegram_id", "anonymous_id"])
+
+class RoutingTable:
+    """In-process map of telegram_id -> Route for every active match.
+
+    Filled when a match is created, cleared when it ends and rebuilt from the
+    database at startup, so relaying a chat message needs no lookup queries.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._matches = {}  # match_id -> (user1 telegram_id, user2 telegram_id)
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._routes)
+    
+    def get(self, telegram_id):
+        return self._routes.get(str(telegram_id))
+    
+    def add_match(self, match, user1_telegram_id, user2_telegram_id):
+        """Route both sides of a newly active match to each other"""
+        user1_telegram_id = str(user1_telegram_id)
+        user2_telegram_id = str(user2_telegram_id)
+        with self._lock:
+            self._routes[user1_telegram_id] = Route(
+                match.id, match.user1_id, match.user2_id, user2_telegram_id, match.anonymous_id_1
+            )
+            self._routes[user2_telegram_id] = Route(
+                match.id, match.user2_id, match.user1_id, user1_telegram_id, match.anonymous_id_2
+            )
+            self._matches[match.id] = (user1_telegram_id, user2_telegram_id)
+    
+    def remove_match(self, match_id):
+        """Drop both sides of a match"""
+        with self._lock:
+            for telegram_id in self._matches.pop(match_id, ()):
+                route = self._routes.get(telegram_id)
+                if route and route.match_id == match_id:
+                    del self._routes[telegram_id]
+    
+    def remove_user(self, telegram_id):
+        """Drop the match the user is routed through, both sides"""
+        route = self.get(telegram_id)
+        if route:
+            self.remove_match(route.match_id)
+        return route
+    
+    def rebuild(self, session):
+        """Reload every active match from the database"""
+        user1 = aliased(User)
+        user2 = aliased(User)
+        rows = session.query(Match, user1.telegram_id, user2.telegram_id).join(
+            user1, Match.user1_id == user1.id
+        ).join(
+            user2, Match.user2_id == user2.id
+        ).filter(Match.status == MatchStatus.ACTIVE).all()
+        
+        with self._lock:
+            self._routes.clear()
+            self._matches.clear()
+        for match, user1_telegram_id, user2_telegram_id in rows:
+            self.add_match(match, user1_telegram_id, user2_telegram_id)
+        
+        logger.info(f"Routing table rebuilt with {len(rows)} active matches")
+        return len(rows)
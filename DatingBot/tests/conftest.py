@@ -0,0 +1,30 @@
+import os
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:test")
+
+import pytest
+from sqlalchemy import create_engine
+from database import DatabaseExecutor
+from models import db, User, UserProfile, Gender
+
+@pytest.fixture
+def database(tmp_path):
+    """A DatabaseExecutor over a fresh SQLite file with all tables created"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"timeout": 30})
+    db.metadata.create_all(engine)
+    executor = DatabaseExecutor(engine, max_workers=8)
+    yield executor
+    executor.close()
+    engine.dispose()
+
+@pytest.fixture
+def make_user(database):
+    """Create a registered user with a profile; returns its id"""
+    def make(telegram_id, gender=Gender.MALE, looking_for=Gender.FEMALE, age=25):
+        with database.Session() as session:
+            user = User(telegram_id=str(telegram_id), is_registered=True)
+            user.profile = UserProfile(age=age, gender=gender, looking_for=looking_for, city="Paris")
+            session.add(user)
+            session.commit()
+            return user.id
+    return make
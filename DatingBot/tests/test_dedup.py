@@ -0,0 +1,70 @@
+from dedup import UpdateDeduplicator
+
+def accept(dedup, update_id):
+    """What the dispatcher does with each update: drop it, or record it"""
+    if dedup.is_duplicate(update_id):
+        return False
+    dedup.record(update_id)
+    return True
+
+def test_redelivered_update_is_dropped():
+    dedup = UpdateDeduplicator(window=10, hwm_path="")
+    
+    assert accept(dedup, 5)
+    assert not accept(dedup, 5)
+    assert dedup.duplicates == 1
+
+def test_ring_forgets_ids_beyond_the_window():
+    dedup = UpdateDeduplicator(window=3, hwm_path="")
+    for update_id in (1, 2, 3, 4):
+        assert accept(dedup, update_id)
+    
+    # 1 fell out of the ring; without a persisted mark it is accepted again
+    assert accept(dedup, 1)
+    assert not accept(dedup, 4)
+    assert len(dedup._seen) == len(dedup._ring) == 3
+
+def test_updates_without_an_id_are_never_dropped():
+    dedup = UpdateDeduplicator(window=3, hwm_path="")
+    
+    assert accept(dedup, None)
+    assert accept(dedup, None)
+    assert dedup.high_water_mark == 0
+
+def test_high_water_mark_survives_a_restart(tmp_path):
+    hwm_path = str(tmp_path / "hwm")
+    dedup = UpdateDeduplicator(window=10, hwm_path=hwm_path, save_every=1)
+    for update_id in (10, 12, 11):
+        accept(dedup, update_id)
+        if dedup.needs_save():
+            dedup.save()
+    
+    restarted = UpdateDeduplicator(window=10, hwm_path=hwm_path)
+    
+    assert restarted.high_water_mark == 12
+    assert not accept(restarted, 12)
+    assert not accept(restarted, 7)
+    assert accept(restarted, 13)
+
+def test_high_water_mark_saved_every_n_new_highs(tmp_path):
+    hwm_path = tmp_path / "hwm"
+    dedup = UpdateDeduplicator(window=10, hwm_path=str(hwm_path), save_every=3)
+    
+    for update_id in (1, 2):
+        accept(dedup, update_id)
+    assert not dedup.needs_save()
+    accept(dedup, 3)
+    assert dedup.needs_save()
+    dedup.save()
+    
+    assert hwm_path.read_text() == "3"
+    assert not dedup.needs_save()
+
+def test_unreadable_high_water_mark_is_ignored(tmp_path):
+    hwm_path = tmp_path / "hwm"
+    hwm_path.write_text("not a number")
+    
+    dedup = UpdateDeduplicator(window=10, hwm_path=str(hwm_path))
+    
+    assert dedup.high_water_mark == 0
+    assert accept(dedup, 1)
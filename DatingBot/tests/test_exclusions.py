@@ -0,0 +1,63 @@
+import pytest
+from exclusions import ExclusionCache
+from models import BlockedUser
+
+class RacingExclusionCache(ExclusionCache):
+    """Runs a write while a user's entry is loading, after the load read the database"""
+    
+    def __init__(self, write, **kwargs):
+        super().__init__(**kwargs)
+        self.write = write
+    
+    def _load(self, session, user_id):
+        entry = super()._load(session, user_id)
+        self.write(self)
+        return entry
+
+def test_block_during_load_is_kept(database, make_user):
+    user_id, other_id = make_user(1), make_user(2)
+    cache = RacingExclusionCache(lambda cache: cache.add_block(other_id, user_id), max_users=10)
+    
+    with database.Session() as session:
+        entry = cache.get(session, user_id)
+    
+    assert other_id in cache.excluded_ids(entry)
+    assert cache.get(None, user_id) is entry
+    assert not cache._loading
+
+def test_match_during_load_is_kept(database, make_user):
+    user_id, other_id = make_user(1), make_user(2)
+    cache = RacingExclusionCache(lambda cache: cache.add_match(user_id, other_id), max_users=10)
+    
+    with database.Session() as session:
+        entry = cache.get(session, user_id)
+    
+    assert other_id in cache.excluded_ids(entry)
+
+def test_block_during_load_reaches_bloom_filter(database, make_user):
+    user_id = make_user(1)
+    blocked_ids = [make_user(i) for i in range(2, 6)]
+    late_id = make_user(6)
+    with database.Session() as session:
+        session.add_all(BlockedUser(blocker_id=user_id, blocked_id=blocked_id) for blocked_id in blocked_ids)
+        session.commit()
+    cache = RacingExclusionCache(lambda cache: cache.add_block(user_id, late_id), max_users=10, bloom_threshold=2)
+    
+    with database.Session() as session:
+        entry = cache.get(session, user_id)
+        assert entry.bloom is not None
+        # The block row itself was never committed, so only the Bloom filter can know about it
+        assert late_id in entry.bloom
+
+def test_failed_load_stops_recording_writes(make_user):
+    cache = ExclusionCache(max_users=10)
+    
+    class BrokenSession:
+        def query(self, *args):
+            raise RuntimeError("database unavailable")
+    
+    with pytest.raises(RuntimeError):
+        cache.get(BrokenSession(), 1)
+    cache.add_block(1, 2)
+    
+    assert not cache._loading
@@ -0,0 +1,58 @@
+import asyncio
+from collections import Counter
+import pytest
+from matching_service import MatchingService
+from models import Match, MatchStatus, Gender
+
+def active_match_counts(database):
+    with database.Session() as session:
+        counts = Counter()
+        for match in session.query(Match).filter(Match.status == MatchStatus.ACTIVE):
+            counts[match.user1_id] += 1
+            counts[match.user2_id] += 1
+        return counts
+
+async def find_matches(service, user_ids):
+    return await asyncio.gather(*(service.find_match(user_id) for user_id in user_ids))
+
+@pytest.mark.parametrize("from_pool", [True, False])
+def test_same_seeker_searching_concurrently_gets_one_match(database, make_user, from_pool):
+    seeker_id = make_user(1)
+    candidate_ids = [make_user(telegram_id, Gender.FEMALE, Gender.MALE) for telegram_id in range(2, 5)]
+    service = MatchingService(database)
+    if from_pool:
+        database.run_sync(service.pool.rebuild)
+    
+    matches = asyncio.run(find_matches(service, [seeker_id] * 8))
+    
+    assert sum(match is not None for match in matches) == 1
+    counts = active_match_counts(database)
+    assert counts[seeker_id] == 1
+    assert sum(counts[candidate_id] for candidate_id in candidate_ids) == 1
+
+@pytest.mark.parametrize("from_pool", [True, False])
+def test_seekers_racing_for_one_candidate(database, make_user, from_pool):
+    candidate_id = make_user(1, Gender.FEMALE, Gender.MALE)
+    seeker_ids = [make_user(telegram_id) for telegram_id in range(2, 10)]
+    service = MatchingService(database)
+    if from_pool:
+        database.run_sync(service.pool.rebuild)
+    
+    matches = asyncio.run(find_matches(service, seeker_ids))
+    
+    assert sum(match is not None for match in matches) == 1
+    assert active_match_counts(database)[candidate_id] == 1
+
+def test_many_seekers_many_candidates_at_most_one_match_each(database, make_user):
+    males = [make_user(telegram_id) for telegram_id in range(1, 13)]
+    females = [make_user(telegram_id, Gender.FEMALE, Gender.MALE) for telegram_id in range(13, 25)]
+    service = MatchingService(database)
+    database.run_sync(service.pool.rebuild)
+    
+    # Both sides search at once, several times each, so every user is a seeker and a candidate
+    asyncio.run(find_matches(service, (males + females) * 3))
+    
+    counts = active_match_counts(database)
+    assert counts
+    assert max(counts.values()) == 1
+    assert not service.claims
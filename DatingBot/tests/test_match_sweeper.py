@@ -0,0 +1,53 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+from match_sweeper import InactiveMatchSweeper
+from matching_service import MatchingService
+from models import Match, MatchStatus, Gender
+
+def add_match(database, user1_id, user2_id, idle_hours, status=MatchStatus.ACTIVE):
+    last_activity_at = datetime.now(timezone.utc) - timedelta(hours=idle_hours)
+    with database.Session() as session:
+        match = Match(user1_id=user1_id, user2_id=user2_id, status=status, anonymous_id_1=f"A{user1_id}",
+                      anonymous_id_2=f"A{user2_id}", last_activity_at=last_activity_at)
+        session.add(match)
+        session.commit()
+        return match.id
+
+def statuses(database):
+    with database.Session() as session:
+        return {match_id: status for match_id, status in session.query(Match.id, Match.status)}
+
+def test_sweep_ends_only_idle_active_matches(database, make_user):
+    users = [make_user(telegram_id, *((Gender.MALE, Gender.FEMALE) if telegram_id % 2 else (Gender.FEMALE, Gender.MALE)))
+             for telegram_id in range(1, 7)]
+    idle_id = add_match(database, users[0], users[1], idle_hours=30)
+    fresh_id = add_match(database, users[2], users[3], idle_hours=1)
+    already_ended_id = add_match(database, users[4], users[5], idle_hours=30, status=MatchStatus.ENDED)
+    
+    service = MatchingService(database)
+    notified = []
+    async def on_ended(ended):
+        notified.extend(ended)
+    sweeper = InactiveMatchSweeper(service, on_ended, max_inactive_hours=24)
+    
+    assert asyncio.run(sweeper.sweep()) == 1
+    
+    assert statuses(database) == {idle_id: MatchStatus.ENDED, fresh_id: MatchStatus.ACTIVE,
+                                  already_ended_id: MatchStatus.ENDED}
+    assert notified == [(idle_id, "1", "2")]
+    # The freed pair can be matched again; the pair still chatting cannot
+    assert users[0] in service.pool and users[1] in service.pool
+    assert users[2] not in service.pool and users[3] not in service.pool
+
+def test_sweep_with_nothing_idle_does_not_notify(database, make_user):
+    add_match(database, make_user(1), make_user(2, Gender.FEMALE, Gender.MALE), idle_hours=23)
+    notified = []
+    async def on_ended(ended):
+        notified.extend(ended)
+    sweeper = InactiveMatchSweeper(MatchingService(database), on_ended, max_inactive_hours=24)
+    
+    assert asyncio.run(sweeper.sweep()) == 0
+    assert asyncio.run(sweeper.sweep()) == 0
+    
+    assert not notified
+    assert sweeper.stats()["sweeps"] == 2
@@ -0,0 +1,64 @@
+import pytest
+from utils import validate_bio, validate_message
+
+# The substring checks validate_bio and validate_message made before the rule file
+BASELINE_BIO_WORDS = ["hate", "kill", "die", "suicide", "drug"]
+BASELINE_MESSAGE_WORDS = ["hate", "kill", "die", "suicide"]
+
+def baseline_rejects(text, words):
+    text = text.lower()
+    return any(word in text for word in words)
+
+VIOLENT_OR_DRUG_TEXTS = [
+    "I will kill you",
+    "I love killing time",
+    "He KILLED it",
+    "serial killer documentaries",
+    "kills me every time",
+    "I hate you",
+    "so hateful",
+    "she hated mondays",
+    "I want to die",
+    "he died, she dies",
+    "suicide squad fan",
+    "suicides are tragic",
+    "into drugs",
+    "got drugged at a party",
+    "drug dealer",
+    "that's hate-speech",
+    "self-kill",
+]
+
+# Baseline rejected these only because a blocked word appears inside another word
+BENIGN_TEXTS = [
+    "I have many skills",
+    "on a diet",
+    "studied physics",
+    "soldier by profession",
+    "that would be overkill",
+    "diehard fan of jazz",
+    "whatever",
+]
+
+@pytest.mark.parametrize("text", VIOLENT_OR_DRUG_TEXTS)
+def test_violent_and_drug_bios_rejected_as_before(text):
+    assert baseline_rejects(text, BASELINE_BIO_WORDS)
+    assert validate_bio(text) == (False, None)
+
+@pytest.mark.parametrize("text", [text for text in VIOLENT_OR_DRUG_TEXTS if "drug" not in text.lower()])
+def test_violent_messages_rejected_as_before(text):
+    assert baseline_rejects(text, BASELINE_MESSAGE_WORDS)
+    assert validate_message(text) == (False, None)
+
+@pytest.mark.parametrize("text", ["he was murdered", "murder mystery night", "feeling suicidal"])
+def test_violence_baseline_missed_is_rejected(text):
+    assert validate_bio(text) == (False, None)
+    assert validate_message(text) == (False, None)
+
+@pytest.mark.parametrize("text", BENIGN_TEXTS)
+def test_words_containing_a_blocked_word_pass(text):
+    assert validate_bio(text) == (True, text)
+    assert validate_message(text) == (True, text)
+
+def test_messages_still_allow_drug_talk():
+    assert validate_message("drugs are bad") == (True, "drugs are bad")
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+from rate_limit import RateLimiter
+
+WINDOW = 60
+START = 600.0  # Start of a fixed window
+
+def hit(limiter, now, key="user"):
+    return asyncio.run(limiter.hit(key, now=now))
+
+def test_limit_within_one_window_and_single_warning():
+    limiter = RateLimiter("messages", 3, WINDOW, max_keys=100)
+    
+    assert all(hit(limiter, START + t) for t in (0, 1, 2))
+    first, second = hit(limiter, START + 3), hit(limiter, START + 4)
+    
+    assert not first and first.warn
+    assert not second and not second.warn
+    assert limiter.stats()["throttled_keys"] == 1
+
+def test_previous_window_still_counts_at_the_boundary():
+    limiter = RateLimiter("messages", 3, WINDOW, max_keys=100)
+    for t in (50, 55, 59):
+        assert hit(limiter, START + t)
+    
+    # At the boundary the previous window overlaps fully, so there is no room yet
+    decision = hit(limiter, START + WINDOW)
+    
+    assert not decision
+    assert decision.retry_after == pytest.approx(WINDOW / 3)
+
+@pytest.mark.parametrize("limit, hits", [(3, 3), (5, 4), (7, 7), (10, 9)])
+def test_retry_at_exactly_retry_after_is_allowed(limit, hits):
+    limiter = RateLimiter("messages", limit, WINDOW, max_keys=100)
+    for i in range(hits):
+        assert hit(limiter, START + i)
+    refused_at = START + WINDOW + 5
+    if hits < limit:
+        # Fill the new window up to the point of refusal
+        while hit(limiter, refused_at):
+            pass
+    
+    decision = hit(limiter, refused_at)
+    assert not decision
+    
+    assert hit(limiter, refused_at + decision.retry_after)
+
+def test_window_two_back_is_forgotten():
+    limiter = RateLimiter("messages", 2, WINDOW, max_keys=100)
+    hit(limiter, START)
+    hit(limiter, START + 1)
+    assert not hit(limiter, START + 2)
+    
+    assert hit(limiter, START + 2 * WINDOW)
+    assert hit(limiter, START + 2 * WINDOW)
+
+def test_keys_are_limited_independently():
+    limiter = RateLimiter("reports", 1, WINDOW, max_keys=100)
+    
+    assert hit(limiter, START, "a")
+    assert hit(limiter, START, "b")
+    assert not hit(limiter, START + 1, "a")
+
+def test_zero_limit_disables():
+    limiter = RateLimiter("messages", 0, WINDOW, max_keys=100)
+    
+    assert all(hit(limiter, START) for _ in range(50))
+    assert limiter.stats()["keys"] == 0
+
+def test_idle_keys_are_evicted_and_table_is_bounded():
+    limiter = RateLimiter("messages", 5, WINDOW, max_keys=3)
+    for i in range(3):
+        hit(limiter, START, f"old{i}")
+    
+    hit(limiter, START + 2 * WINDOW, "new")
+    assert list(limiter._windows) == ["new"]
+    
+    for i in range(5):
+        hit(limiter, START + 2 * WINDOW, f"more{i}")
+    assert len(limiter._windows) <= 3
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+from waiting_room import WaitingRoom
+
+def make_room(premium_weight=2):
+    matching_service = SimpleNamespace(pool=SimpleNamespace(version=0))
+    return WaitingRoom(matching_service, on_match=None, batch_mode=False, premium_weight=premium_weight)
+
+def test_positions_follow_the_weighted_service_order():
+    room = make_room()
+    for user_id in (1, 2, 3):
+        room.join(user_id, f"t{user_id}")
+    for user_id in (4, 5, 6):
+        room.join(user_id, f"t{user_id}", priority=True)
+    
+    # Two premium users per free user
+    assert [room.position(f"t{user_id}") for user_id in (4, 5, 1, 6, 2, 3)] == [1, 2, 3, 4, 5, 6]
+
+def test_order_is_cached_until_the_queue_changes():
+    room = make_room()
+    room.join(1, "t1")
+    room.join(2, "t2")
+    order = room._service_order()
+    room.position("t2")
+    assert room._service_order() is order
+    
+    room.join(3, "t3", priority=True)
+    assert room.position("t2") == 3
+    assert room.position("t3") == 1
+    
+    room.leave("t3")
+    assert room.position("t2") == 2
+    
+    room.matched_users(1)
+    assert room.position("t2") == 1
+    assert room.position("t1") is None
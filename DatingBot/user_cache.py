@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import joinedload
+from config import Config
+from models import User
+
+logger = logging.getLogger(__name__)
+
+class _Snapshot:
+    """Read-only record; fields are set once in __init__"""
+    __slots__ = ()
+    
+    def _set(self, source, fields):
+        for field in fields:
+            object.__setattr__(self, field, getattr(source, field))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+class ProfileSnapshot(_Snapshot):
+    __slots__ = ("age", "gender", "looking_for", "min_age", "max_age", "city", "bio", "interests", "interest_ids")
+    
+    def __init__(self, profile):
+        self._set(profile, self.__slots__)
+
+class UserSnapshot(_Snapshot):
+    """The User columns handlers read, plus the profile, detached from any session.
+    
+    gender_views_used is left out on purpose: it changes on every match
+    notice, which reads it from the database.
+    """
+    __slots__ = ("id", "telegram_id", "username", "first_name", "status", "is_registered",
+                 "subscription_type", "premium_expires_at", "profile")
+    
+    def __init__(self, user):
+        self._set(user, self.__slots__[:-1])
+        object.__setattr__(self, "profile", ProfileSnapshot(user.profile) if user.profile else None)
+
+class UserCache:
+    """Read-through LRU cache of UserSnapshots keyed by telegram_id.
+    
+    Entries expire after ttl_seconds, which bounds staleness from changes made
+    elsewhere (another process, manual edits). Code that changes a user's
+    profile, subscription or status calls invalidate() or put().
+    """
+
+    def __init__(self, max_size=None, ttl_seconds=None):
+        self.max_size = max_size or Config.USER_CACHE_SIZE
+        self.ttl = ttl_seconds or Config.USER_CACHE_TTL_SECONDS
+        self._entries = OrderedDict()  # telegram_id -> (UserSnapshot, expires_at)
+        self._lock = threading.Lock()
+        self._generation = 0  # Bumped by invalidate(), so a load racing it isn't cached
+        
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, telegram_id):
+        """The cached snapshot, or None on a miss"""
+        telegram_id = str(telegram_id)
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            snapshot, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[telegram_id]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return snapshot
+    
+    def load(self, session, telegram_id):
+        """The user's snapshot, from the cache or else the database (None if there is no such user)"""
+        snapshot = self.get(telegram_id)
+        if snapshot is not None:
+            return snapshot
+        return self.fetch(session, telegram_id)
+    
+    def fetch(self, session, telegram_id):
+        """Load the user from the database and cache them, without looking in the cache first"""
+        generation = self._generation
+        user = session.query(User).options(joinedload(User.profile)).filter_by(telegram_id=str(telegram_id)).first()
+        return self.put(user, generation) if user else None
+    
+    def put(self, user, generation=None):
+        """Cache a snapshot of a freshly loaded or just-committed User (profile loaded); returns it"""
+        snapshot = UserSnapshot(user)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return snapshot  # Invalidated while loading; may already be stale
+            self._entries[snapshot.telegram_id] = (snapshot, time.monotonic() + self.ttl)
+            self._entries.move_to_end(snapshot.telegram_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return snapshot
+    
+    def invalidate(self, telegram_id):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(str(telegram_id), None) is not None:
+                self.invalidations += 1
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "expired": self.expired,
+            "invalidations": self.invalidations,
+        }
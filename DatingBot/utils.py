@@ -4,6 +4,11 @@ import hashlib
 import re
 from datetime import datetime, timezone
 from config import Config
+from moderation import get_engine
+
+# Moderation categories that reject a bio or message in the validators below
+BIO_BLOCKED_CATEGORIES = ("violence", "drugs")
+MESSAGE_BLOCKED_CATEGORIES = ("violence",)
 
 def generate_anonymous_id(length=None):
     """Generate a random anonymous ID for users"""
@@ -31,12 +36,9 @@ def validate_bio(bio):
     if len(bio) > Config.MAX_BIO_LENGTH:
         return False, None
     
-    # Check for inappropriate content (basic check)
-    inappropriate_words = ["hate", "kill", "die", "suicide", "drug"]  # Extend as needed
-    bio_lower = bio.lower()
-    for word in inappropriate_words:
-        if word in bio_lower:
-            return False, None
+    # Check for inappropriate content (rules in moderation_rules.txt)
+    if get_engine().check(bio, BIO_BLOCKED_CATEGORIES):
+        return False, None
     
     return True, bio
 
@@ -87,12 +89,9 @@ def validate_message(message):
     if len(message) > Config.MAX_MESSAGE_LENGTH:
         return False, None
     
-    # Basic inappropriate content check
-    inappropriate_words = ["hate", "kill", "die", "suicide"]  # Extend as needed
-    message_lower = message.lower()
-    for word in inappropriate_words:
-        if word in message_lower:
-            return False, None
+    # Basic inappropriate content check (rules in moderation_rules.txt)
+    if get_engine().check(message, MESSAGE_BLOCKED_CATEGORIES):
+        return False, None
     
     return True, message
 
@@ -100,6 +99,12 @@ def hash_user_id(telegram_id):
     """Create a hash of telegram ID for privacy"""
     return hashlib.sha256(str(telegram_id).encode()).hexdigest()[:10]
 
+def as_utc(dt):
+    """Timezone-aware UTC datetime; DateTime columns come back naive but are stored in UTC"""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
 def format_datetime(dt):
     """Format datetime for display"""
     if not dt:
@@ -144,14 +149,14 @@ def generate_match_summary(user_profile, partner_profile):
         compatibility_points.append("Similar age range")
     
     # Same city
-    if (user_profile.city and partner_profile.city and 
-        user_profile.city.lower() == partner_profile.city.lower()):
+    if user_profile.city_key and user_profile.city_key == partner_profile.city_key:
         compatibility_points.append(f"Both from {user_profile.city}")
     
     # Common interests
     if user_profile.interests and partner_profile.interests:
-        user_interests = set(i.strip().lower() for i in user_profile.interests.split(','))
-        partner_interests = set(i.strip().lower() for i in partner_profile.interests.split(','))
+        from interests import tokenize
+        user_interests = tokenize(user_profile.interests)
+        partner_interests = tokenize(partner_profile.interests)
         common = user_interests.intersection(partner_interests)
         
         if common:
@@ -167,27 +172,8 @@ def generate_match_summary(user_profile, partner_profile):
 
 def is_appropriate_content(text):
     """Check if content is appropriate"""
-    if not text:
-        return True
-    
-    text_lower = text.lower()
-    
-    # List of inappropriate words/phrases (extend as needed)
-    inappropriate_patterns = [
-        r'\b(hate|kill|die|suicide)\b',
-        r'\b(fuck|shit|damn)\b',  # Profanity
-        r'\b(drug|weed|cocaine)\b',  # Drug references
-        r'\b(sex|nude|naked)\b',  # Sexual content
-        r'(instagram|telegram|whatsapp|phone|number)',  # Contact sharing attempts
-        r'(\d{10,})',  # Phone numbers
-        r'(@\w+)',  # Social media handles
-    ]
-    
-    for pattern in inappropriate_patterns:
-        if re.search(pattern, text_lower):
-            return False
-    
-    return True
+    # Every category in moderation_rules.txt, in one pass
+    return get_engine().check(text) is None
 
 def get_safety_tips():
     """Get random safety tip for users"""
@@ -225,7 +211,7 @@ def can_see_gender(user, db_session=None):
     # Premium users can always see gender
     if user.subscription_type == SubscriptionType.PREMIUM:
         # Check if premium is still valid
-        if user.premium_expires_at and user.premium_expires_at > datetime.now(timezone.utc):
+        if user.premium_expires_at and as_utc(user.premium_expires_at) > datetime.now(timezone.utc):
             return True, "Premium active"
         else:
             # Premium expired, revert to free
@@ -249,6 +235,16 @@ def increment_gender_view(user, db_session):
         user.gender_views_used += 1
         db_session.commit()
 
+def has_priority_matching(user):
+    """Owners and users with an unexpired premium subscription get the priority matching lane"""
+    from models import SubscriptionType
+    
+    if user.subscription_type == SubscriptionType.OWNER or is_owner(user):
+        return True
+    if user.subscription_type == SubscriptionType.PREMIUM and user.premium_expires_at:
+        return as_utc(user.premium_expires_at) > datetime.now(timezone.utc)
+    return False
+
 def is_owner(user):
     """Check if user is the bot owner"""
     return int(user.telegram_id) in Config.OWNER_IDS
@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+TIERS = ("premium", "free")
+
+class _Waiting:
+    __slots__ = ("user_id", "telegram_id", "joined_at", "attempted_version", "priority")
+    
+    def __init__(self, user_id, telegram_id, joined_at, priority=False):
+        self.user_id = user_id
+        self.telegram_id = telegram_id
+        self.joined_at = joined_at
+        self.attempted_version = -1  # Pool version of the last match attempt
+        self.priority = priority
+    
+    @property
+    def tier(self):
+        return "premium" if self.priority else "free"
+
+class WaitingRoom:
+    """Users who asked for a match while nobody compatible was free.
+    
+    A background task on the update loop retries queued users (oldest first)
+    whenever the matching pool gains users, and calls on_match(user_id, match)
+    when one is paired. Queue status is answered from memory, so a user
+    repeating /match costs no database work. Users who wait longer than the
+    timeout are dropped and told via on_expire(telegram_id).
+    
+    In batch mode a round every interval seconds pairs the whole queue at
+    once (MatchingService.match_batch) instead of retrying users one by one;
+    joining doesn't trigger a round.
+    
+    Premium users wait in a priority lane. Users are served weighted-fair:
+    premium_weight premium users, then one free user, each lane oldest first,
+    so premium users get first pick of candidates while free users still
+    get a turn in every pass.
+    """
+
+    def __init__(self, matching_service, on_match, on_expire=None, interval=None, timeout_minutes=None,
+                 batch_mode=None, premium_weight=None):
+        self.matching_service = matching_service
+        self.on_match = on_match
+        self.on_expire = on_expire
+        self.interval = interval or Config.MATCH_QUEUE_INTERVAL_SECONDS
+        self.timeout = (timeout_minutes or Config.MATCH_QUEUE_TIMEOUT_MINUTES) * 60
+        self.batch_mode = Config.MATCH_BATCH_MODE if batch_mode is None else batch_mode
+        self.premium_weight = max(1, premium_weight or Config.PREMIUM_LANE_WEIGHT)
+        
+        self._queue = OrderedDict()  # user_id -> _Waiting, in join order
+        self._by_telegram_id = {}
+        self._order = None  # Cached _service_order() and user_id -> position; reset when the queue changes
+        self._positions = None
+        self._recent_waits = {tier: deque(maxlen=100) for tier in TIERS}
+        self._task = None
+        self._wakeup = None
+        self._stopping = False
+        
+        self.joined = 0
+        self.matched = {tier: 0 for tier in TIERS}
+        self.expired = 0
+        self.status_checks = 0
+        
+        # Batch rounds
+        self._last_round_state = None  # (pool version, joined) of the last round
+        self.rounds = 0
+        self.round_pairs = 0
+        self.last_round_pairs = 0
+        self.last_round_ms = None
+    
+    def __len__(self):
+        return len(self._queue)
+    
+    async def start(self):
+        if not self._task:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+    
+    async def close(self):
+        if self._task:
+            # If a /match joins in the same tick as this cancel, wait_for returns on the
+            # wakeup and the cancel is lost; _run() stops on this flag in that case
+            self._stopping = True
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    def position(self, telegram_id):
+        """1-based position in serving order, or None if the user isn't waiting"""
+        waiting = self._by_telegram_id.get(str(telegram_id))
+        if not waiting:
+            return None
+        self.status_checks += 1
+        if self._positions is None:
+            self._positions = {queued.user_id: position for position, queued in enumerate(self._service_order(), 1)}
+        return self._positions[waiting.user_id]
+    
+    def tier(self, telegram_id):
+        waiting = self._by_telegram_id.get(str(telegram_id))
+        return waiting.tier if waiting else None
+    
+    def _service_order(self):
+        """Queued users in the order they are served: premium_weight premium users per free user"""
+        if self._order is None:
+            self._order = self._build_service_order()
+        return self._order
+    
+    def _queue_changed(self):
+        self._order = None
+        self._positions = None
+    
+    def _build_service_order(self):
+        premium = [waiting for waiting in self._queue.values() if waiting.priority]
+        free = [waiting for waiting in self._queue.values() if not waiting.priority]
+        if not premium or not free:
+            return premium or free
+        
+        order = []
+        next_premium = next_free = 0
+        while next_premium < len(premium) or next_free < len(free):
+            order.extend(premium[next_premium:next_premium + self.premium_weight])
+            next_premium += self.premium_weight
+            if next_free < len(free):
+                order.append(free[next_free])
+                next_free += 1
+        return order
+    
+    def join(self, user_id, telegram_id, priority=False):
+        """Queue a user in the premium or free lane; returns their position"""
+        telegram_id = str(telegram_id)
+        if user_id not in self._queue:
+            waiting = _Waiting(user_id, telegram_id, time.monotonic(), priority)
+            waiting.attempted_version = self.matching_service.pool.version  # The caller just tried
+            self._queue[user_id] = waiting
+            self._by_telegram_id[telegram_id] = waiting
+            self._queue_changed()
+            self.joined += 1
+            # Batch rounds run on the interval only: waking one per join would pair
+            # each arrival on the spot, the early-arrival bias batching is there to avoid
+            if self._wakeup and not self.batch_mode:
+                self._wakeup.set()
+        return self.position(telegram_id)
+    
+    def leave(self, telegram_id):
+        """Take a user out of the queue; returns True if they were waiting"""
+        waiting = self._by_telegram_id.pop(str(telegram_id), None)
+        if not waiting:
+            return False
+        self._queue.pop(waiting.user_id, None)
+        self._queue_changed()
+        return True
+    
+    def matched_users(self, *user_ids):
+        """Drop users who got a match, recording how long they waited"""
+        now = time.monotonic()
+        for user_id in user_ids:
+            waiting = self._queue.pop(user_id, None)
+            if waiting:
+                self._by_telegram_id.pop(waiting.telegram_id, None)
+                self._queue_changed()
+                self._recent_waits[waiting.tier].append(now - waiting.joined_at)
+                self.matched[waiting.tier] += 1
+    
+    def expected_wait(self, tier=None):
+        """Average wait of recently matched users (of one tier), in seconds (None until there is one)"""
+        # Also called from the metrics thread while the loop appends; read copies
+        waits = list(self._recent_waits[tier]) if tier else [wait for tier in TIERS for wait in list(self._recent_waits[tier])]
+        if not waits:
+            return None
+        return sum(waits) / len(waits)
+    
+    async def _run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            
+            try:
+                await self._expire()
+                if self.batch_mode:
+                    await self.match_batch()
+                else:
+                    await self.match_waiting()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in waiting room matcher: {e}")
+    
+    async def _expire(self):
+        deadline = time.monotonic() - self.timeout
+        while self._queue:
+            waiting = next(iter(self._queue.values()))
+            if waiting.joined_at > deadline:
+                break
+            self.leave(waiting.telegram_id)
+            self.expired += 1
+            if self.on_expire:
+                await self.on_expire(waiting.telegram_id)
+    
+    async def match_waiting(self):
+        """Try to pair queued users in serving order. Returns the number of matches made."""
+        pool = self.matching_service.pool
+        made = 0
+        
+        for waiting in self._service_order():
+            if waiting.user_id not in self._queue:
+                continue  # Paired earlier in this pass
+            
+            # Nothing changed in the pool since this user's last attempt
+            version = pool.version
+            if waiting.attempted_version == version:
+                continue
+            waiting.attempted_version = version
+            
+            # A queued user missing from the pool was matched elsewhere or is no longer active
+            entry = pool.get(waiting.user_id)
+            if entry is None:
+                self.leave(waiting.telegram_id)
+                continue
+            
+            # Cheap in-memory check before going to the database
+            if not pool.candidates(entry, {waiting.user_id}):
+                continue
+            
+            match = await self.matching_service.find_match(waiting.user_id, waiting.priority)
+            if match:
+                self.matched_users(match.user1_id, match.user2_id)
+                made += 1
+                await self.on_match(waiting.user_id, match)
+        
+        return made
+    
+    async def match_batch(self):
+        """Run one batch round over everyone waiting. Returns the number of matches made."""
+        pool = self.matching_service.pool
+        
+        # A round can only find something new if someone joined or the pool gained users
+        state = (pool.version, self.joined)
+        if not self._queue or state == self._last_round_state:
+            return 0
+        self._last_round_state = state
+        
+        # Queued users missing from the pool were matched elsewhere or are no longer active
+        for waiting in list(self._queue.values()):
+            if waiting.user_id not in pool:
+                self.leave(waiting.telegram_id)
+        
+        started = time.perf_counter()
+        # Serving order breaks score ties, so premium users win equally good partners
+        matches = await self.matching_service.match_batch([waiting.user_id for waiting in self._service_order()])
+        self.rounds += 1
+        self.last_round_ms = (time.perf_counter() - started) * 1000
+        self.last_round_pairs = len(matches)
+        self.round_pairs += len(matches)
+        
+        for match in matches:
+            self.matched_users(match.user1_id, match.user2_id)
+            await self.on_match(match.user1_id, match)
+        return len(matches)
+    
+    def _tier_stats(self, tier, queue):
+        now = time.monotonic()
+        waiting = [now - queued.joined_at for queued in queue if queued.tier == tier]
+        recent = sorted(self._recent_waits[tier])
+        expected_wait = self.expected_wait(tier)
+        return {
+            "waiting": len(waiting),
+            "matched": self.matched[tier],
+            "longest_wait_s": round(max(waiting), 1) if waiting else None,
+            "expected_wait_s": round(expected_wait, 1) if expected_wait is not None else None,
+            "p95_wait_s": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1) if recent else None,
+        }
+    
+    def stats(self):
+        # Runs on the metrics thread while the loop changes the queue; work from a snapshot
+        queue = list(self._queue.values())
+        expected_wait = self.expected_wait()
+        return {
+            "waiting": len(queue),
+            "joined": self.joined,
+            "matched": sum(self.matched.values()),
+            "expired": self.expired,
+            "status_checks": self.status_checks,
+            "expected_wait_s": round(expected_wait, 1) if expected_wait is not None else None,
+            "by_tier": {tier: self._tier_stats(tier, queue) for tier in TIERS},
+            "batch_mode": self.batch_mode,
+            "batch_rounds": self.rounds,
+            "batch_pairs": self.round_pairs,
+            "last_round_pairs": self.last_round_pairs,
+            "last_round_ms": round(self.last_round_ms, 1) if self.last_round_ms is not None else None,
+        }